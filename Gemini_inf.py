@@ -4,9 +4,12 @@ This script processes text data and generates emotion predictions using Gemini m
 It supports both language-specific and country-specific evaluations.
 """
 
-import google.generativeai as genai
-from inference_utils import process_file, write_json
-import os
+from client_utils import gemini_request_options, get_client
+from providers import RunConfig, run_evaluation
+from generation_utils import GenerationConfig, gemini_params, gemini_usage
+from inference_utils import default_stream_path
+from telemetry_utils import record_usage
+import sys
 
 
 # Configuration for the evaluation
@@ -16,23 +19,39 @@ LANG = None     # "English", "Arabic", "Spanish", "German", "Amharic", "Hindi",
 COUNTRY = "Mexico"      # "Ethiopia", "United Arab Emirates", "Germany", "India", "Mexico", None
 MODEL_NAME = "gemini-1.5-flash"
 OUTPUT_JSON_PATH = "gemini1.5_flash/countries/mex-eng_gemini1.5_flash.json"
+# Results are streamed here while running so an interrupted run resumes where it stopped (under .cache/streams/)
+STREAM_PATH = default_stream_path(OUTPUT_JSON_PATH)
+# Send requests concurrently instead of one row at a time
+ASYNC_MODE = True
+CONCURRENCY = 16    # Maximum number of requests in flight
+# Reuse responses from earlier runs; in replay mode uncached prompts raise instead of calling the API
+CACHE_PATH = ".cache/responses.sqlite"
+CACHE_REPLAY = False
+# Per-request trace (JSONL), Prometheus metrics and a progress bar are written here; None disables telemetry
+TELEMETRY_DIR = "telemetry"
+# Every record is also written to this results store (see results_store.py); None disables it
+RESULTS_DB = "results.sqlite"
+# Hedge slow requests and fail over to other routes (see hedging_utils); None sends every request once
+HEDGE = None        # e.g. hedging_utils.HedgePolicy(percentile=0.95, deadline=60)
+HEDGE_ROUTES = []   # Other "provider:model" routes, e.g. "anthropic:claude-3-5-sonnet-20240620"
+# Rows asked per request; above 1, numbered questions are packed into one prompt (see inference_utils.pack_prompt)
+PACK_SIZE = 1
+# Output token cap, stop sequences and structured (label-constrained) answers; see generation_utils.py
+GENERATION = GenerationConfig(max_tokens=16, structured=False).for_pack(PACK_SIZE)
+CACHE_PARAMS = GENERATION.cache_params()
 
-# Get API key from environment variable
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("Please set the GOOGLE_API_KEY environment variable")
+# The SDK reads the API key from GOOGLE_API_KEY when the first model is created (checked by check_credentials
+# when a run starts); call genai.configure before that to use another key or endpoint
 
-# Initialize Gemini API
-genai.configure(api_key=API_KEY)
 
-
-def get_prediction(model_name: str, prompt: str) -> tuple[str, str]:
+def get_prediction(model_name: str, prompt: str, generation: GenerationConfig = GENERATION) -> tuple[str, str]:
     """
     Gets a prediction from the Gemini model.
     
     Args:
         model_name (str): Name of the Gemini model to use (e.g., "gemini-1.5-flash")
         prompt (str): The prompt to send to the model
+        generation (GenerationConfig): Output limits and answer format of the run
         
     Returns:
         tuple[str, str]: A tuple containing (prompt, model_response)
@@ -41,23 +60,42 @@ def get_prediction(model_name: str, prompt: str) -> tuple[str, str]:
         The model is configured to return a single emotion word from the allowed set:
         'anger', 'fear', 'sadness', 'joy', 'guilt', or 'neutral'
     """
-    model = genai.GenerativeModel(model_name)
-    response = model.generate_content(prompt)
+    model = get_client("gemini", model_name)
+    response = model.generate_content(prompt, generation_config=gemini_params(generation, prompt),
+                                      request_options=gemini_request_options())
+    record_usage(*gemini_usage(response))
     return prompt, response.text
 
 
-if __name__ == "__main__":
-    # Process the TSV file and generate predictions
-    output_data = process_file(
-        tsv_file=TSV_FILE_PATH,
-        model=MODEL_NAME,
-        get_prediction=get_prediction,
-        language=LANG,
-        country=COUNTRY
-    )
-    
-    # Save the results to a JSON file
-    # The output JSON will contain:
-    write_json(output_data, OUTPUT_JSON_PATH)
+async def get_prediction_async(model_name: str, prompt: str,
+                               generation: GenerationConfig = GENERATION) -> tuple[str, str]:
+    """
+    Async version of get_prediction using generate_content_async.
+    """
+    model = get_client("gemini", model_name, async_client=True)
+    response = await model.generate_content_async(prompt, generation_config=gemini_params(generation, prompt),
+                                                  request_options=gemini_request_options())
+    record_usage(*gemini_usage(response))
+    return prompt, response.text
 
 
+def run_config() -> RunConfig:
+    """
+    Returns the run config set by the constants above.
+    """
+    return RunConfig(tsv_file=TSV_FILE_PATH, model=MODEL_NAME, output_path=OUTPUT_JSON_PATH, language=LANG,
+                     country=COUNTRY, stream_path=STREAM_PATH, async_mode=ASYNC_MODE, concurrency=CONCURRENCY,
+                     cache_path=CACHE_PATH, cache_replay=CACHE_REPLAY, telemetry_dir=TELEMETRY_DIR,
+                     results_db=RESULTS_DB, hedge=HEDGE, hedge_routes=tuple(HEDGE_ROUTES), pack_size=PACK_SIZE,
+                     generation=GENERATION)
+
+
+def main() -> list[dict]:
+    """
+    Runs the evaluation configured by the constants above and returns the records.
+    """
+    return run_evaluation("gemini", run_config(), sys.modules[__name__])
+
+
+if __name__ == "__main__":
+    main()
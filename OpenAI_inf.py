@@ -4,9 +4,13 @@ This script processes text data and generates emotion predictions using GPT mode
 It supports both language-specific and country-specific evaluations.
 """
 
-from inference_utils import process_file, write_json
-from openai import OpenAI
+from client_utils import get_client
+from providers import RunConfig, run_evaluation
+from generation_utils import GenerationConfig, openai_answer, openai_params, openai_scored, openai_usage
+from inference_utils import default_stream_path
+from telemetry_utils import record_usage
 import os
+import sys
 
 
 # Configuration for the evaluation
@@ -16,23 +20,40 @@ LANG = "English"     # "English", "Arabic", "Spanish", "German", "Amharic", "Hin
 COUNTRY = None      # "Ethiopia", "United Arab Emirates", "Germany", "India", "Mexico", None
 MODEL_NAME = "gpt-4"
 OUTPUT_JSON_PATH = "gpt4_outputs/eng_gpt-4.json"
+# Results are streamed here while running so an interrupted run resumes where it stopped (under .cache/streams/)
+STREAM_PATH = default_stream_path(OUTPUT_JSON_PATH)
+# Send requests concurrently instead of one row at a time
+ASYNC_MODE = True
+CONCURRENCY = 16    # Maximum number of requests in flight
+# Reuse responses from earlier runs; in replay mode uncached prompts raise instead of calling the API
+CACHE_PATH = ".cache/responses.sqlite"
+CACHE_REPLAY = False
+# Per-request trace (JSONL), Prometheus metrics and a progress bar are written here; None disables telemetry
+TELEMETRY_DIR = "telemetry"
+# Every record is also written to this results store (see results_store.py); None disables it
+RESULTS_DB = "results.sqlite"
+# Hedge slow requests and fail over to other routes (see hedging_utils); None sends every request once
+HEDGE = None        # e.g. hedging_utils.HedgePolicy(percentile=0.95, deadline=60)
+HEDGE_ROUTES = []   # Other "provider:model" routes, e.g. "anthropic:claude-3-5-sonnet-20240620"
+# Rows asked per request; above 1, numbered questions are packed into one prompt (see inference_utils.pack_prompt)
+PACK_SIZE = 1
+# Output token cap, stop sequences and structured (label-constrained) answers; see generation_utils.py.
+# scoring=True asks for one token with its top logprobs and stores the label distribution in the records
+GENERATION = GenerationConfig(max_tokens=16, structured=False, scoring=False).for_pack(PACK_SIZE)
+CACHE_PARAMS = GENERATION.cache_params()
 
-# Get API key from environment variable
+# Checked by check_credentials when a run starts
 API_KEY = os.getenv("OPENAI_API_KEY")
-if not API_KEY:
-    raise ValueError("Please set the OPENAI_API_KEY environment variable")
 
-# Initialize OpenAI client
-client = OpenAI(api_key=API_KEY)
 
-
-def get_prediction(model: str, prompt: str) -> tuple[str, str]:
+def get_prediction(model: str, prompt: str, generation: GenerationConfig = GENERATION) -> tuple[str, str]:
     """
     Gets a prediction from the GPT model.
     
     Args:
         model (str): Name of the GPT model to use (e.g., "gpt-4")
         prompt (str): The prompt to send to the model
+        generation (GenerationConfig): Output limits and answer format of the run
         
     Returns:
         tuple[str, str]: A tuple containing (prompt, model_response)
@@ -41,27 +62,53 @@ def get_prediction(model: str, prompt: str) -> tuple[str, str]:
         The model is configured to return a single emotion word from the allowed set:
         'anger', 'fear', 'sadness', 'joy', 'guilt', or 'neutral'
     """
+    client = get_client("openai", api_key=API_KEY)
     completion = client.chat.completions.create(
         model=model,
         messages=[
             {"role": "user", "content": prompt}
-        ]
+        ],
+        **openai_params(generation, prompt)
     )
-    prediction = completion.choices[0].message.content
+    record_usage(*openai_usage(completion))
+    prediction = openai_scored(completion, prompt) if generation.scoring else openai_answer(completion)
     return prompt, prediction
 
 
-if __name__ == "__main__":
-    # Process the TSV file and generate predictions
-    output_data = process_file(
-        tsv_file=TSV_FILE_PATH,
-        model=MODEL_NAME,
-        get_prediction=get_prediction,
-        language=LANG,
-        country=COUNTRY
+async def get_prediction_async(model: str, prompt: str, generation: GenerationConfig = GENERATION) -> tuple[str, str]:
+    """
+    Async version of get_prediction using the AsyncOpenAI client of the running event loop.
+    """
+    async_client = get_client("openai", async_client=True, api_key=API_KEY)
+    completion = await async_client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "user", "content": prompt}
+        ],
+        **openai_params(generation, prompt)
     )
-    
-    # Save the results to a JSON file
-    write_json(output_data, OUTPUT_JSON_PATH)
+    record_usage(*openai_usage(completion))
+    prediction = openai_scored(completion, prompt) if generation.scoring else openai_answer(completion)
+    return prompt, prediction
 
 
+def run_config() -> RunConfig:
+    """
+    Returns the run config set by the constants above.
+    """
+    return RunConfig(tsv_file=TSV_FILE_PATH, model=MODEL_NAME, output_path=OUTPUT_JSON_PATH, language=LANG,
+                     country=COUNTRY, stream_path=STREAM_PATH, async_mode=ASYNC_MODE, concurrency=CONCURRENCY,
+                     cache_path=CACHE_PATH, cache_replay=CACHE_REPLAY, telemetry_dir=TELEMETRY_DIR,
+                     results_db=RESULTS_DB, hedge=HEDGE, hedge_routes=tuple(HEDGE_ROUTES), pack_size=PACK_SIZE,
+                     generation=GENERATION)
+
+
+def main() -> list[dict]:
+    """
+    Runs the evaluation configured by the constants above and returns the records.
+    """
+    return run_evaluation("openai", run_config(), sys.modules[__name__])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Script for adaptive (sequential) evaluation.
+Instead of running every row of a language/country cell, rows are asked in a random order stratified by gold
+emotion, a batch at a time, and the accuracy confidence intervals are updated after each batch. A cell stops as
+soon as its intervals are narrow enough or, when two models are compared, as soon as the paired comparison is
+decided (one model is better, or both are within `margin` of each other). The report lists how many calls
+were saved compared with a full run.
+
+Every batch is a "look" at the data, so each look uses a Bonferroni-adjusted confidence level
+(1 - (1 - confidence) / number of possible looks); the overall error rate of a cell's stopping decision thus
+stays at or below 1 - confidence.
+
+Usage:
+    python adaptive_eval.py --models openai anthropic:claude-3-5-sonnet-20240620 --languages English Arabic
+                            [--countries Mexico] [--target-width 0.1] [--margin 0.03] [--batch-size 40]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+from dataclasses import dataclass, field
+from statistics import NormalDist
+import numpy as np
+from cache_utils import DEFAULT_CACHE_PATH, ResponseCache, cached_async
+from dataset_utils import load_dataset
+from eval import to_label_ids
+from inference_utils import (COUNTRY_CODES, LANGUAGE_CODES, get_prompt, process_file_async, prompt_variant,
+                             read_jsonl)
+from label_utils import INVALID_ID
+from providers import load_provider
+from scheduler_utils import Scheduler, scheduled_async
+from sweep import DATA_DIR, DEFAULT_CONCURRENCY
+
+
+OUTPUT_DIR = "adaptive_outputs"
+REPORT_PATH = "adaptive_report.json"
+
+
+@dataclass(frozen=True)
+class StoppingRule:
+    """
+    When an adaptive cell stops.
+
+    Args:
+        confidence (float): Overall confidence level of the intervals and the stopping decision
+        target_width (float): A single model's cell stops once its accuracy interval is at most this wide
+        margin (float): Two models whose accuracy difference is within +-margin count as equivalent
+        batch_size (int): Rows asked between two looks at the intervals
+        min_rows (int): Rows asked before the first look
+    """
+    confidence: float = 0.95
+    target_width: float = 0.1
+    margin: float = 0.03
+    batch_size: int = 40
+    min_rows: int = 80
+
+    def look_confidence(self, total_rows: int) -> float:
+        """
+        Returns the per-look confidence level for a cell of total_rows rows (Bonferroni over all possible looks).
+        """
+        looks = 1 + max(0, math.ceil((total_rows - self.min_rows) / self.batch_size))
+        return 1 - (1 - self.confidence) / looks
+
+
+@dataclass
+class Arm:
+    """A model evaluated in the adaptive run, with the async get_prediction used to query it."""
+    provider: str
+    model: str
+    get_prediction: object = field(repr=False)
+    pack_size: int = 1
+
+
+def stratified_order(labels: list[str], seed: int = 0) -> list[int]:
+    """
+    Returns the row indices in a random order in which every prefix holds each label in about the same
+    proportion as the whole file.
+
+    Each row gets the position (k + u) / n_label, where k is its rank in a shuffle of its label's rows and u is
+    uniform in [0, 1); sorting by position interleaves the labels proportionally.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels, dtype=object).astype(str)
+    positions = np.empty(len(labels))
+    for label in np.unique(labels):
+        rows = rng.permutation(np.flatnonzero(labels == label))
+        positions[rows] = (np.arange(len(rows)) + rng.random(len(rows))) / len(rows)
+    return np.argsort(positions, kind="stable").tolist()
+
+
+def wilson_interval(correct: int, n: int, confidence: float = 0.95) -> tuple[float, float]:
+    """
+    Returns the Wilson score interval of an accuracy of correct / n.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = correct / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def paired_interval(a_correct: np.ndarray, b_correct: np.ndarray,
+                    confidence: float = 0.95) -> tuple[float, float, float]:
+    """
+    Returns the accuracy difference of two models on the same rows and its Agresti-Min interval
+    (a Wald interval with half a pseudo-count added to each cell of the paired 2x2 table, so it does not
+    collapse to zero width when the models have not disagreed yet).
+
+    Returns:
+        tuple[float, float, float]: (difference, low, high) of accuracy(a) - accuracy(b)
+    """
+    n = len(a_correct)
+    only_a = int(np.sum(a_correct & ~b_correct))
+    only_b = int(np.sum(~a_correct & b_correct))
+    difference = (only_a - only_b) / n if n else 0.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    n_adjusted = n + 2
+    p_a, p_b = (only_a + 0.5) / n_adjusted, (only_b + 0.5) / n_adjusted
+    adjusted = p_a - p_b
+    half_width = z * math.sqrt(max(p_a + p_b - adjusted ** 2, 0.0) / n_adjusted)
+    return difference, max(-1.0, adjusted - half_width), min(1.0, adjusted + half_width)
+
+
+def correctness(tsv_rows: dict[int, dict], rows: list[int]) -> np.ndarray:
+    """
+    Returns whether each of the given rows was answered correctly, from the records of a run.
+    """
+    records = [tsv_rows[row] for row in rows]
+    y_true = to_label_ids([record["emotion"] for record in records])
+    y_pred = to_label_ids([record["pred_emotion"] or "" for record in records])
+    return (y_true == y_pred) & (y_true != INVALID_ID)
+
+
+def decide(correct: list[np.ndarray], rule: StoppingRule, confidence: float) -> tuple[str, dict]:
+    """
+    Applies the stopping rule to the correctness arrays of the arms (on the same rows).
+
+    Returns:
+        tuple[str, dict]: The decision ("continue", "precise", "a_better", "b_better" or "equivalent") and
+            the current accuracies and intervals
+    """
+    n = len(correct[0])
+    intervals = [wilson_interval(int(c.sum()), n, confidence) for c in correct]
+    stats = {
+        "rows": n,
+        "accuracy": [round(float(c.mean()), 4) if n else 0.0 for c in correct],
+        "interval": [[round(low, 4), round(high, 4)] for low, high in intervals],
+    }
+    if len(correct) == 1:
+        low, high = intervals[0]
+        return ("precise" if high - low <= rule.target_width else "continue"), stats
+
+    difference, low, high = paired_interval(correct[0], correct[1], confidence)
+    stats["difference"] = round(difference, 4)
+    stats["difference_interval"] = [round(low, 4), round(high, 4)]
+    if low > 0:
+        return "a_better", stats
+    if high < 0:
+        return "b_better", stats
+    if -rule.margin < low and high < rule.margin:
+        return "equivalent", stats
+    return "continue", stats
+
+
+async def run_cell(tsv_file: str, arms: list[Arm], language: str = None, country: str = None,
+                   rule: StoppingRule = StoppingRule(), output_dir: str = OUTPUT_DIR, prompt_fn=get_prompt,
+                   concurrency: int = 8, seed: int = 0) -> dict:
+    """
+    Runs one language/country cell adaptively for one model or a pair of models.
+
+    The rows are asked in stratified_order, batch_size rows at a time for every arm, through process_file_async
+    with a JSONL stream per arm at output_dir/<provider>/<model>/<prompt variant>/<cell>.jsonl, so an interrupted
+    cell resumes from the rows already answered, and never from the answers of another provider or prompt.
+
+    Returns:
+        dict: The decision, accuracies and intervals at the stopping point and the rows and calls saved
+    """
+    if not 1 <= len(arms) <= 2:
+        raise ValueError("An adaptive cell compares one or two models")
+    parsed = load_dataset(tsv_file).rows(language, country)
+    order = stratified_order([gt_emotion for _, gt_emotion, _ in parsed], seed)
+    confidence = rule.look_confidence(len(order))
+    cell = language or country
+    variant = prompt_variant(prompt_fn, country)
+    stream_paths = [os.path.join(output_dir, arm.provider, arm.model.replace("/", "_"), variant, f"{cell}.jsonl")
+                    for arm in arms]
+
+    asked = min(rule.min_rows, len(order))
+    while True:
+        await asyncio.gather(*(
+            process_file_async(tsv_file, arm.model, arm.get_prediction, language, country, concurrency,
+                               output_path=path, prompt_fn=prompt_fn, pack_size=arm.pack_size, rows=order[:asked])
+            for arm, path in zip(arms, stream_paths)
+        ))
+        records = [read_jsonl(path) for path in stream_paths]
+        answered = [row for row in order[:asked] if all(row in r for r in records)]
+        decision, stats = decide([correctness(r, answered) for r in records], rule, confidence)
+        if decision != "continue" or asked >= len(order):
+            break
+        asked = min(asked + rule.batch_size, len(order))
+
+    skipped = len(order) - asked
+    return {
+        "cell": cell,
+        "models": [arm.model for arm in arms],
+        "decision": decision if decision != "continue" else "undecided",
+        "look_confidence": round(confidence, 5),
+        **stats,
+        "total_rows": len(order),
+        "rows_saved": skipped * len(arms),
+        "calls_saved": sum(math.ceil(skipped / arm.pack_size) for arm in arms),
+    }
+
+
+def make_arms(specs: list[str], cache: ResponseCache, concurrency: dict) -> list[Arm]:
+    """
+    Builds the arms from "provider" or "provider:model" strings, using each provider script's
+    get_prediction_async, generation settings and pack size behind the cache and a scheduler per provider.
+    """
+    schedulers = {}
+    arms = []
+    for spec in specs:
+        provider, _, model = spec.partition(":")
+        module = load_provider(provider)
+        if provider not in schedulers:
+            schedulers[provider] = Scheduler.for_provider(provider, max_concurrency=concurrency[provider],
+                                                          max_output_tokens=module.GENERATION.token_cap)
+        get_prediction = cached_async(scheduled_async(module.get_prediction_async, schedulers[provider]), cache,
+                                      provider, params=module.CACHE_PARAMS)
+        arms.append(Arm(provider, model or module.MODEL_NAME, get_prediction, module.PACK_SIZE))
+    return arms
+
+
+async def run_adaptive(arms: list[Arm], languages: list[str], countries: list[str], rule: StoppingRule,
+                       output_dir: str = OUTPUT_DIR, concurrency: int = 8, seed: int = 0,
+                       data_dir: str = DATA_DIR) -> list[dict]:
+    """
+    Runs all cells in parallel and returns their reports.
+    """
+    cells = [(os.path.join(data_dir, f"{LANGUAGE_CODES[language]}.tsv"), language, None) for language in languages]
+    cells += [(os.path.join(data_dir, f"{COUNTRY_CODES[country][0]}.tsv"), None, country) for country in countries]
+    return await asyncio.gather(*(
+        run_cell(tsv_file, arms, language, country, rule, output_dir, concurrency=concurrency, seed=seed)
+        for tsv_file, language, country in cells
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate one model, or compare two, with early stopping")
+    parser.add_argument("--models", nargs="+", required=True,
+                        help="One or two 'provider' or 'provider:model' entries (default: the script's MODEL_NAME)")
+    parser.add_argument("--languages", nargs="*", default=[], choices=list(LANGUAGE_CODES))
+    parser.add_argument("--countries", nargs="*", default=[], choices=list(COUNTRY_CODES))
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--target-width", type=float, default=0.1, help="Accuracy interval width for one model")
+    parser.add_argument("--margin", type=float, default=0.03, help="Accuracy difference treated as equivalent")
+    parser.add_argument("--batch-size", type=int, default=40, help="Rows asked between looks")
+    parser.add_argument("--min-rows", type=int, default=80, help="Rows asked before the first look")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the stratified row order")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--report", default=REPORT_PATH)
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Path of the response cache")
+    args = parser.parse_args()
+
+    rule = StoppingRule(args.confidence, args.target_width, args.margin, args.batch_size, args.min_rows)
+    cache = ResponseCache(args.cache)
+    arms = make_arms(args.models, cache, DEFAULT_CONCURRENCY)
+    concurrency = min(DEFAULT_CONCURRENCY[arm.provider] for arm in arms)
+    report = asyncio.run(run_adaptive(arms, args.languages, args.countries, rule, args.output_dir, concurrency,
+                                      args.seed))
+    cache.close()
+
+    print(f"{'cell':<22} {'decision':<11} {'rows':>5} {'accuracy':<16} {'saved calls':>11}")
+    for entry in report:
+        accuracy = " / ".join(f"{a:.3f}" for a in entry["accuracy"])
+        print(f"{entry['cell']:<22} {entry['decision']:<11} {entry['rows']:>5} {accuracy:<16} "
+              f"{entry['calls_saved']:>11}")
+    total = sum(entry["total_rows"] for entry in report) * len(arms)
+    print(f"Calls saved: {sum(entry['calls_saved'] for entry in report)} "
+          f"(rows saved: {sum(entry['rows_saved'] for entry in report)} of {total})")
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"Report written to {args.report}")
@@ -0,0 +1,229 @@
+"""
+Script for running inference through the provider batch APIs.
+This script turns a TSV file into an OpenAI Batch API or Anthropic Message Batches request file,
+submits it, waits for the batch to finish and maps the results back into the same records process_file produces.
+Batch requests are billed at about half the price of regular requests and have separate, much higher rate limits.
+"""
+
+import json
+import os
+import time
+from client_utils import get_client
+from dataset_utils import load_dataset
+from generation_utils import GenerationConfig, anthropic_answer, anthropic_params, openai_answer, openai_params
+from inference_utils import (JsonlWriter, completed_rows, default_stream_path, get_prompt, load_jsonl, make_record,
+                             write_json)
+
+
+# Configuration for the evaluation
+TSV_FILE_PATH = "data/test/spn.tsv"
+# Either LANG or COUNTRY must be set to None
+LANG = None     # "English", "Arabic", "Spanish", "German", "Amharic", "Hindi", None
+COUNTRY = "Mexico"      # "Ethiopia", "United Arab Emirates", "Germany", "India", "Mexico", None
+PROVIDER = "openai"     # "openai", "anthropic"
+MODEL_NAME = "gpt-4"
+OUTPUT_JSON_PATH = "gpt4_outputs/countries/mex-eng_gpt-4.json"
+# Rows are appended here as results arrive; rows already in it are not resubmitted
+STREAM_PATH = default_stream_path(OUTPUT_JSON_PATH)
+BATCH_DIR = "batches"   # Where the generated batch request files are kept
+BASE_URL = None         # e.g. "http://127.0.0.1:8765/v1" (OpenAI) or "http://127.0.0.1:8765" (Anthropic) for mock_server.py
+POLL_INTERVAL = 30      # Seconds between status checks
+BATCH_MAX_RETRIES = 2   # SDK retries of the upload and status calls, which do not go through a Scheduler
+
+# Output token cap, stop sequences and structured answers, as in the regular inference scripts
+GENERATION = GenerationConfig(max_tokens=16, structured=False)
+
+OPENAI_DONE_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_requests(provider: str, model: str, tsv_file: str, language: str = None, country: str = None,
+                         skip_rows: set[int] = frozenset(), generation: GenerationConfig = GENERATION) -> list[dict]:
+    """
+    Builds one batch request per TSV row in the provider's batch format.
+
+    Args:
+        provider (str): "openai" or "anthropic"
+        model (str): Name of the model to use for predictions
+        tsv_file (str): Path to the TSV file containing the evaluation data
+        language (str, optional): Language to use for prompts
+        country (str, optional): Country context to use for prompts
+        skip_rows (set[int]): Row indices that already have results
+        generation (GenerationConfig): Output limits and answer format
+
+    Returns:
+        list[dict]: Batch requests whose custom_id is "row-<index>"
+    """
+    requests = []
+    for index, (text, _, _) in enumerate(load_dataset(tsv_file).rows(language, country)):
+        if index in skip_rows:
+            continue
+        prompt = get_prompt(language, country, text)
+        body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        if provider == "openai":
+            body.update(openai_params(generation, prompt))
+            requests.append({"custom_id": f"row-{index}", "method": "POST", "url": "/v1/chat/completions", "body": body})
+        elif provider == "anthropic":
+            body.update(anthropic_params(generation, prompt))
+            requests.append({"custom_id": f"row-{index}", "params": body})
+        else:
+            raise ValueError(f"Batch mode is not supported for provider '{provider}'")
+    return requests
+
+
+def write_batch_file(requests: list[dict], path: str) -> None:
+    """
+    Writes batch requests to a JSONL file.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+
+def make_client(provider: str, base_url: str = None):
+    """
+    Returns the shared SDK client for the given provider.
+    """
+    if provider == "openai":
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key and not base_url:
+            raise ValueError("Please set the OPENAI_API_KEY environment variable")
+        return get_client("openai", endpoint=base_url, api_key=api_key or "mock", max_retries=BATCH_MAX_RETRIES)
+    if provider == "anthropic":
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key and not base_url:
+            raise ValueError("Please set the ANTHROPIC_API_KEY environment variable")
+        return get_client("anthropic", endpoint=base_url, api_key=api_key or "mock",
+                          max_retries=BATCH_MAX_RETRIES)
+    raise ValueError(f"Batch mode is not supported for provider '{provider}'")
+
+
+def parse_openai_output(lines: list[str]) -> dict[str, str]:
+    """
+    Extracts the model responses from the lines of an OpenAI batch output file.
+
+    Returns:
+        dict[str, str]: Mapping from custom_id to model response for the succeeded requests
+    """
+    predictions = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if response.get("status_code") == 200:
+            predictions[entry["custom_id"]] = openai_answer(response["body"])
+    return predictions
+
+
+def run_openai_batch(client, batch_file: str, poll_interval: float = POLL_INTERVAL) -> dict[str, str]:
+    """
+    Uploads a batch file to the OpenAI Batch API, waits for it to finish and downloads the results.
+
+    Returns:
+        dict[str, str]: Mapping from custom_id to model response
+    """
+    with open(batch_file, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions", completion_window="24h")
+    print(f"Submitted batch {batch.id}")
+
+    while batch.status not in OPENAI_DONE_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status} {batch.request_counts}")
+
+    if not batch.output_file_id:
+        print(f"Batch {batch.id} finished with status '{batch.status}' and no output")
+        return {}
+    return parse_openai_output(client.files.content(batch.output_file_id).text.splitlines())
+
+
+def run_anthropic_batch(client, requests: list[dict], poll_interval: float = POLL_INTERVAL) -> dict[str, str]:
+    """
+    Submits requests to the Anthropic Message Batches API, waits for it to finish and collects the results.
+
+    Returns:
+        dict[str, str]: Mapping from custom_id to model response
+    """
+    batch = client.messages.batches.create(requests=requests)
+    print(f"Submitted batch {batch.id}")
+
+    while batch.processing_status != "ended":
+        time.sleep(poll_interval)
+        batch = client.messages.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.processing_status} {batch.request_counts}")
+
+    predictions = {}
+    for entry in client.messages.batches.results(batch.id):
+        if entry.result.type == "succeeded":
+            predictions[entry.custom_id] = anthropic_answer(entry.result.message)
+    return predictions
+
+
+def process_file_batch(tsv_file: str, model: str, provider: str, output_path: str, language: str = None,
+                       country: str = None, client=None, batch_dir: str = BATCH_DIR,
+                       poll_interval: float = POLL_INTERVAL) -> list[dict]:
+    """
+    Batch-API counterpart of process_file.
+
+    Rows that fail in the batch are left out of output_path, so running process_file (or this function)
+    again with the same output_path only retries those rows.
+
+    Args:
+        tsv_file (str): Path to the TSV file containing the evaluation data
+        model (str): Name of the model to use for predictions
+        provider (str): "openai" or "anthropic"
+        output_path (str): JSONL file the results are appended to
+        language (str, optional): Language to use for prompts
+        country (str, optional): Country context to use for prompts
+        client (optional): SDK client; created with make_client if not given
+        batch_dir (str): Directory where the batch request file is written
+        poll_interval (float): Seconds between status checks
+
+    Returns:
+        list[dict]: List of dictionaries containing the evaluation results, in the original row order
+    """
+    client = client or make_client(provider)
+    requests = build_batch_requests(provider, model, tsv_file, language, country, completed_rows(output_path))
+    if not requests:
+        return load_jsonl(output_path)
+
+    name = os.path.splitext(os.path.basename(output_path))[0]
+    batch_file = os.path.join(batch_dir, f"{name}_{provider}_batch.jsonl")
+    write_batch_file(requests, batch_file)
+    print(f"Wrote {len(requests)} requests to {batch_file}")
+
+    if provider == "openai":
+        predictions = run_openai_batch(client, batch_file, poll_interval)
+    else:
+        predictions = run_anthropic_batch(client, requests, poll_interval)
+
+    rows = load_dataset(tsv_file).rows(language, country)
+    with JsonlWriter(output_path) as writer:
+        for custom_id, pred_emotion in predictions.items():
+            index = int(custom_id.split("-")[1])
+            text, gt_emotion, _ = rows[index]
+            prompt = get_prompt(language, country, text)
+            writer.write({"row": index, **make_record(prompt, text, gt_emotion, pred_emotion, model, language, country)})
+
+    missing = len(requests) - len(predictions)
+    if missing:
+        print(f"{missing} requests failed; rerun to retry them")
+    return load_jsonl(output_path)
+
+
+if __name__ == "__main__":
+    output_data = process_file_batch(
+        tsv_file=TSV_FILE_PATH,
+        model=MODEL_NAME,
+        provider=PROVIDER,
+        output_path=STREAM_PATH,
+        language=LANG,
+        country=COUNTRY,
+        client=make_client(PROVIDER, BASE_URL)
+    )
+
+    # Save the results to a JSON file
+    write_json(output_data, OUTPUT_JSON_PATH)
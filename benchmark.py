@@ -0,0 +1,269 @@
+"""
+Offline benchmark of the inference pipeline.
+Starts mock_server.py with a simulated latency and error profile, points the provider SDKs at it and runs
+process_file end to end over the data/test files in each execution mode, reporting items/sec, request latency
+percentiles and peak RSS. No API credits are used. Results are saved to benchmark_results/ so runs of different
+versions can be compared.
+
+Usage:
+    python benchmark.py [--providers openai ollama] [--modes sync async packed hedged] [--files data/test/eng.tsv]
+                        [--latency-ms 20] [--error-rate 0.01] [--stall-rate 0.01] [--burst-every 10 --burst-length 1]
+                        [--compare benchmark_results/<earlier run>.json]
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import io
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+import urllib.request
+import numpy as np
+from mock_server import FaultProfile, start_server
+from providers import load_provider
+
+
+PROVIDERS = ("openai", "anthropic", "gemini", "ollama")
+MODES = ("sync", "async", "packed", "hedged")
+DEFAULT_FILES = ["data/test/eng.tsv"]
+RESULTS_DIR = "benchmark_results"
+PACK_SIZE = 8
+
+
+def point_sdks_at(url: str) -> None:
+    """
+    Makes the provider scripts talk to the mock server: the SDKs read their base URL from the environment.
+    """
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    os.environ["ANTHROPIC_API_KEY"] = "mock"
+    os.environ["ANTHROPIC_BASE_URL"] = url
+    os.environ["GOOGLE_API_KEY"] = "mock"
+    os.environ["OLLAMA_HOST"] = url
+
+
+def language_of(tsv_file: str) -> str:
+    """
+    Returns the prompt language of a data/test file from its file code (e.g. "amh.tsv" -> "Amharic").
+    """
+    from inference_utils import LANGUAGE_CODES
+    code = os.path.splitext(os.path.basename(tsv_file))[0]
+    for language, language_code in LANGUAGE_CODES.items():
+        if language_code == code:
+            return language
+    raise ValueError(f"No prompt language for {tsv_file}")
+
+
+def timed(get_prediction, latencies: list[float]):
+    @functools.wraps(get_prediction)
+    def wrapper(model: str, prompt: str):
+        start = time.perf_counter()
+        result = get_prediction(model, prompt)
+        latencies.append(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def timed_async(get_prediction, latencies: list[float]):
+    @functools.wraps(get_prediction)
+    async def wrapper(model: str, prompt: str):
+        start = time.perf_counter()
+        result = await get_prediction(model, prompt)
+        latencies.append(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def run_case(provider: str, mode: str, files: list[str], url: str, pack_size: int = PACK_SIZE,
+             concurrency: int = None, quotas: bool = False) -> dict:
+    """
+    Runs one (provider, mode) case; meant to run in a fresh process so peak RSS is per case.
+
+    Args:
+        provider (str): Provider whose script is benchmarked
+        mode (str): "sync" (process_file), "async" (process_file_async), "packed" (async with pack_size) or
+            "hedged" (async with hedging_utils' default policy, hedges duplicating the request)
+        files (list[str]): TSV files to process
+        url (str): Base URL of the mock server
+        pack_size (int): Rows per request in packed mode
+        concurrency (int, optional): Requests in flight; defaults to the script's CONCURRENCY
+        quotas (bool): Enforce the provider's requests/min and tokens/min quotas (PROVIDER_LIMITS)
+
+    Returns:
+        dict: Throughput, latency percentiles (of scheduled calls, retries included; per row in hedged mode)
+            and peak RSS
+    """
+    point_sdks_at(url)
+    from hedging_utils import Hedger, hedged_async
+    from inference_utils import process_file, process_file_async
+    from label_utils import INVALID_ID, normalize_label
+    from scheduler_utils import Scheduler, scheduled, scheduled_async
+
+    module = load_provider(provider)
+    note = None
+    if provider == "gemini":
+        import google.generativeai as genai
+        genai.configure(api_key="mock", transport="rest", client_options={"api_endpoint": url})
+    generation = module.GENERATION.for_pack(pack_size) if mode == "packed" else module.GENERATION
+    concurrency = concurrency or module.CONCURRENCY
+    limits = {} if quotas else {"requests_per_minute": None, "tokens_per_minute": None}
+    scheduler = Scheduler.for_provider(provider, max_concurrency=concurrency,
+                                       max_output_tokens=generation.token_cap, **limits)
+
+    get_prediction = functools.partial(module.get_prediction, generation=generation)
+    get_prediction_async = functools.partial(module.get_prediction_async, generation=generation)
+    if provider == "gemini" and mode != "sync":
+        # generate_content_async is broken over REST in google-generativeai 0.8, so async runs use threads
+        get_prediction_async = functools.partial(asyncio.to_thread, get_prediction)
+        note = "async via threads"
+
+    hedger = Hedger() if mode == "hedged" else None
+    latencies = []
+    records = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tsv_file in files:
+            language = language_of(tsv_file)
+            if mode == "sync":
+                records += process_file(tsv_file, module.MODEL_NAME, timed(scheduled(get_prediction, scheduler),
+                                                                         latencies), language)
+            else:
+                records += asyncio.run(process_file_async(
+                    tsv_file, module.MODEL_NAME,
+                    timed_async(hedged_async(scheduled_async(get_prediction_async, scheduler), hedger, provider),
+                                latencies),
+                    language, concurrency=concurrency, pack_size=pack_size if mode == "packed" else 1))
+    elapsed = time.perf_counter() - start
+
+    latency_ms = np.array(latencies) * 1000
+    valid = sum(normalize_label(record["pred_emotion"] or "") != INVALID_ID for record in records)
+    return {
+        "provider": provider,
+        "mode": mode,
+        "note": note,
+        "items": len(records),
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "items_per_sec": round(len(records) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latency_ms, 50)), 2),
+            "p95": round(float(np.percentile(latency_ms, 95)), 2),
+            "p99": round(float(np.percentile(latency_ms, 99)), 2),
+            "mean": round(float(latency_ms.mean()), 2),
+        } if len(latency_ms) else None,
+        "valid_rate": round(valid / len(records), 4) if records else 0.0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **scheduler.stats(),
+        **({"hedging": hedger.stats()} if hedger else {}),
+    }
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    """
+    Prints the change in items/sec and p95 latency of each case against an earlier results file.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["provider"], r["mode"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline['version']}):")
+    for result in results:
+        before = previous.get((result["provider"], result["mode"]))
+        if not before:
+            continue
+        speedup = result["items_per_sec"] / before["items_per_sec"] - 1 if before["items_per_sec"] else 0.0
+        line = f"  {result['provider']:<10} {result['mode']:<7} items/sec {speedup:+.1%}"
+        if result["latency_ms"] and before["latency_ms"]:
+            line += f", p95 {result['latency_ms']['p95'] - before['latency_ms']['p95']:+.1f} ms"
+        print(line)
+
+
+def run_benchmark(providers: list[str], modes: list[str], files: list[str], faults: FaultProfile,
+                  pack_size: int = PACK_SIZE, concurrency: int = None, quotas: bool = False,
+                  results_dir: str = RESULTS_DIR) -> dict:
+    """
+    Runs every (provider, mode) case against one mock server and saves the results.
+
+    Returns:
+        dict: The saved results, with the version and configuration of the run
+    """
+    server = start_server(faults=faults)
+    url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    context = multiprocessing.get_context("spawn")
+    results = []
+    server_stats = None
+    print(f"{'provider':<10} {'mode':<7} {'items':>6} {'reqs':>6} {'items/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'RSS MB':>7} {'retries':>7}")
+    try:
+        for provider in providers:
+            for mode in modes:
+                # A fresh process per case, so peak RSS and SDK state are not shared between cases
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_case, provider, mode, files, url, pack_size, concurrency,
+                                             quotas).result()
+                results.append(result)
+                latency = result["latency_ms"] or {"p50": 0, "p95": 0, "p99": 0}
+                print(f"{provider:<10} {mode:<7} {result['items']:>6} {result['requests']:>6} "
+                      f"{result['items_per_sec']:>9.1f} {latency['p50']:>8.1f} {latency['p95']:>8.1f} "
+                      f"{latency['p99']:>8.1f} {result['peak_rss_mb']:>7.1f} {result['retries']:>7}"
+                      + (f"  ({result['note']})" if result["note"] else ""))
+        with contextlib.suppress(OSError):
+            server_stats = json.loads(urllib.request.urlopen(f"{url}/mock/stats").read())
+    finally:
+        server.shutdown()
+
+    version = git_version()
+    report = {
+        "version": version,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"files": files, "pack_size": pack_size, "concurrency": concurrency, "quotas": quotas},
+        "server": server_stats,
+        "results": results,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{version}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {path}")
+    return {**report, "path": path}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the inference pipeline against a local mock server")
+    parser.add_argument("--providers", nargs="+", choices=PROVIDERS, default=list(PROVIDERS))
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--files", nargs="+", default=DEFAULT_FILES, help="data/test TSV files to process")
+    parser.add_argument("--pack-size", type=int, default=PACK_SIZE, help="Rows per request in packed mode")
+    parser.add_argument("--concurrency", type=int, help="Requests in flight (default: each script's CONCURRENCY)")
+    parser.add_argument("--quotas", action="store_true", help="Enforce the provider quotas of PROVIDER_LIMITS")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Median simulated latency")
+    parser.add_argument("--latency-distribution", choices=["fixed", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500/503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--stall-seconds", type=float, default=5.0, help="How long a stalled request hangs")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="Seconds between 429 bursts")
+    parser.add_argument("--burst-length", type=float, default=0.0, help="Seconds each 429 burst lasts")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    faults = FaultProfile(latency_ms=args.latency_ms, latency_distribution=args.latency_distribution,
+                          error_rate=args.error_rate, stall_rate=args.stall_rate, stall_seconds=args.stall_seconds,
+                          burst_every=args.burst_every, burst_length=args.burst_length)
+    report = run_benchmark(args.providers, args.modes, args.files, faults, args.pack_size, args.concurrency,
+                           args.quotas)
+    if args.compare:
+        compare(report["results"], args.compare)
@@ -0,0 +1,224 @@
+"""
+On-disk response cache for the get_prediction functions of the inference scripts.
+Responses are stored in SQLite and keyed by a hash of the provider, model, prompt and generation parameters,
+so reruns only pay for the prompts that actually changed.
+"""
+
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from telemetry_utils import annotate
+
+
+DEFAULT_CACHE_PATH = ".cache/responses.sqlite"
+
+# Whether the response of the request made in the current thread or asyncio task may be stored by cached
+_cacheable = contextvars.ContextVar("cacheable", default=True)
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a prompt has no cached response."""
+
+
+def make_key(provider: str, model: str, prompt: str, params: dict = None) -> str:
+    """
+    Computes the content address of a request.
+
+    Args:
+        provider (str): Provider name (e.g., "openai", "anthropic", "gemini", "ollama")
+        model (str): Name of the model
+        prompt (str): The prompt sent to the model
+        params (dict, optional): Generation parameters that influence the response
+
+    Returns:
+        str: Hex SHA-256 digest identifying the request
+    """
+    payload = json.dumps([provider, model, prompt, params or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of model responses with size- and age-based eviction.
+
+    Args:
+        path (str): Path of the SQLite database file
+        max_entries (int, optional): Keep at most this many entries (least recently used are evicted first)
+        max_age_days (float, optional): Drop entries older than this many days
+        replay (bool): If True, never call the model; misses raise CacheMissError and nothing is written
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = None, max_age_days: float = None,
+                 replay: bool = False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )"""
+        )
+        self._conn.commit()
+        if not replay:
+            self.evict()
+
+    def get(self, key: str):
+        """Returns the cached response for key, or None if it is not cached."""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.replay:
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str, provider: str = None, model: str = None) -> None:
+        """Stores a response. Does nothing in replay mode."""
+        if self.replay:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, now, now),
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """
+        Applies the age and size limits.
+
+        Returns:
+            int: Number of evicted entries
+        """
+        evicted = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                evicted += self._conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_entries is not None:
+                evicted += self._conn.execute(
+                    """DELETE FROM responses WHERE key NOT IN (
+                        SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?
+                    )""",
+                    (self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        return evicted
+
+    def __contains__(self, key: str) -> bool:
+        """Checks whether key is cached, without counting a hit or miss."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters of this session."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        if not self.replay:
+            self.evict()
+        self._conn.close()
+
+
+def skip_cache() -> None:
+    """
+    Keeps the response of the current request out of the cache of the enclosing cached wrapper, because it did not
+    come from the provider and model of the cache key (e.g. a hedge or failover route answered, see hedging_utils).
+    """
+    _cacheable.set(False)
+
+
+def cached(get_prediction, cache: ResponseCache, provider: str, params: dict = None):
+    """
+    Wraps a get_prediction function so that responses are served from and stored in the cache.
+
+    Args:
+        get_prediction (callable): Function with signature (model, prompt) -> (prompt, response)
+        cache (ResponseCache): Cache to use
+        provider (str): Provider name, part of the cache key
+        params (dict, optional): Generation parameters used by get_prediction, part of the cache key
+
+    Responses get_prediction marks with skip_cache are returned but not stored.
+
+    Returns:
+        callable: Function with the same signature as get_prediction
+    """
+    @functools.wraps(get_prediction)
+    def wrapper(model: str, prompt: str) -> tuple[str, str]:
+        key = make_key(provider, model, prompt, params)
+        response = cache.get(key)
+        if response is not None:
+            annotate(cache="hit")
+            return prompt, response
+        annotate(cache="miss")
+        if cache.replay:
+            raise CacheMissError(f"No cached response for {provider}/{model} prompt: {prompt[:80]!r}")
+        token = _cacheable.set(True)
+        try:
+            prompt, response = get_prediction(model, prompt)
+            if _cacheable.get():
+                cache.put(key, response, provider, model)
+        finally:
+            _cacheable.reset(token)
+        return prompt, response
+
+    return wrapper
+
+
+def cached_async(get_prediction, cache: ResponseCache, provider: str, params: dict = None):
+    """
+    Async version of cached for coroutine get_prediction functions.
+    """
+    @functools.wraps(get_prediction)
+    async def wrapper(model: str, prompt: str) -> tuple[str, str]:
+        key = make_key(provider, model, prompt, params)
+        response = cache.get(key)
+        if response is not None:
+            annotate(cache="hit")
+            return prompt, response
+        annotate(cache="miss")
+        if cache.replay:
+            raise CacheMissError(f"No cached response for {provider}/{model} prompt: {prompt[:80]!r}")
+        token = _cacheable.set(True)
+        try:
+            prompt, response = await get_prediction(model, prompt)
+            if _cacheable.get():
+                cache.put(key, response, provider, model)
+        finally:
+            _cacheable.reset(token)
+        return prompt, response
+
+    return wrapper
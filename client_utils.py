@@ -0,0 +1,211 @@
+"""
+Registry of long-lived provider clients.
+Creating an SDK client (or a Gemini GenerativeModel) per request repeats the connection setup and TLS handshake for
+every row, which dominates the latency of one-word answers. The registry creates one connection-pooled client per
+(provider, model, endpoint) and hands the same instance to every caller: sync clients are shared across threads,
+async clients are shared by all tasks of an event loop (they cannot be used from another loop).
+"""
+
+import asyncio
+import importlib.util
+import threading
+import weakref
+from dataclasses import dataclass
+from telemetry_utils import mark_response
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    """
+    Connection pool settings of the HTTP clients created by the registry.
+
+    Args:
+        max_connections (int): Maximum number of open connections per client
+        max_keepalive_connections (int): Idle connections kept open for reuse
+        keepalive_expiry (float): Seconds an idle connection is kept open
+        timeout (float): Request timeout in seconds
+        http2 (bool): Use HTTP/2 where the provider supports it (requires the h2 package)
+
+    Gemini only uses the timeout, passed with every request (see gemini_request_options); its connections are
+    managed by the google-generativeai SDK, so the connection limits, keep-alive and http2 do not apply.
+    """
+    max_connections: int = 64
+    max_keepalive_connections: int = 32
+    keepalive_expiry: float = 30.0
+    timeout: float = 60.0
+    http2: bool = importlib.util.find_spec("h2") is not None
+
+    def limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+
+def _on_response(response) -> None:
+    mark_response(response.status_code)
+
+
+async def _on_response_async(response) -> None:
+    mark_response(response.status_code)
+
+
+def _event_hooks(async_client: bool) -> dict:
+    # Response hooks feed the time to first byte and HTTP errors to telemetry
+    return {"response": [_on_response_async if async_client else _on_response]}
+
+
+def _make_openai(model: str, endpoint: str, async_client: bool, config: PoolConfig, options: dict):
+    import openai
+    http_client_cls = openai.DefaultAsyncHttpxClient if async_client else openai.DefaultHttpxClient
+    client_cls = openai.AsyncOpenAI if async_client else openai.OpenAI
+    # Retries are left to scheduler_utils.Scheduler, so that throttling reaches its concurrency control and the
+    # two retry layers do not multiply; pass max_retries to clients not used through a scheduler
+    options = {"max_retries": 0, **options}
+    http_client = http_client_cls(limits=config.limits(), timeout=config.timeout, http2=config.http2,
+                                  event_hooks=_event_hooks(async_client))
+    return client_cls(base_url=endpoint, timeout=config.timeout, http_client=http_client, **options)
+
+
+def _make_anthropic(model: str, endpoint: str, async_client: bool, config: PoolConfig, options: dict):
+    import anthropic
+    http_client_cls = anthropic.DefaultAsyncHttpxClient if async_client else anthropic.DefaultHttpxClient
+    client_cls = anthropic.AsyncAnthropic if async_client else anthropic.Anthropic
+    options = {"max_retries": 0, **options}  # See _make_openai
+    http_client = http_client_cls(limits=config.limits(), timeout=config.timeout, http2=config.http2,
+                                  event_hooks=_event_hooks(async_client))
+    return client_cls(base_url=endpoint, timeout=config.timeout, http_client=http_client, **options)
+
+
+def _make_gemini(model: str, endpoint: str, async_client: bool, config: PoolConfig, options: dict):
+    # The API key and endpoint are set once with genai.configure; the gRPC channel behind it is shared. The SDK
+    # takes no pool settings, and the timeout is a per-request option (gemini_request_options)
+    import google.generativeai as genai
+    return genai.GenerativeModel(model, **options)
+
+
+def _make_ollama(model: str, endpoint: str, async_client: bool, config: PoolConfig, options: dict):
+    import ollama
+    client_cls = ollama.AsyncClient if async_client else ollama.Client
+    return client_cls(host=endpoint, timeout=config.timeout, limits=config.limits(), http2=config.http2,
+                      event_hooks=_event_hooks(async_client), **options)
+
+
+def _make_transformers(model: str, endpoint: str, async_client: bool, config: PoolConfig, options: dict):
+    # Not an HTTP client but a local model; the registry makes sure it is loaded only once
+    from hf_utils import LocalGenerator
+    return LocalGenerator(model, **options)
+
+
+# Factory for each provider, called as factory(model, endpoint, async_client, config, options)
+CLIENT_FACTORIES = {
+    "openai": _make_openai,
+    "anthropic": _make_anthropic,
+    "gemini": _make_gemini,
+    "ollama": _make_ollama,
+    "transformers": _make_transformers,
+}
+# Providers whose client is bound to one model
+PER_MODEL_PROVIDERS = {"gemini", "transformers"}
+
+
+class ClientRegistry:
+    """
+    Creates provider clients on first use and returns the same instance afterwards.
+
+    Args:
+        config (PoolConfig, optional): Connection pool settings for the clients created from now on
+    """
+
+    def __init__(self, config: PoolConfig = None):
+        self.config = config or PoolConfig()
+        self._lock = threading.Lock()
+        self._clients = {}
+        # Async clients are bound to the event loop they were first used on; they go away with their loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.created = 0
+
+    def get(self, provider: str, model: str = None, endpoint: str = None, async_client: bool = False, **options):
+        """
+        Returns the shared client for (provider, model, endpoint).
+
+        Args:
+            provider (str): "openai", "anthropic", "gemini", "ollama" or "transformers"
+            model (str, optional): Model name; only needed for providers whose client is per model
+                (PER_MODEL_PROVIDERS)
+            endpoint (str, optional): Base URL or host; None uses the SDK default
+            async_client (bool): Return the async client of the running event loop
+            **options: Extra constructor arguments (e.g. api_key); part of the registry key
+
+        Raises:
+            ValueError: If the provider is unknown
+        """
+        if provider not in CLIENT_FACTORIES:
+            raise ValueError(f"Unknown provider '{provider}'")
+        if provider not in PER_MODEL_PROVIDERS:
+            model = None
+        key = (provider, model, endpoint, tuple(sorted(options.items())))
+
+        with self._lock:
+            if async_client:
+                clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+            else:
+                clients = self._clients
+            client = clients.get(key)
+            if client is None:
+                client = CLIENT_FACTORIES[provider](model, endpoint, async_client, self.config, options)
+                clients[key] = client
+                self.created += 1
+            return client
+
+    def close(self) -> None:
+        """
+        Closes the sync clients; later calls to get create new ones.
+        """
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            if hasattr(client, "close"):
+                client.close()
+
+    async def aclose(self) -> None:
+        """
+        Closes the async clients of the running event loop.
+        """
+        with self._lock:
+            clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            if hasattr(client, "close"):
+                await client.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "created": self.created,
+                "sync_clients": len(self._clients),
+                "async_clients": sum(len(clients) for clients in self._async_clients.values()),
+            }
+
+
+registry = ClientRegistry()
+
+
+def configure_pool(**settings) -> None:
+    """
+    Changes the pool settings (see PoolConfig) of the shared registry. Only clients created afterwards are affected.
+    """
+    registry.config = PoolConfig(**settings)
+
+
+def gemini_request_options() -> dict:
+    """
+    Returns the request_options of Gemini generate_content calls: the timeout of the pool settings.
+    """
+    return {"timeout": registry.config.timeout}
+
+
+def get_client(provider: str, model: str = None, endpoint: str = None, async_client: bool = False, **options):
+    """
+    Returns the shared client of the given provider from the module-level registry (see ClientRegistry.get).
+    """
+    return registry.get(provider, model, endpoint, async_client, **options)
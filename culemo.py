@@ -0,0 +1,172 @@
+"""
+Command-line entry point for running CuLEmo evaluations with any provider.
+The run config is taken from the arguments instead of editing the constants of an inference script; the
+provider's script (see providers.py) is imported only when it is selected, and its SDK only when the first
+request is made, so startup stays fast.
+
+Usage:
+    python culemo.py run --provider openai --language English --output gpt4_outputs/eng_gpt-4.json
+    python culemo.py run --provider ollama --model llama3.2:1b --country Mexico --output out.json --pack-size 8
+    python culemo.py run --provider anthropic --language Amharic --output out.json --hedge-route openai:gpt-4o
+    python culemo.py providers
+    python culemo.py startup [--repeat 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from providers import PROVIDERS, load_provider, run_evaluation
+
+
+DATA_DIR = "data/test"
+# Import time of the CLI or of a provider script above which `culemo.py startup` reports a regression; creating
+# the first client also imports the provider's SDK, which is not counted against it
+STARTUP_BUDGET_MS = 500
+
+
+def default_tsv(language: str = None, country: str = None) -> str:
+    """
+    Returns the data file of a language or country (e.g. "Mexico" -> data/test/spn.tsv).
+    """
+    from inference_utils import COUNTRY_CODES, LANGUAGE_CODES
+    code = COUNTRY_CODES[country][0] if country else LANGUAGE_CODES[language]
+    return os.path.join(DATA_DIR, f"{code}.tsv")
+
+
+def run(args: argparse.Namespace) -> list[dict]:
+    """
+    Runs one evaluation: the run config of the provider's script (its run_config()) with the arguments applied,
+    through providers.run_evaluation.
+    """
+    from dataclasses import replace
+
+    module = load_provider(args.provider)
+    config = module.run_config()
+    # Scripts without PACK_SIZE (hf_inf) answer one row per prompt
+    pack_size = args.pack_size if args.pack_size is not None and hasattr(module, "PACK_SIZE") else config.pack_size
+    overrides = {"max_tokens": args.max_tokens, "temperature": args.temperature, "structured": args.structured,
+                 "scoring": args.scoring}
+    generation = replace(config.generation, **{k: v for k, v in overrides.items() if v is not None})
+    generation = generation.for_pack(pack_size)
+
+    settings = {
+        "tsv_file": args.file or default_tsv(args.language, args.country),
+        "language": args.language,
+        "country": args.country,
+        "model": args.model or config.model,
+        "output_path": args.output,
+        "stream_path": None,
+        "cache_path": args.cache or config.cache_path,
+        "cache_replay": args.replay,
+        "telemetry_dir": None if args.no_telemetry else args.telemetry_dir,
+        "results_db": None if args.no_results_db else args.results_db or config.results_db,
+        "generation": generation,
+        "pack_size": pack_size,
+        "async_mode": config.async_mode and not args.sync,
+        "concurrency": args.concurrency or config.concurrency,
+    }
+    if args.hedge or args.hedge_routes:
+        from hedging_utils import HedgePolicy
+        policy = {"percentile": args.hedge_percentile, "deadline": args.deadline, "max_hedge_rate": args.hedge_budget}
+        settings["hedge"] = HedgePolicy(**{k: v for k, v in policy.items() if v is not None})
+        settings["hedge_routes"] = tuple(args.hedge_routes)
+    return run_evaluation(args.provider, replace(config, **settings), module)
+
+
+def list_providers() -> None:
+    print(f"{'provider':<14} {'script':<16} {'API key':<20} {'set':>4}")
+    for provider in PROVIDERS.values():
+        key_set = "-" if not provider.env_var else ("yes" if os.getenv(provider.env_var) else "no")
+        print(f"{provider.name:<14} {provider.module + '.py':<16} {provider.env_var or '-':<20} {key_set:>4}")
+
+
+def time_command(code: str, repeat: int, env: dict = None) -> float:
+    """
+    Returns the median wall time in ms of running code in a fresh interpreter.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=env, capture_output=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def measure_startup(repeat: int = 5) -> dict[str, float]:
+    """
+    Measures, in fresh interpreters, the time to import the CLI and to get each provider ready (import its
+    script and create its client), minus the interpreter's own startup.
+
+    Returns:
+        dict[str, float]: Milliseconds per measured step
+    """
+    # Dummy credentials: creating a client does not send a request
+    env = {**os.environ, **{p.env_var: os.getenv(p.env_var) or "startup-check"
+                            for p in PROVIDERS.values() if p.env_var}}
+    baseline = time_command("pass", repeat, env)
+    targets = {"culemo": "import culemo"}
+    for name in PROVIDERS:
+        targets[f"{name} script"] = f"import providers; providers.load_provider({name!r})"
+        if name != "transformers":
+            # The registry ignores the model except for Gemini
+            targets[f"{name} client"] = (f"import providers, client_utils; providers.load_provider({name!r}); "
+                                         f"client_utils.get_client({name!r}, 'gemini-1.5-flash')")
+    return {name: round(time_command(code, repeat, env) - baseline, 1) for name, code in targets.items()}
+
+
+if __name__ == "__main__":
+    # Every provider script imports inference_utils too, so `run` does not start slower for it
+    from inference_utils import COUNTRY_CODES, LANGUAGE_CODES
+
+    parser = argparse.ArgumentParser(description="Run CuLEmo evaluations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run a model over one language or country")
+    run_parser.add_argument("--provider", required=True, choices=list(PROVIDERS))
+    run_parser.add_argument("--model", help="Model name (default: the provider script's MODEL_NAME)")
+    target = run_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--language", choices=list(LANGUAGE_CODES), help="Prompt language, e.g. English")
+    target.add_argument("--country", choices=list(COUNTRY_CODES),
+                        help="Country context (English prompts), e.g. Mexico")
+    run_parser.add_argument("--file", help="TSV file (default: the data/test file of the language or country)")
+    run_parser.add_argument("--output", required=True, help="Output JSON path; results stream to .cache/streams/<output>l")
+    run_parser.add_argument("--sync", action="store_true", help="Send one request at a time")
+    run_parser.add_argument("--concurrency", type=int, help="Requests in flight (default: the script's CONCURRENCY)")
+    run_parser.add_argument("--pack-size", type=int, help="Rows asked per request")
+    run_parser.add_argument("--max-tokens", type=int, help="Output token cap")
+    run_parser.add_argument("--temperature", type=float)
+    run_parser.add_argument("--structured", action="store_true", default=None,
+                            help="Constrain answers to the prompt's labels")
+    run_parser.add_argument("--scoring", action="store_true", default=None,
+                            help="Store the label distribution from the first token's logprobs")
+    run_parser.add_argument("--cache", help="Response cache path")
+    run_parser.add_argument("--replay", action="store_true", help="Only use cached responses")
+    run_parser.add_argument("--telemetry-dir", default="telemetry")
+    run_parser.add_argument("--no-telemetry", action="store_true")
+    run_parser.add_argument("--hedge", action="store_true", help="Hedge slow requests (see hedging_utils)")
+    run_parser.add_argument("--hedge-route", dest="hedge_routes", action="append", default=[],
+                            help="Equivalent provider:model route for hedges and failover (implies --hedge)")
+    run_parser.add_argument("--hedge-percentile", type=float, help="Latency percentile after which a request is hedged")
+    run_parser.add_argument("--hedge-budget", type=float, help="Maximum fraction of requests that are hedged")
+    run_parser.add_argument("--deadline", type=float, help="Seconds after which a hedged request fails")
+    run_parser.add_argument("--results-db", help="Results store the records are written to")
+    run_parser.add_argument("--no-results-db", action="store_true")
+
+    subparsers.add_parser("providers", help="List the providers and whether their API key is set")
+
+    startup_parser = subparsers.add_parser("startup", help="Measure the startup time of the CLI and each provider")
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif args.command == "providers":
+        list_providers()
+    else:
+        timings = measure_startup(args.repeat)
+        for name, ms in timings.items():
+            over_budget = not name.endswith(" client") and ms > STARTUP_BUDGET_MS
+            print(f"{name:<22} {ms:>8.1f} ms" + ("  (over budget)" if over_budget else ""))
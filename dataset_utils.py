@@ -0,0 +1,189 @@
+"""
+Columnar, memory-mapped cache of the benchmark TSV files.
+Each TSV file is converted once into a directory of NumPy arrays (a UTF-8 byte buffer plus per-column offsets)
+keyed by the SHA-256 of the file, so editing a TSV invalidates its cache automatically. All languages expose the
+same columns whatever the TSV layout (the 3-column eng.tsv or the 6-column files of the other languages):
+text, text_eng, emotion, emotion_eng, sentiment, sentiment_eng.
+"""
+
+import csv
+import functools
+import hashlib
+import json
+import os
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = ".cache/datasets"
+COLUMNS = ("text", "text_eng", "emotion", "emotion_eng", "sentiment", "sentiment_eng")
+
+# Position of each column in the TSV, by number of TSV columns
+TSV_LAYOUTS = {
+    3: {"text": 0, "text_eng": 0, "emotion": 1, "emotion_eng": 1, "sentiment": 2, "sentiment_eng": 2},
+    6: {"text": 1, "text_eng": 0, "emotion": 3, "emotion_eng": 2, "sentiment": 5, "sentiment_eng": 4},
+}
+
+
+def file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_columns(language: str = None, country: str = None) -> tuple[str, str, str]:
+    """
+    Returns the (text, emotion, sentiment) column names used for a language or country run.
+
+    Language runs use the text and labels in that language; country runs use the English text and labels.
+
+    Raises:
+        ValueError: If both or neither of language and country are given
+    """
+    if bool(language) == bool(country):
+        raise ValueError("Either 'language' or 'country' must be provided, but not both.")
+    if language:
+        return "text", "emotion", "sentiment"
+    return "text_eng", "emotion_eng", "sentiment_eng"
+
+
+class StringColumn:
+    """
+    Read-only view of a string column stored as a UTF-8 buffer and offsets.
+
+    Slicing returns another view over the same memory-mapped arrays without copying.
+    """
+
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("StringColumn only supports contiguous slices")
+            return StringColumn(self.buffer, self.offsets[start:max(start, stop) + 1])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_list(self) -> list[str]:
+        return list(self)
+
+
+class Dataset:
+    """
+    A cached TSV file: memory-mapped string columns plus a row index.
+
+    Args:
+        path (str): Cache directory of the dataset (see build_cache)
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.buffer = np.load(os.path.join(path, "data.npy"), mmap_mode="r")
+        # offsets[c, i] is where row i of column c starts in the buffer; it doubles as the row index
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.meta["n_rows"]
+
+    def column(self, name: str) -> StringColumn:
+        return StringColumn(self.buffer, self.offsets[COLUMNS.index(name)])
+
+    def __getitem__(self, name: str) -> StringColumn:
+        return self.column(name)
+
+    def shard(self, index: int, count: int) -> range:
+        """
+        Returns the row range of shard `index` out of `count` nearly equal contiguous shards.
+        """
+        bounds = np.linspace(0, len(self), count + 1).astype(int)
+        return range(bounds[index], bounds[index + 1])
+
+    def rows(self, language: str = None, country: str = None) -> list[tuple[str, str, str]]:
+        """
+        Returns (text, gt_emotion, gt_sentiment) for every row, for a language or country run.
+        """
+        return list(zip(*(self.column(name) for name in prompt_columns(language, country))))
+
+
+def build_cache(tsv_file: str, cache_path: str, digest: str) -> None:
+    """
+    Converts a TSV file into the columnar cache format.
+    """
+    with open(tsv_file, "r", encoding="utf-8") as file:
+        tsv_reader = csv.reader(file, delimiter="\t")
+        next(tsv_reader)  # Skip header row
+        rows = [row for row in tsv_reader if row]
+    width = len(rows[0]) if rows else 3
+    if width not in TSV_LAYOUTS:
+        raise ValueError(f"Unsupported TSV layout with {width} columns: {tsv_file}")
+    layout = TSV_LAYOUTS[width]
+
+    chunks = []
+    offsets = np.zeros((len(COLUMNS), len(rows) + 1), dtype=np.int64)
+    position = 0
+    for c, name in enumerate(COLUMNS):
+        offsets[c, 0] = position
+        for i, row in enumerate(rows):
+            encoded = row[layout[name]].encode("utf-8")
+            chunks.append(encoded)
+            position += len(encoded)
+            offsets[c, i + 1] = position
+
+    # Write to a temporary directory first so concurrent readers never see a partial cache
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, "data.npy"), np.frombuffer(b"".join(chunks), dtype=np.uint8))
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"source": tsv_file, "sha256": digest, "n_rows": len(rows), "tsv_columns": width,
+                   "columns": list(COLUMNS)}, f, indent=4)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Another process built the same cache in the meantime
+        for name in os.listdir(tmp_path):
+            os.remove(os.path.join(tmp_path, name))
+        os.rmdir(tmp_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _open_dataset(cache_path: str) -> Dataset:
+    return Dataset(cache_path)
+
+
+def load_dataset(tsv_file: str, cache_dir: str = DEFAULT_CACHE_DIR) -> Dataset:
+    """
+    Returns the cached columnar version of a TSV file, building it if the file changed or was never cached.
+
+    Args:
+        tsv_file (str): Path of the TSV file (e.g. "data/test/amh.tsv")
+        cache_dir (str): Directory holding the caches
+
+    Returns:
+        Dataset: Memory-mapped dataset
+    """
+    digest = file_hash(tsv_file)
+    stem = os.path.splitext(os.path.basename(tsv_file))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}-{digest[:16]}")
+    if not os.path.exists(os.path.join(cache_path, "meta.json")):
+        os.makedirs(cache_dir, exist_ok=True)
+        build_cache(tsv_file, cache_path, digest)
+    return _open_dataset(cache_path)
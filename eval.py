@@ -1,25 +1,54 @@
 """
 Script for evaluating model predictions against ground truth data.
 This script calculates accuracy and other metrics for emotion predictions.
+
+The evaluation engine loads many output files at once, maps gold labels and predictions to canonical label IDs
+and computes accuracy, per-class precision/recall/F1 and confusion matrices for all
+(model, language/country, prompt variant) cells in one vectorized pass. Outputs of scoring runs, which store a
+label distribution per record, also get log-loss, Brier score and expected calibration error.
+
+Usage:
+    python eval.py [output files or directories ...] [--report eval_report.json]
 """
 
+import argparse
+import glob
 import json
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support, classification_report
-from qa_metrics.em import em_match
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+import os
+from dataclasses import dataclass, field
+import numpy as np
+from label_utils import EMOTIONS, INVALID_ID, normalize_label
+
+
+# Output trees evaluated when no paths are given
+OUTPUT_DIRS = [
+    "gpt4_outputs",
+    "claude3_opus_outputs",
+    "claude3.5_sonnet_outputs",
+    "gemini1.5_flash",
+    "wo_country_pref_outputs",
+]
+REPORT_PATH = "eval_report.json"
+# Confidence bins of the expected calibration error
+CALIBRATION_BINS = 10
+# Probability floor for the log-loss, so a gold label with probability 0 costs a finite amount
+MIN_PROBABILITY = 1e-6
 
 
 def evaluate_predictions_binary(json_path: str) -> None:
     """
     Evaluates model predictions using binary accuracy (exact match).
-    
+
     Args:
         json_path (str): Path to the JSON file containing predictions and ground truth
-        
+
     The function prints:
         - Individual prediction results
         - Overall accuracy score
     """
+    from sklearn.metrics import accuracy_score
+    from qa_metrics.em import em_match
+
     # Load the evaluation data
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -51,8 +80,250 @@ def evaluate_predictions_binary(json_path: str) -> None:
     # print(f"F1:        {f1:.4f}")
 
 
+@dataclass
+class Cell:
+    """Predictions of one model for one language/country and prompt variant."""
+    path: str
+    model: str
+    variant: str
+    language: str = None
+    country: str = None
+    y_true: np.ndarray = field(default=None, repr=False)
+    y_pred: np.ndarray = field(default=None, repr=False)
+    # (n, n_classes) label probabilities of scoring runs, None otherwise
+    probs: np.ndarray = field(default=None, repr=False)
+
+
+def discover_output_files(paths: list[str]) -> list[str]:
+    """
+    Expands directories into the JSON output files they contain.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def get_variant(path: str, record: dict) -> str:
+    """
+    Returns the prompt variant of an output file: "wo_country_pref", "country" or "language".
+    """
+    if "wo_country_pref" in path or "wo-country-pref" in path:
+        return "wo_country_pref"
+    return "country" if "country" in record else "language"
+
+
+def to_label_ids(labels: list[str]) -> np.ndarray:
+    """
+    Maps label strings to canonical label IDs, normalizing every distinct string only once.
+    """
+    uniques, inverse = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+    ids = np.fromiter((normalize_label(label) for label in uniques), dtype=np.int8, count=len(uniques))
+    return ids[inverse.reshape(-1)]
+
+
+def to_probabilities(distributions: list[dict]) -> np.ndarray:
+    """
+    Converts the label_distribution of each record into a row of class probabilities; records without one
+    (no label among the top tokens) get the uniform distribution.
+    """
+    probs = np.full((len(distributions), len(EMOTIONS)), 1 / len(EMOTIONS))
+    label_ids = {}
+    for i, distribution in enumerate(distributions):
+        if not distribution:
+            continue
+        probs[i] = 0.0
+        for label, p in distribution.items():
+            if label not in label_ids:
+                label_ids[label] = normalize_label(label)
+            if label_ids[label] != INVALID_ID:
+                probs[i, label_ids[label]] += p
+        total = probs[i].sum()
+        probs[i] = probs[i] / total if total > 0 else 1 / len(EMOTIONS)
+    return probs
+
+
+def load_cells(paths: list[str]) -> list[Cell]:
+    """
+    Loads output files into evaluation cells.
+
+    Args:
+        paths (list[str]): Output JSON files
+
+    Returns:
+        list[Cell]: One cell per non-empty file, with y_true and y_pred as label ID arrays
+    """
+    cells = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list) or not data or "pred_emotion" not in data[0]:
+            continue
+        first = data[0]
+        cells.append(Cell(
+            path=path,
+            model=first.get("model"),
+            variant=get_variant(path, first),
+            language=first.get("language"),
+            country=first.get("country"),
+            y_true=to_label_ids([item["emotion"] for item in data]),
+            y_pred=to_label_ids([item["pred_emotion"] or "" for item in data]),
+            probs=to_probabilities([item.get("label_distribution") for item in data])
+            if "label_distribution" in first else None,
+        ))
+    return cells
+
+
+def confusion_matrices(cells: list[Cell]) -> np.ndarray:
+    """
+    Computes the confusion matrices of all cells at once.
+
+    Returns:
+        np.ndarray: Array of shape (n_cells, n_classes, n_classes + 1); rows are gold labels, columns are
+            predicted labels and the last column counts answers that match no label
+    """
+    n_classes = len(EMOTIONS)
+    cell_index = np.repeat(np.arange(len(cells)), [len(cell.y_true) for cell in cells])
+    y_true = np.concatenate([cell.y_true for cell in cells]).astype(np.int64)
+    y_pred = np.concatenate([cell.y_pred for cell in cells]).astype(np.int64)
+    y_pred[y_pred == INVALID_ID] = n_classes
+
+    valid = y_true != INVALID_ID
+    flat = (cell_index[valid] * n_classes + y_true[valid]) * (n_classes + 1) + y_pred[valid]
+    counts = np.bincount(flat, minlength=len(cells) * n_classes * (n_classes + 1))
+    return counts.reshape(len(cells), n_classes, n_classes + 1)
+
+
+def compute_metrics(confusion: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Derives metrics from a stack of confusion matrices.
+
+    Returns:
+        dict[str, np.ndarray]: accuracy, invalid_rate and macro_f1 of shape (n_cells,);
+            precision, recall, f1 and support of shape (n_cells, n_classes)
+    """
+    n_classes = confusion.shape[1]
+    tp = np.diagonal(confusion[:, :, :n_classes], axis1=1, axis2=2).astype(float)
+    support = confusion.sum(axis=2)
+    predicted = confusion[:, :, :n_classes].sum(axis=1)
+    total = support.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        accuracy = np.where(total > 0, tp.sum(axis=1) / total, 0.0)
+        invalid_rate = np.where(total > 0, confusion[:, :, n_classes].sum(axis=1) / total, 0.0)
+
+    present = support > 0
+    macro_f1 = (f1 * present).sum(axis=1) / np.maximum(present.sum(axis=1), 1)
+    return {
+        "accuracy": accuracy,
+        "invalid_rate": invalid_rate,
+        "macro_f1": macro_f1,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "support": support,
+    }
+
+
+def probabilistic_metrics(y_true: np.ndarray, probs: np.ndarray, bins: int = CALIBRATION_BINS) -> dict[str, float]:
+    """
+    Computes log-loss, multi-class Brier score and expected calibration error (ECE, over `bins` equal-width
+    confidence bins of the most likely label) for rows with a valid gold label.
+    """
+    valid = y_true != INVALID_ID
+    y_true, probs = y_true[valid].astype(np.int64), probs[valid]
+    if not len(y_true):
+        return {"log_loss": 0.0, "brier": 0.0, "ece": 0.0}
+    rows = np.arange(len(y_true))
+    one_hot = np.zeros_like(probs)
+    one_hot[rows, y_true] = 1.0
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == y_true
+    bin_index = np.minimum((confidence * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(bin_index, minlength=bins)
+    gap = np.abs(np.bincount(bin_index, weights=correct, minlength=bins)
+                 - np.bincount(bin_index, weights=confidence, minlength=bins))
+    return {
+        "log_loss": float(-np.log(np.maximum(probs[rows, y_true], MIN_PROBABILITY)).mean()),
+        "brier": float(((probs - one_hot) ** 2).sum(axis=1).mean()),
+        "ece": float(gap.sum() / counts.sum()),
+    }
+
+
+def build_report(cells: list[Cell], confusion: np.ndarray, metrics: dict[str, np.ndarray]) -> list[dict]:
+    """
+    Converts the metric arrays into one JSON-serializable entry per cell.
+    """
+    report = []
+    for i, cell in enumerate(cells):
+        scores = probabilistic_metrics(cell.y_true, cell.probs) if cell.probs is not None else {}
+        report.append({
+            "file": cell.path,
+            "model": cell.model,
+            "variant": cell.variant,
+            "language": cell.language,
+            "country": cell.country,
+            "n": int(len(cell.y_true)),
+            "accuracy": round(float(metrics["accuracy"][i]), 4),
+            "invalid_rate": round(float(metrics["invalid_rate"][i]), 4),
+            "macro_f1": round(float(metrics["macro_f1"][i]), 4),
+            **{name: round(value, 4) for name, value in scores.items()},
+            "per_class": {
+                emotion: {
+                    "precision": round(float(metrics["precision"][i, k]), 4),
+                    "recall": round(float(metrics["recall"][i, k]), 4),
+                    "f1": round(float(metrics["f1"][i, k]), 4),
+                    "support": int(metrics["support"][i, k]),
+                }
+                for k, emotion in enumerate(EMOTIONS)
+            },
+            "confusion_labels": [*EMOTIONS, "invalid"],
+            "confusion": confusion[i].tolist(),
+        })
+    return report
+
+
+def evaluate_files(paths: list[str], report_path: str = REPORT_PATH) -> list[dict]:
+    """
+    Evaluates many output files in one pass and writes a consolidated report.
+
+    Args:
+        paths (list[str]): Output JSON files or directories containing them
+        report_path (str): Where the JSON report is written
+
+    Returns:
+        list[dict]: The report entries, one per cell
+    """
+    cells = load_cells(discover_output_files(paths))
+    if not cells:
+        print("No output files found")
+        return []
+    confusion = confusion_matrices(cells)
+    report = build_report(cells, confusion, compute_metrics(confusion))
+
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print(f"{'model':<28} {'variant':<16} {'language/country':<22} {'acc':>6} {'macroF1':>8} {'invalid':>8} "
+          f"{'logloss':>8} {'ECE':>6}")
+    for entry in sorted(report, key=lambda e: (e["model"], e["variant"], e["language"] or e["country"])):
+        scores = f"{entry['log_loss']:>8.4f} {entry['ece']:>6.4f}" if "log_loss" in entry else f"{'-':>8} {'-':>6}"
+        print(f"{entry['model']:<28} {entry['variant']:<16} {entry['language'] or entry['country']:<22} "
+              f"{entry['accuracy']:>6.4f} {entry['macro_f1']:>8.4f} {entry['invalid_rate']:>8.4f} {scores}")
+    print(f"Report for {len(report)} cells written to {report_path}")
+    return report
+
+
 if __name__ == "__main__":
-    # Example evaluation on a specific output file
-    evaluate_predictions_binary(
-        "wo_country_pref_outputs/wo_country_pref_gemini1.5_flash/eng_wo-country-pref_gemini1.5_flash.json")
+    parser = argparse.ArgumentParser(description="Evaluate CuLEmo output files")
+    parser.add_argument("paths", nargs="*", default=OUTPUT_DIRS, help="Output JSON files or directories")
+    parser.add_argument("--report", default=REPORT_PATH, help="Path of the consolidated JSON report")
+    args = parser.parse_args()
 
+    evaluate_files(args.paths, args.report)
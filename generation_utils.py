@@ -0,0 +1,329 @@
+"""
+Generation settings shared by all provider backends.
+The prompts ask for a single emotion word, so every request is capped to a few output tokens. There is no stop
+sequence by default: an answer may start with a line break (e.g. "\\nJoy"), which a stop at "\\n" would cut to
+nothing, and label_utils reads the word from the first line of a longer answer. Optionally the answer is
+constrained to the six labels of the prompt's language with the provider's structured-output feature (JSON schema,
+tool call or enum), which rules out verbose answers entirely.
+"""
+
+import json
+import math
+from dataclasses import asdict, dataclass, replace
+from label_utils import extract_labels, fold, scoring_supported, strip_edges
+
+
+# Extra output tokens allowed for the JSON wrapper of structured answers ({"emotion": "..."})
+STRUCTURED_OVERHEAD_TOKENS = 16
+ANSWER_FIELD = "emotion"
+ANSWER_TOOL = "answer"
+# Alternatives returned for the answer token in scoring mode (the OpenAI maximum)
+TOP_LOGPROBS = 20
+
+
+@dataclass(frozen=True)
+class GenerationConfig:
+    """
+    Output limits and answer format for a run.
+
+    Args:
+        max_tokens (int): Maximum number of output tokens of a plain answer; even Amharic and Hindi
+            labels fit in 16
+        stop (tuple[str, ...]): Stop sequences, none by default (see the module docstring); Anthropic ignores
+            whitespace-only ones, which it rejects
+        temperature (float, optional): Sampling temperature; None keeps the provider default
+        structured (bool): Constrain the answer to the prompt's labels with the provider's structured output.
+            Needs a model that supports it (e.g. gpt-4o, Claude 3+, Gemini 1.5, Ollama >= 0.5)
+        scoring (bool): Generate a single token with its top log-probabilities and answer with the distribution
+            over the prompt's labels (see scored_answer). OpenAI-compatible and Ollama (>= 0.12.11) backends only;
+            prompts in label_utils.UNSCORED_LANGUAGES are answered in plain text and marked as unscored
+    """
+    max_tokens: int = 16
+    stop: tuple[str, ...] = ()
+    temperature: float = None
+    structured: bool = False
+    scoring: bool = False
+
+    @property
+    def token_cap(self) -> int:
+        if self.scoring:
+            return 1
+        return self.max_tokens + (STRUCTURED_OVERHEAD_TOKENS if self.structured else 0)
+
+    def for_pack(self, pack_size: int) -> "GenerationConfig":
+        """
+        Returns the config for prompts with pack_size numbered questions: one answer line per question, so
+        the token cap scales with the pack size and there are no stop sequences. Structured answers are only
+        supported for single questions, and so is scoring.
+        """
+        if pack_size <= 1:
+            return self
+        return replace(self, max_tokens=self.max_tokens * pack_size, stop=(), structured=False, scoring=False)
+
+    def for_prompt(self, prompt: str) -> "GenerationConfig":
+        """
+        Returns the config for one prompt: scoring is turned off for prompts whose labels cannot be scored
+        (see label_utils.scoring_supported).
+        """
+        if self.scoring and not scoring_supported(extract_labels(prompt)):
+            return replace(self, scoring=False)
+        return self
+
+    def cache_params(self, **extra) -> dict:
+        """
+        Returns the settings as a dict for the response cache key, with provider-specific extras.
+        """
+        params = {**asdict(self), "stop": list(self.stop), **extra}
+        if not self.scoring:
+            # Leaves the keys of responses cached before scoring existed unchanged
+            del params["scoring"]
+        return params
+
+
+def answer_schema(prompt: str) -> dict:
+    """
+    Returns a JSON schema allowing only {"emotion": <one of the labels listed in the prompt>}.
+    """
+    return {
+        "type": "object",
+        "properties": {ANSWER_FIELD: {"type": "string", "enum": extract_labels(prompt)}},
+        "required": [ANSWER_FIELD],
+        "additionalProperties": False,
+    }
+
+
+def parse_structured(text: str) -> str:
+    """
+    Extracts the label from a structured JSON answer; other answers are returned unchanged.
+    """
+    try:
+        answer = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return text
+    if isinstance(answer, dict) and isinstance(answer.get(ANSWER_FIELD), str):
+        return answer[ANSWER_FIELD]
+    return text
+
+
+def label_distribution(top_logprobs: list[tuple[str, float]], labels: list[str]) -> tuple[dict[str, float], float]:
+    """
+    Turns the top alternatives of the first answer token into a distribution over the labels.
+
+    A token counts for every label it is a prefix of (or that is a prefix of it, e.g. "joy."), its probability
+    shared equally between them; labels no token matches get 0.
+
+    Args:
+        top_logprobs (list[tuple[str, float]]): (token, logprob) alternatives of the first answer token
+        labels (list[str]): Labels of the prompt
+
+    Returns:
+        tuple[dict[str, float], float]: The normalized distribution (empty if no token matched a label) and its
+            coverage, the share of the alternatives' probability that matched a label
+    """
+    folded = [fold(label) for label in labels]
+    mass = dict.fromkeys(labels, 0.0)
+    total = 0.0
+    for token, logprob in top_logprobs:
+        probability = math.exp(logprob)
+        total += probability
+        token = strip_edges(fold(token))
+        if not token:
+            continue
+        matches = [label for label, f in zip(labels, folded) if f.startswith(token) or token.startswith(f)]
+        for label in matches:
+            mass[label] += probability / len(matches)
+    matched = sum(mass.values())
+    if not matched:
+        return {}, 0.0
+    return {label: p / matched for label, p in mass.items()}, matched / total
+
+
+def scored_answer(top_logprobs: list[tuple[str, float]], prompt: str) -> str:
+    """
+    Returns the answer of a scoring-mode request as JSON: {"emotion": <most likely label>, "distribution":
+    {label: probability}, "coverage": <share of the probability on labels>}. When no alternative matches a
+    label, "emotion" is the most likely token and the distribution is empty. inference_utils.split_scored
+    reads it back.
+    """
+    distribution, coverage = label_distribution(top_logprobs, extract_labels(prompt))
+    if distribution:
+        emotion = max(distribution, key=distribution.get)
+    else:
+        emotion = max(top_logprobs, key=lambda item: item[1])[0].strip() if top_logprobs else ""
+    return json.dumps({
+        ANSWER_FIELD: emotion,
+        "distribution": {label: round(p, 6) for label, p in distribution.items()},
+        "coverage": round(coverage, 6),
+    }, ensure_ascii=False)
+
+
+def unscored_answer(answer: str) -> str:
+    """
+    Returns the plain answer of a scoring-mode request whose labels cannot be scored, as JSON: {"emotion":
+    <answer>, "scoring": "unsupported"}. inference_utils.split_scored reads it back.
+    """
+    return json.dumps({ANSWER_FIELD: answer, "scoring": "unsupported"}, ensure_ascii=False)
+
+
+def openai_params(config: GenerationConfig, prompt: str) -> dict:
+    """
+    Returns the chat.completions.create arguments for the config.
+    """
+    config = config.for_prompt(prompt)
+    if config.scoring:
+        params = {"max_tokens": 1, "logprobs": True, "top_logprobs": TOP_LOGPROBS}
+        if config.temperature is not None:
+            params["temperature"] = config.temperature
+        return params
+    params = {"max_tokens": config.token_cap}
+    if config.stop and not config.structured:
+        params["stop"] = list(config.stop)
+    if config.temperature is not None:
+        params["temperature"] = config.temperature
+    if config.structured:
+        params["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": ANSWER_TOOL, "strict": True, "schema": answer_schema(prompt)},
+        }
+    return params
+
+
+def openai_answer(completion) -> str:
+    """
+    Returns the label from a chat completion (a response object or a batch output body).
+    """
+    if isinstance(completion, dict):
+        content = completion["choices"][0]["message"]["content"]
+    else:
+        content = completion.choices[0].message.content
+    return parse_structured(content)
+
+
+def openai_scored(completion, prompt: str) -> str:
+    """
+    Returns the scored_answer of a scoring-mode chat completion (a response object or a batch output body), or
+    the unscored_answer if the prompt's labels cannot be scored.
+    """
+    if not scoring_supported(extract_labels(prompt)):
+        return unscored_answer(openai_answer(completion))
+    if isinstance(completion, dict):
+        content = completion["choices"][0]["logprobs"]["content"]
+        top = [(alt["token"], alt["logprob"]) for alt in content[0]["top_logprobs"]] if content else []
+    else:
+        content = completion.choices[0].logprobs.content
+        top = [(alt.token, alt.logprob) for alt in content[0].top_logprobs] if content else []
+    return scored_answer(top, prompt)
+
+
+def openai_usage(completion) -> tuple[int, int]:
+    """
+    Returns the (input, output) token counts of a chat completion, or Nones if the server did not report them.
+    """
+    if completion.usage is None:
+        return None, None
+    return completion.usage.prompt_tokens, completion.usage.completion_tokens
+
+
+def anthropic_params(config: GenerationConfig, prompt: str) -> dict:
+    """
+    Returns the messages.create arguments for the config; structured answers use a forced tool call.
+    """
+    params = {"max_tokens": config.token_cap}
+    stop = [s for s in config.stop if s.strip()]
+    if stop and not config.structured:
+        params["stop_sequences"] = stop
+    if config.temperature is not None:
+        params["temperature"] = config.temperature
+    if config.structured:
+        params["tools"] = [{
+            "name": ANSWER_TOOL,
+            "description": "Report the chosen emotion.",
+            "input_schema": answer_schema(prompt),
+        }]
+        params["tool_choice"] = {"type": "tool", "name": ANSWER_TOOL}
+    return params
+
+
+def anthropic_answer(message) -> str:
+    """
+    Returns the label from a message (a response object or a batch result dict), text or tool call.
+    """
+    blocks = message["content"] if isinstance(message, dict) else message.content
+    for block in blocks:
+        block = block if isinstance(block, dict) else block.model_dump()
+        if block["type"] == "tool_use" and isinstance(block["input"].get(ANSWER_FIELD), str):
+            return block["input"][ANSWER_FIELD]
+        if block["type"] == "text":
+            return block["text"]
+    return ""
+
+
+def anthropic_usage(message) -> tuple[int, int]:
+    """
+    Returns the (input, output) token counts of a message.
+    """
+    return message.usage.input_tokens, message.usage.output_tokens
+
+
+def gemini_params(config: GenerationConfig, prompt: str) -> dict:
+    """
+    Returns the generation_config for generate_content; structured answers use the text/x.enum MIME type,
+    so the response text is the bare label.
+    """
+    params = {"max_output_tokens": config.token_cap}
+    if config.stop and not config.structured:
+        params["stop_sequences"] = list(config.stop)
+    if config.temperature is not None:
+        params["temperature"] = config.temperature
+    if config.structured:
+        params["response_mime_type"] = "text/x.enum"
+        params["response_schema"] = {"type": "STRING", "format": "enum", "enum": extract_labels(prompt)}
+    return params
+
+
+def gemini_usage(response) -> tuple[int, int]:
+    """
+    Returns the (input, output) token counts of a generate_content response.
+    """
+    usage = response.usage_metadata
+    return usage.prompt_token_count, usage.candidates_token_count
+
+
+def ollama_params(config: GenerationConfig, prompt: str, options: dict = None) -> dict:
+    """
+    Returns the chat arguments (options and format) for the config, merged with server options such as num_ctx.
+    """
+    config = config.for_prompt(prompt)
+    params = {"options": {**(options or {}), "num_predict": config.token_cap}}
+    if config.scoring:
+        params["logprobs"] = True
+        params["top_logprobs"] = TOP_LOGPROBS
+        if config.temperature is not None:
+            params["options"]["temperature"] = config.temperature
+        return params
+    if config.stop and not config.structured:
+        params["options"]["stop"] = list(config.stop)
+    if config.temperature is not None:
+        params["options"]["temperature"] = config.temperature
+    if config.structured:
+        params["format"] = answer_schema(prompt)
+    return params
+
+
+def ollama_usage(response) -> tuple[int, int]:
+    """
+    Returns the (input, output) token counts of a chat response (missing when the prompt was cached by the server).
+    """
+    return response.get("prompt_eval_count"), response.get("eval_count")
+
+
+def ollama_scored(response, prompt: str) -> str:
+    """
+    Returns the scored_answer of a scoring-mode chat response, or the unscored_answer if the prompt's labels
+    cannot be scored.
+    """
+    if not scoring_supported(extract_labels(prompt)):
+        return unscored_answer(parse_structured(response["message"]["content"]))
+    logprobs = response.get("logprobs")
+    top = [(alt["token"], alt["logprob"]) for alt in logprobs[0]["top_logprobs"] or []] if logprobs else []
+    return scored_answer(top, prompt)
@@ -0,0 +1,371 @@
+"""
+Hedged requests and failover for get_prediction functions, to cut the latency tail of a run.
+A few slow or stuck calls dominate the wall time of a run. Hedger sends each request on its primary route and, if no
+answer has arrived after a latency percentile of the answers so far, sends the prompt again (to the same model, or
+to a configured equivalent route such as another provider's model) and takes whichever answers first; the other
+attempts are cancelled. A route that fails is replaced by the next one right away (failover), and a request that
+gets no answer before its deadline raises HedgeTimeoutError instead of stalling the run; process_file leaves that
+row out and a resumed run asks it again. Hedges are capped at a fraction of the requests, so the extra cost stays
+bounded. Attempts are timed from when their scheduler sends them: a request waiting for the rate limits is not slow,
+and hedging it would only add to the queue.
+
+The route that answered is added to the result record ("route", and "hedged" when it was not the first attempt)
+and to the telemetry trace. Responses from the cache never reach the hedger, so their records have no route. An
+answer from another route is kept out of the cache entry of the request (skip_cache), so a later run never takes
+it for the primary model's; load_routes caches the routes under their own provider and model instead.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import functools
+import threading
+import time
+from dataclasses import dataclass, field
+from cache_utils import cached, cached_async, skip_cache
+from inference_utils import annotate_record
+from scheduler_utils import Scheduler, dispatch_hook, scheduled, scheduled_async
+from telemetry_utils import annotate
+
+
+class HedgeTimeoutError(TimeoutError):
+    """Raised when no route answers a request before its deadline."""
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    """
+    When requests are hedged.
+
+    Args:
+        percentile (float): A hedge is sent when an attempt has not answered after this percentile of the
+            latencies of earlier requests, counted from when the scheduler sent the attempt
+        deadline (float): Seconds after which a request fails with HedgeTimeoutError
+        max_hedge_rate (float): Hedges sent at most, as a fraction of the requests (failovers after errors
+            are not counted)
+        max_attempts (int): Attempts per request, hedges and failovers included
+        initial_delay (float): Hedge delay in seconds until `warmup` answers have been seen
+        min_delay (float): Lower bound of the hedge delay in seconds
+        warmup (int): Answers needed before the percentile is used
+        window (int): Number of recent request latencies the percentile is computed over
+    """
+    percentile: float = 0.95
+    deadline: float = 60.0
+    max_hedge_rate: float = 0.1
+    max_attempts: int = 3
+    initial_delay: float = 2.0
+    min_delay: float = 0.05
+    warmup: int = 20
+    window: int = 1000
+
+
+@dataclass
+class Route:
+    """
+    A way to answer a prompt.
+
+    Args:
+        provider (str): Provider name, used to name the route in records
+        get_prediction (callable): get_prediction function of the route (async for Hedger.call)
+        model (str, optional): Model the route asks; None asks the model of the request
+    """
+    provider: str
+    get_prediction: object = field(repr=False)
+    model: str = None
+
+    def name(self, model: str) -> str:
+        return f"{self.provider}:{self.model or model}"
+
+
+class _Dispatch:
+    """
+    Progress of one attempt through its scheduler, reported through scheduler_utils.dispatch_hook. Attempts
+    whose get_prediction is not scheduled never report and are timed from their launch.
+    """
+
+    def __init__(self):
+        self.launched = time.monotonic()
+        self.queued = False
+        self.sent = None
+
+    def __call__(self, state: str) -> None:
+        if state == "queued":
+            self.queued = True
+        elif self.sent is None:
+            self.sent = time.monotonic()
+
+    def latency(self) -> float:
+        """
+        Seconds since the attempt was sent, the time spent waiting for the rate limits excluded.
+        """
+        return time.monotonic() - (self.sent or self.launched)
+
+
+class Hedger:
+    """
+    Hedges and fails over the requests of a get_prediction function (see hedged and hedged_async).
+
+    Args:
+        policy (HedgePolicy): When to hedge and the deadline of a request
+        alternates (list[Route]): Routes tried after the primary one, in order; hedges go back to the primary
+            route once they are exhausted, and without alternates every hedge is a duplicate of the request
+        max_workers (int): Threads used for sync calls
+    """
+
+    def __init__(self, policy: HedgePolicy = HedgePolicy(), alternates: list[Route] = (), max_workers: int = 32):
+        self.policy = policy
+        self.alternates = list(alternates)
+        self.max_workers = max_workers
+        self._latencies = collections.deque(maxlen=policy.window)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.requests = 0
+        self.hedges = 0
+        self.failovers = 0
+        self.timeouts = 0
+        self.hedge_wins = 0
+        self.wins = collections.Counter()
+
+    def hedge_delay(self) -> float:
+        """
+        Returns how long an attempt may take before the request is hedged.
+        """
+        with self._lock:
+            if len(self._latencies) < self.policy.warmup:
+                return self.policy.initial_delay
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(self.policy.percentile * len(latencies)))
+        return max(self.policy.min_delay, latencies[index])
+
+    def _start_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges < self.policy.max_hedge_rate * self.requests:
+                self.hedges += 1
+                return True
+            return False
+
+    def _route(self, primary: Route, attempt: int) -> Route:
+        routes = [primary, *self.alternates]
+        return routes[attempt % len(routes)]
+
+    def _answered(self, primary: Route, route: Route, model: str, latency: float, attempt: int) -> None:
+        if route is not primary:
+            skip_cache()
+        name = route.name(model)
+        with self._lock:
+            self._latencies.append(latency)
+            self.wins[name] += 1
+            self.hedge_wins += attempt > 0
+        fields = {"route": name, **({"hedged": True} if attempt else {})}
+        annotate(**fields)
+        annotate_record(**fields)
+
+    def _timed_out(self, primary: Route, model: str) -> HedgeTimeoutError:
+        with self._lock:
+            self.timeouts += 1
+        return HedgeTimeoutError(f"No answer from {primary.name(model)} within {self.policy.deadline}s")
+
+    def _next_hedge(self, latest: "_Dispatch", now: float) -> float:
+        """
+        Returns when to hedge the latest attempt, or `now` to hedge it right away. An attempt still waiting for
+        the rate limits of its scheduler is not hedged (the hedge would only queue behind it); it is checked
+        again shortly.
+        """
+        if latest.queued and latest.sent is None:
+            return now + self.policy.min_delay
+        return max(now, (latest.sent or latest.launched) + self.hedge_delay())
+
+    async def call(self, primary: Route, model: str, prompt: str) -> tuple[str, str]:
+        """
+        Answers a prompt with hedging and failover.
+
+        Args:
+            primary (Route): Route of the request, with an async get_prediction
+            model (str): Model of the request
+            prompt (str): The prompt
+
+        Returns:
+            tuple[str, str]: (prompt, model_response) of the first route that answered
+        """
+        self._start_request()
+        deadline = time.monotonic() + self.policy.deadline
+        attempts = {}  # task -> (attempt number, route, dispatch)
+        started = 0
+        latest = None
+        next_hedge = None
+        error = None
+
+        def launch() -> None:
+            nonlocal started, latest, next_hedge
+            route = self._route(primary, started)
+            latest = _Dispatch()
+            # The task copies the context, so the scheduler of this attempt reports to its own hook
+            token = dispatch_hook.set(latest)
+            task = asyncio.ensure_future(route.get_prediction(route.model or model, prompt))
+            dispatch_hook.reset(token)
+            attempts[task] = (started, route, latest)
+            started += 1
+            next_hedge = latest.launched + self.hedge_delay()
+
+        launch()
+        try:
+            while attempts:
+                can_hedge = started < self.policy.max_attempts
+                wait_until = min(deadline, next_hedge) if can_hedge else deadline
+                done, _ = await asyncio.wait(attempts, timeout=max(0.0, wait_until - time.monotonic()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt, route, dispatch = attempts.pop(task)
+                    if task.exception() is None:
+                        self._answered(primary, route, model, dispatch.latency(), attempt)
+                        return task.result()
+                    error = task.exception()
+                    if started < self.policy.max_attempts:
+                        with self._lock:
+                            self.failovers += 1
+                        launch()
+                now = time.monotonic()
+                if now >= deadline:
+                    raise self._timed_out(primary, model)
+                if not done and can_hedge and now >= next_hedge:
+                    next_hedge = self._next_hedge(latest, now)
+                    if next_hedge <= now:
+                        if self._may_hedge():
+                            launch()
+                        else:
+                            # Over the hedge budget; check again once more requests have been made
+                            next_hedge = now + self.hedge_delay()
+            raise error
+        finally:
+            # Losing attempts are abandoned; cancelling them closes their connections
+            for task in attempts:
+                task.cancel()
+
+    def call_sync(self, primary: Route, model: str, prompt: str) -> tuple[str, str]:
+        """
+        Blocking version of call, running the attempts in threads; an attempt still running when the request is
+        answered or times out keeps its thread until it returns.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, "hedge")
+        self._start_request()
+        deadline = time.monotonic() + self.policy.deadline
+        attempts = {}
+        started = 0
+        latest = None
+        next_hedge = None
+        error = None
+
+        def launch() -> None:
+            nonlocal started, latest, next_hedge
+            route = self._route(primary, started)
+            latest = _Dispatch()
+            context = contextvars.copy_context()
+            context.run(dispatch_hook.set, latest)
+            future = self._executor.submit(context.run, route.get_prediction, route.model or model, prompt)
+            attempts[future] = (started, route, latest)
+            started += 1
+            next_hedge = latest.launched + self.hedge_delay()
+
+        launch()
+        while attempts:
+            can_hedge = started < self.policy.max_attempts
+            wait_until = min(deadline, next_hedge) if can_hedge else deadline
+            done, _ = concurrent.futures.wait(attempts, timeout=max(0.0, wait_until - time.monotonic()),
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                attempt, route, dispatch = attempts.pop(future)
+                if future.exception() is None:
+                    self._answered(primary, route, model, dispatch.latency(), attempt)
+                    return future.result()
+                error = future.exception()
+                if started < self.policy.max_attempts:
+                    with self._lock:
+                        self.failovers += 1
+                    launch()
+            now = time.monotonic()
+            if now >= deadline:
+                raise self._timed_out(primary, model)
+            if not done and can_hedge and now >= next_hedge:
+                next_hedge = self._next_hedge(latest, now)
+                if next_hedge <= now:
+                    if self._may_hedge():
+                        launch()
+                    else:
+                        next_hedge = now + self.hedge_delay()
+        raise error
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "timeouts": self.timeouts,
+                "wins": dict(self.wins),
+            }
+
+
+def hedged(get_prediction, hedger: Hedger, provider: str):
+    """
+    Wraps a get_prediction function so that its calls are hedged; returns it unchanged when hedger is None.
+    """
+    if hedger is None:
+        return get_prediction
+    primary = Route(provider, get_prediction)
+
+    @functools.wraps(get_prediction)
+    def wrapper(model: str, prompt: str) -> tuple[str, str]:
+        return hedger.call_sync(primary, model, prompt)
+
+    return wrapper
+
+
+def hedged_async(get_prediction, hedger: Hedger, provider: str):
+    """
+    Async version of hedged for coroutine get_prediction functions.
+    """
+    if hedger is None:
+        return get_prediction
+    primary = Route(provider, get_prediction)
+
+    @functools.wraps(get_prediction)
+    async def wrapper(model: str, prompt: str) -> tuple[str, str]:
+        return await hedger.call(primary, model, prompt)
+
+    return wrapper
+
+
+def load_routes(specs: list[str], async_client: bool = True, generation=None, cache=None) -> list[Route]:
+    """
+    Builds alternate routes from "provider:model" specs (e.g. "anthropic:claude-3-5-sonnet-20240620"; without
+    a model the provider script's MODEL_NAME is used). Each route gets its own scheduler and asks with the
+    generation settings of the run (a GenerationConfig; None uses each script's GENERATION). With a
+    ResponseCache, each route's answers are cached under its own provider and model.
+    """
+    from providers import load_provider
+
+    routes = []
+    for spec in specs:
+        provider, _, model = spec.partition(":")
+        module = load_provider(provider)
+        route_generation = generation or module.GENERATION
+        scheduler = Scheduler.for_provider(provider, max_concurrency=getattr(module, "CONCURRENCY", 8),
+                                           max_output_tokens=route_generation.token_cap)
+        get_prediction = functools.partial(module.get_prediction_async if async_client else module.get_prediction,
+                                           generation=route_generation)
+        get_prediction = (scheduled_async(get_prediction, scheduler) if async_client
+                          else scheduled(get_prediction, scheduler))
+        if cache is not None:
+            params = route_generation.cache_params(**getattr(module, "OPTIONS", {}))
+            get_prediction = (cached_async if async_client else cached)(get_prediction, cache, provider, params=params)
+        routes.append(Route(provider, get_prediction, model or module.MODEL_NAME))
+    return routes
@@ -0,0 +1,107 @@
+"""
+Script for running inference with a local Hugging Face model on CPU.
+This script processes text data and generates emotion predictions without any network access, once the model
+has been downloaded (set HF_HUB_OFFLINE=1 on air-gapped nodes and point MODEL_NAME at a local copy if needed).
+It supports both language-specific and country-specific evaluations.
+
+The model is loaded once (see hf_utils.LocalGenerator). Before process_file runs, the prompts of all pending
+rows are answered in length-sorted padded batches (prefetch); get_prediction then hands the answers to
+process_file row by row, so the output keeps the original row order.
+"""
+
+from client_utils import get_client
+from generation_utils import GenerationConfig
+from inference_utils import default_stream_path
+from providers import RunConfig, run_evaluation
+from telemetry_utils import record_usage
+import sys
+
+# Configuration for the evaluation
+TSV_FILE_PATH = "data/test/eng.tsv"
+# Either LANG or COUNTRY must be set to None
+LANG = "English"     # "English", "Arabic", "Spanish", "German", "Amharic", "Hindi", None
+COUNTRY = None      # "Ethiopia", "United Arab Emirates", "Germany", "India", "Mexico", None
+MODEL_NAME = "Qwen/Qwen2.5-0.5B-Instruct"  # Hugging Face model name or local path
+OUTPUT_JSON_PATH = "hf_outputs/eng_qwen2.5-0.5b-instruct.json"
+# Results are streamed here while running so an interrupted run resumes where it stopped (under .cache/streams/)
+STREAM_PATH = default_stream_path(OUTPUT_JSON_PATH)
+# Prompts per generate call; larger batches use more memory
+BATCH_SIZE = 16
+NUM_THREADS = None  # CPU threads for torch; None uses all CPUs
+DTYPE = "float32"   # "bfloat16" is faster on CPUs with native bf16 support
+# Reuse responses from earlier runs; in replay mode uncached prompts raise instead of running the model
+CACHE_PATH = ".cache/responses.sqlite"
+CACHE_REPLAY = False
+# Per-request trace (JSONL), Prometheus metrics and a progress bar are written here; None disables telemetry
+TELEMETRY_DIR = "telemetry"
+# Every record is also written to this results store (see results_store.py); None disables it
+RESULTS_DB = "results.sqlite"
+# Output token cap; decoding is greedy and the answer is cut at the first line break
+GENERATION = GenerationConfig(max_tokens=8)
+CACHE_PARAMS = GENERATION.cache_params()
+
+# Answers computed by prefetch, as (answer, prompt tokens, output tokens), until get_prediction hands them out
+prefetched = {}
+
+
+def get_generator(model: str, generation: GenerationConfig = GENERATION):
+    """
+    Returns the shared LocalGenerator of a model, loading it on first use.
+    """
+    return get_client("transformers", model, batch_size=BATCH_SIZE, max_new_tokens=generation.max_tokens,
+                      num_threads=NUM_THREADS, dtype=DTYPE)
+
+
+def prefetch(model: str, prompts: list[str], generation: GenerationConfig = GENERATION) -> None:
+    """
+    Answers prompts in batches ahead of process_file.
+    """
+    prompts = [prompt for prompt in dict.fromkeys(prompts) if prompt not in prefetched]
+    for prompt, result in zip(prompts, get_generator(model, generation).generate(prompts)):
+        prefetched[prompt] = result
+
+
+def throughput_stats(model: str, generation: GenerationConfig = GENERATION) -> dict:
+    return get_generator(model, generation).stats()
+
+
+def get_prediction(model: str, prompt: str, generation: GenerationConfig = GENERATION) -> tuple[str, str]:
+    """
+    Gets a prediction from the local model, from the prefetched answers when available.
+
+    Args:
+        model (str): Hugging Face model name or local path
+        prompt (str): The prompt to send to the model
+        generation (GenerationConfig): Output limits of the run
+
+    Returns:
+        tuple[str, str]: A tuple containing (prompt, model_response)
+    """
+    result = prefetched.pop(prompt, None)
+    if result is None:
+        result = get_generator(model, generation).generate([prompt])[0]
+    answer, prompt_tokens, output_tokens = result
+    record_usage(prompt_tokens, output_tokens)
+    return prompt, answer
+
+
+def run_config() -> RunConfig:
+    """
+    Returns the run config set by the constants above.
+    """
+    return RunConfig(tsv_file=TSV_FILE_PATH, model=MODEL_NAME, output_path=OUTPUT_JSON_PATH, language=LANG,
+                     country=COUNTRY, stream_path=STREAM_PATH, async_mode=False, cache_path=CACHE_PATH,
+                     cache_replay=CACHE_REPLAY, telemetry_dir=TELEMETRY_DIR, results_db=RESULTS_DB,
+                     generation=GENERATION)
+
+
+def main() -> list[dict]:
+    """
+    Runs the evaluation configured by the constants above and returns the records. The answers of the pending
+    rows are computed first (prefetch), so process_file only stores them in row order.
+    """
+    return run_evaluation("transformers", run_config(), sys.modules[__name__])
+
+
+if __name__ == "__main__":
+    main()
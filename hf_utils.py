@@ -0,0 +1,113 @@
+"""
+Batched CPU inference with a local Hugging Face causal LM, for offline runs without an API or Ollama server.
+Calling generate once per prompt leaves most of the CPU idle: LocalGenerator sorts the prompts by tokenized
+length (so batches need little padding), runs them through model.generate in padded batches with a small
+max_new_tokens and returns the answers in the original order.
+
+torch and transformers are only needed when a LocalGenerator is created:
+    pip install torch transformers
+"""
+
+import os
+import threading
+import time
+
+
+class LocalGenerator:
+    """
+    A causal LM loaded once, answering prompts in length-sorted padded batches.
+
+    Args:
+        model_name (str): Hugging Face model name or local path (e.g. "Qwen/Qwen2.5-0.5B-Instruct")
+        batch_size (int): Prompts per generate call
+        max_new_tokens (int): Output token cap; an emotion word fits in a few tokens
+        num_threads (int, optional): Threads used by torch for CPU inference; defaults to the number of CPUs
+        dtype (str): torch dtype of the weights ("float32", or "bfloat16" on CPUs with fast bf16 support)
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16, max_new_tokens: int = 8, num_threads: int = None,
+                 dtype: str = "float32"):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        torch.set_num_threads(num_threads or os.cpu_count())
+        self.torch = torch
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        # Decoder-only models continue from the last position, so batches are padded on the left
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=getattr(torch, dtype))
+        self.model.eval()
+        # generate is not thread-safe; concurrent callers are served one batch at a time
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.batches = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.seconds = 0.0
+
+    def format(self, prompt: str) -> str:
+        """
+        Wraps a prompt in the model's chat template (if it has one) as a single user turn.
+        """
+        if self.tokenizer.chat_template:
+            return self.tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False,
+                                                      add_generation_prompt=True)
+        return prompt
+
+    def generate(self, prompts: list[str]) -> list[tuple[str, int, int]]:
+        """
+        Answers prompts in batches of similar length.
+
+        Args:
+            prompts (list[str]): Prompts to answer
+
+        Returns:
+            list[tuple[str, int, int]]: (first line of the answer, prompt tokens, output tokens) per prompt,
+                in the order of prompts
+        """
+        texts = [self.format(prompt) for prompt in prompts]
+        lengths = [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+        order = sorted(range(len(texts)), key=lengths.__getitem__)
+        results = [None] * len(texts)
+
+        with self._lock:
+            start = time.perf_counter()
+            for i in range(0, len(order), self.batch_size):
+                batch = order[i:i + self.batch_size]
+                inputs = self.tokenizer([texts[j] for j in batch], return_tensors="pt", padding=True,
+                                        add_special_tokens=False)
+                with self.torch.inference_mode():
+                    output = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens, do_sample=False,
+                                                 pad_token_id=self.tokenizer.pad_token_id)
+                new_tokens = output[:, inputs["input_ids"].shape[1]:]
+                answers = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+                for j, answer, tokens in zip(batch, answers, new_tokens):
+                    output_tokens = int((tokens != self.tokenizer.pad_token_id).sum())
+                    results[j] = (answer.strip().split("\n")[0].strip(), lengths[j], output_tokens)
+                    self.output_tokens += output_tokens
+                self.batches += 1
+            self.seconds += time.perf_counter() - start
+            self.requests += len(texts)
+            self.prompt_tokens += sum(lengths)
+        return results
+
+    def stats(self) -> dict:
+        """
+        Returns the totals and the throughput of the generate calls so far.
+        """
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "seconds": round(self.seconds, 2),
+            "requests_per_sec": round(self.requests / self.seconds, 2) if self.seconds else 0.0,
+            "tokens_per_sec": round(self.output_tokens / self.seconds, 2) if self.seconds else 0.0,
+        }
@@ -3,8 +3,62 @@ Utility functions for processing and evaluating LLM responses across different l
 This module handles prompt generation, file processing, and result storage.
 """
 
-import csv
+import asyncio
+import contextvars
 import json
+import os
+import re
+from dataset_utils import load_dataset
+
+
+# File code of the TSV for each prompt language (data/test/<code>.tsv)
+LANGUAGE_CODES = {
+    "English": "eng",
+    "Arabic": "ara",
+    "Spanish": "spn",
+    "Amharic": "amh",
+    "German": "deu",
+    "Hindi": "hin",
+}
+# (TSV file code, output file code) for each country; country prompts use the English text of that TSV
+COUNTRY_CODES = {
+    "United Arab Emirates": ("ara", "uae"),
+    "Mexico": ("spn", "mex"),
+    "Ethiopia": ("amh", "eth"),
+    "Germany": ("deu", "deu"),
+    "India": ("hin", "ind"),
+}
+
+# Appended to the instruction of packed prompts (see pack_prompt)
+PACK_INSTRUCTION = ("There are {count} numbered texts below. Answer each of them with a single emotion word from the "
+                    "list, one per line, in the form \"<number>. <emotion>\".")
+# "3. fear", "3) fear", "**3.** fear", ...
+PACKED_ANSWER_PATTERN = re.compile(r"^[\s*#]*(\d+)\s*[.):\-]\**\s*(.+?)\s*$", re.MULTILINE)
+TEXT_PLACEHOLDER = "\x00TEXT\x00"
+# JSONL streams runs resume from (see default_stream_path), kept out of the published output trees
+STREAM_DIR = ".cache/streams"
+
+# Extra fields for the record(s) of the request answered in the current thread or asyncio task (see annotate_record)
+_record_fields = contextvars.ContextVar("record_fields", default=None)
+
+
+def annotate_record(**fields) -> None:
+    """
+    Adds fields to the result record(s) of the current request, e.g. the route that answered a hedged request
+    (see hedging_utils). They are stored by the next ResultSink.add in the same thread or task.
+    """
+    _record_fields.set({**(_record_fields.get() or {}), **fields})
+
+
+def take_record_fields() -> dict:
+    """
+    Returns and clears the fields added by annotate_record since the last call.
+    """
+    fields = _record_fields.get()
+    if fields is None:
+        return {}
+    _record_fields.set(None)
+    return fields
 
 
 def get_prompt(language: str, country: str, text: str) -> str:
@@ -41,7 +95,145 @@ def get_prompt(language: str, country: str, text: str) -> str:
     return prompt
 
 
-def process_file(tsv_file: str, model: str, get_prediction, language: str = None, country: str = None) -> list[dict]:
+def get_prompt_wo_country_pref(language: str, country: str, text: str) -> str:
+    """
+    Generates a prompt in the specified language without stating where the model lives
+    (the no-country-preference variant used in wo_country_pref_outputs/).
+    
+    Args:
+        language (str): The language to generate the prompt in (e.g., "English", "Arabic")
+        country (str): Unused; kept for the same signature as get_prompt
+        text (str): The input text to be evaluated
+        
+    Returns:
+        str: A formatted prompt in the specified language
+        
+    Raises:
+        ValueError: If no valid language is provided
+    """
+    if language == "English":
+        prompt = f"""Choose the best emotion you feel for the given question. Emotions can be only either 'anger', 'fear', 'sadness', 'joy', 'guilt', or 'neutral'. Return only a single emotion word from the list of emotions without further explanation. \nText: {text}\nAnswer:"""
+    elif language == "Arabic":
+        prompt = f"""اختر الحالة العاطفية الأفضل التي تشعر بها تجاه السؤال المطروح. يمكن أن تكون العواطف إما "غضب" أو "خوف" أو "حزن" أو "فرح" أو "ذنب" أو "محايد". أعد فقط كلمة عاطفة واحدة من قائمة العواطف دون أي تفسير إضافي.\n النص: {text}\n الإجابة:"""
+    elif language == "Spanish":
+        prompt = f"""Elige la emoción que sientes más a menudo en la pregunta. Las emociones pueden ser 'enojo','tristeza','culpa','alegría','miedo' o 'neutral'. Solo responde con una palabra de la lista de emociones sin más explicaciones. \nTexto: {text}\nRespuesta:"""
+    elif language == "Amharic":
+        prompt = f"""ለተሰጠው ጥያቄ የሚሰማህን ስሜት ምረጥ። ስሜቶች 'ቁጣ', 'ጥፋተኛ', 'ሀዘን', 'ደስታ', 'ፍርሀት' ወይም 'መደበኛ' ብቻ ሊሆኑ ይችላሉ:: ያለተጨማሪ ማብራሪያ ከስሜቶች ዝርዝር ውስጥ አንዱን ስሜት ብቻ ይመልሱ።\n"ጽሑፍ፡ {text}\nመልስ፡"""
+    elif language == "German":
+        prompt = f"""Wählen Sie die beste Emotion, die Sie für die gestellte Frage empfinden. Emotionen können nur 'wut', 'freude', 'traurigkeit', 'schuld', 'furcht' oder 'neutral' sein. Geben Sie nur ein einziges Emotionswort aus der Liste der Emotionen ohne weitere Erklärung zurück. \nText: {text}\nAntwort:"""
+    elif language == "Hindi":
+        prompt = f"""दिए गए प्रश्न के लिए अपनी सबसे अच्छी भावना चुनें। भावनाएँ केवल 'उदासी', 'आनंद', 'अपराध', 'गुस्सा', 'डर', या 'सामान्य' हो सकती हैं। बिना किसी अतिरिक्त स्पष्टीकरण के भावनाओं की सूची से केवल एक ही भावना शब्द लौटाएँ। \nपाठ: {text}\nउत्तर:"""
+    # elif country:
+    #     prompt = f"You live in {country}, choose the best emotion you feel for the given question. Emotions can be only either 'anger', 'fear', 'sadness', 'joy', 'guilt', or 'neutral'. Return only a single emotion word from the list of emotions without further explanation. \nText: {text}"
+    else:
+        raise ValueError("Either a valid 'language' or 'country' must be provided.")
+    return prompt
+
+
+def pack_prompt(prompt_fn, language: str, country: str, texts: list[str]) -> str:
+    """
+    Builds one prompt asking for the labels of several texts at once.
+
+    The instruction of the regular prompt is kept as is (in the prompt language), followed by PACK_INSTRUCTION
+    and the texts as a numbered list.
+
+    Args:
+        prompt_fn (callable): Builds the single-text prompt from (language, country, text)
+        language (str): Language to use for prompts
+        country (str): Country context to use for prompts
+        texts (list[str]): Texts to label
+
+    Returns:
+        str: The packed prompt
+    """
+    template = prompt_fn(language, country, TEXT_PLACEHOLDER)
+    # Drop the "Text:" line (in whatever language) that introduces the single text
+    instruction = template.split(TEXT_PLACEHOLDER)[0].rsplit("\n", 1)[0].rstrip()
+    items = "\n".join(f"{number}. {' '.join(text.split())}" for number, text in enumerate(texts, start=1))
+    return f"{instruction}\n{PACK_INSTRUCTION.format(count=len(texts))}\n{items}"
+
+
+def unpack_answer(answer: str, count: int) -> dict[int, str]:
+    """
+    Splits the answer to a packed prompt into per-text labels.
+
+    Accepts a numbered list ("1. fear") or a JSON list of labels. Positions missing from the answer are left out
+    of the result; if the numbering does not line up with the texts (duplicates or numbers out of range),
+    nothing is returned, so all texts of the pack fall back to single requests.
+
+    Returns:
+        dict[int, str]: Mapping from position in the pack (0-based) to the raw label
+    """
+    answer = answer or ""
+    try:
+        labels = json.loads(answer)
+        if isinstance(labels, list) and len(labels) == count and all(isinstance(label, str) for label in labels):
+            return dict(enumerate(labels))
+    except json.JSONDecodeError:
+        pass
+
+    labels = {}
+    for number, label in PACKED_ANSWER_PATTERN.findall(answer):
+        position = int(number) - 1
+        if not 0 <= position < count or position in labels:
+            return {}
+        labels[position] = label
+    return labels
+
+
+def split_scored(answer: str) -> tuple[str, dict]:
+    """
+    Splits the answer of a scoring-mode request (see generation_utils.scored_answer) into the label and the
+    rest (distribution and coverage, or the unsupported scoring of an unscored_answer); other answers are
+    returned unchanged with None.
+    """
+    if not answer or not answer.startswith("{"):
+        return answer, None
+    try:
+        scored = json.loads(answer)
+    except json.JSONDecodeError:
+        return answer, None
+    if isinstance(scored, dict) and scored.get("scoring") == "unsupported":
+        return scored["emotion"], {"scoring": "unsupported"}
+    if not isinstance(scored, dict) or "distribution" not in scored:
+        return answer, None
+    return scored["emotion"], {"distribution": scored["distribution"] or None, "coverage": scored.get("coverage")}
+
+
+def make_record(prompt: str, text: str, gt_emotion: str, pred_emotion: str, model: str,
+                language: str = None, country: str = None, scores: dict = None, fields: dict = None) -> dict:
+    """
+    Builds a single result record in the format stored in the output JSON files.
+    In scoring mode (see generation_utils.scored_answer) the label distribution and its coverage follow
+    pred_emotion, or label_scoring marks the prompts whose labels cannot be scored; fields (see annotate_record)
+    come last.
+    """
+    return {
+        "prompt": prompt,
+        "text": text,
+        **({"country": country} if country else {"language": language}),
+        "emotion": gt_emotion,
+        "pred_emotion": pred_emotion,
+        **({"label_distribution": scores["distribution"], "label_coverage": scores["coverage"]}
+           if scores and "distribution" in scores else {}),
+        **({"label_scoring": scores["scoring"]} if scores and "scoring" in scores else {}),
+        "model": model,
+        **(fields or {}),
+    }
+
+
+def prompt_variant(prompt_fn, country: str = None) -> str:
+    """
+    Returns the prompt variant of a run, as named in the results store and eval.py.
+    """
+    if prompt_fn is get_prompt_wo_country_pref:
+        return "wo_country_pref"
+    return "country" if country else "language"
+
+
+def process_file(tsv_file: str, model: str, get_prediction, language: str = None, country: str = None,
+                 output_path: str = None, prompt_fn=get_prompt, pack_size: int = 1, telemetry=None,
+                 rows: list[int] = None, store=None) -> list[dict]:
     """
     Processes a TSV file containing emotion evaluation data and generates predictions using the specified model.
     
@@ -51,47 +243,381 @@ def process_file(tsv_file: str, model: str, get_prediction, language: str = None
         get_prediction (callable): Function to get predictions from the model
         language (str, optional): Language to use for prompts
         country (str, optional): Country context to use for prompts
+        output_path (str, optional): JSONL file to stream results to. Rows already present in it are skipped,
+            so an interrupted run can be resumed by calling process_file again with the same path.
+        prompt_fn (callable): Builds the prompt from (language, country, text); defaults to get_prompt
+        pack_size (int): Number of rows asked per request (see pack_prompt); rows whose answer cannot be
+            matched are asked again one by one
+        telemetry (Telemetry, optional): Traces every request (see telemetry_utils); its progress bar
+            replaces the printed row numbers
+        rows (list[int], optional): Indices of the rows to process, in this order; defaults to all rows
+        store (ResultsStore, optional): Results store every record is also written to (see results_store)
         
     Returns:
         list[dict]: List of dictionaries containing the evaluation results
         
     Note:
-        Either language or country must be provided, but not both
+        Either language or country must be provided, but not both. A row whose request raises TimeoutError (e.g.
+        the deadline of hedging_utils.HedgeTimeoutError) is left out of the results and asked again on resume.
     """
-    results = []
-
-    with open(tsv_file, "r", encoding="utf-8") as file:
-        tsv_reader = csv.reader(file, delimiter="\t")
-        next(tsv_reader)  # Skip header row
+    # (text, gt_emotion, gt_sentiment) for every row, from the columnar dataset cache
+    parsed = load_dataset(tsv_file).rows(language, country)
+    done_rows = completed_rows(output_path) if output_path else set()
+    pending = [index for index in (range(len(parsed)) if rows is None else rows) if index not in done_rows]
+    verbose = telemetry is None or not telemetry.progress
+    if telemetry:
+        get_prediction = telemetry.wrap(get_prediction)
 
-        for count, row in enumerate(tsv_reader, start=1):
-            print(count)
+    with ResultSink(parsed, model, language, country, output_path, store, prompt_variant(prompt_fn, country)) as sink:
+        if pack_size > 1:
+            groups = pack_rows(pending, pack_size)
+            if telemetry:
+                telemetry.add_total(len(groups))
+            unanswered = []
+            for group in groups:
+                if verbose:
+                    print(group[-1] + 1)
+                try:
+                    prompt, answer = get_prediction(model, pack_prompt(prompt_fn, language, country,
+                                                                       [parsed[index][0] for index in group]))
+                except TimeoutError as exc:
+                    sink.skip(group, exc)
+                    continue
+                unanswered += sink.add_packed(group, prompt, answer)
+            pending = unanswered
 
-            # Parse row based on file format
-            if language == "English":
-                text, gt_emotion, gt_sentiment = row        # only for english tsv
-            elif language and not country:
-                text_eng, text, emotion_eng, gt_emotion, sentiment_eng, gt_sentiment = row
-            elif country and not language:
-                text, _, gt_emotion, _, gt_sentiment, _ = row
-            else:
-                raise Exception("ERROR!")
+        if telemetry:
+            telemetry.add_total(len(pending))
+        for index in pending:
+            if verbose:
+                print(index + 1)
 
             # Get prediction from model
-            prompt, pred_emotion = get_prediction(model, get_prompt(language, country, text))
-            
+            try:
+                prompt, pred_emotion = get_prediction(model, prompt_fn(language, country, parsed[index][0]))
+            except TimeoutError as exc:
+                sink.skip([index], exc)
+                continue
+
             # Store results
-            results.append(
-                {
-                    "prompt": prompt,
-                    "text": text,
-                    **({"country": country} if country else {"language": language}),
-                    "emotion": gt_emotion,
-                    "pred_emotion": pred_emotion,
-                    "model": model,
-                }
-            )
-    return results
+            sink.add(index, prompt, pred_emotion)
+    return sink.results()
+
+
+async def gather_predictions(model: str, prompts: list[str], get_prediction, concurrency: int = 8,
+                             on_result=None, verbose: bool = True, on_timeout=None) -> list[tuple[str, str]]:
+    """
+    Runs an async prediction function over many prompts with a bounded number of requests in flight.
+    
+    Args:
+        model (str): Name of the model to use for predictions
+        prompts (list[str]): Prompts to send to the model
+        get_prediction (callable): Coroutine function with the same signature as the sync get_prediction
+        concurrency (int): Maximum number of requests in flight at once
+        on_result (callable, optional): Called as on_result(index, prompt, model_response) as soon as
+            each prediction completes
+        verbose (bool): Print the number of completed predictions as they come in
+        on_timeout (callable, optional): Called as on_timeout(index, exception) when a prediction raises
+            TimeoutError, instead of failing the whole gather; that prompt's result is then None
+        
+    Returns:
+        list[tuple[str, str]]: (prompt, model_response) pairs in the same order as prompts
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def predict(index: int, prompt: str) -> tuple[str, str]:
+        nonlocal done
+        async with semaphore:
+            try:
+                result = await get_prediction(model, prompt)
+            except TimeoutError as exc:
+                if on_timeout is None:
+                    raise
+                on_timeout(index, exc)
+                return None
+        done += 1
+        if verbose:
+            print(done)
+        if on_result:
+            on_result(index, *result)
+        return result
+
+    # gather keeps the results in the order the coroutines were passed in
+    return await asyncio.gather(*(predict(index, prompt) for index, prompt in enumerate(prompts)))
+
+
+async def process_file_async(tsv_file: str, model: str, get_prediction, language: str = None, country: str = None,
+                             concurrency: int = 8, output_path: str = None, prompt_fn=get_prompt,
+                             pack_size: int = 1, telemetry=None, rows: list[int] = None,
+                             store=None) -> list[dict]:
+    """
+    Async counterpart of process_file that sends up to `concurrency` requests at once.
+    
+    Args:
+        tsv_file (str): Path to the TSV file containing the evaluation data
+        model (str): Name of the model to use for predictions
+        get_prediction (callable): Coroutine function to get predictions from the model
+        language (str, optional): Language to use for prompts
+        country (str, optional): Country context to use for prompts
+        concurrency (int): Maximum number of requests in flight at once
+        output_path (str, optional): JSONL file to stream results to as they complete; rows already
+            present in it are skipped
+        prompt_fn (callable): Builds the prompt from (language, country, text); defaults to get_prompt
+        pack_size (int): Number of rows asked per request (see pack_prompt); rows whose answer cannot be
+            matched are asked again one by one
+        telemetry (Telemetry, optional): Traces every request (see telemetry_utils)
+        rows (list[int], optional): Indices of the rows to process, in this order; defaults to all rows
+        store (ResultsStore, optional): Results store every record is also written to (see results_store)
+        
+    Returns:
+        list[dict]: List of dictionaries containing the evaluation results, in the original row order; rows
+            whose request timed out are left out, as in process_file
+    """
+    parsed = load_dataset(tsv_file).rows(language, country)
+    done_rows = completed_rows(output_path) if output_path else set()
+    pending = [i for i in (range(len(parsed)) if rows is None else rows) if i not in done_rows]
+    verbose = telemetry is None or not telemetry.progress
+    if telemetry:
+        get_prediction = telemetry.wrap_async(get_prediction)
+
+    with ResultSink(parsed, model, language, country, output_path, store, prompt_variant(prompt_fn, country)) as sink:
+        if pack_size > 1:
+            groups = pack_rows(pending, pack_size)
+            if telemetry:
+                telemetry.add_total(len(groups))
+            prompts = [pack_prompt(prompt_fn, language, country, [parsed[i][0] for i in group]) for group in groups]
+            unanswered = []
+
+            def on_packed(index: int, prompt: str, answer: str) -> None:
+                unanswered.extend(sink.add_packed(groups[index], prompt, answer))
+
+            await gather_predictions(model, prompts, get_prediction, concurrency, on_packed, verbose,
+                                     lambda index, exc: sink.skip(groups[index], exc))
+            pending = sorted(unanswered)
+
+        if telemetry:
+            telemetry.add_total(len(pending))
+        prompts = [prompt_fn(language, country, parsed[i][0]) for i in pending]
+        await gather_predictions(model, prompts, get_prediction, concurrency,
+                                 lambda index, prompt, pred_emotion: sink.add(pending[index], prompt, pred_emotion),
+                                 verbose, lambda index, exc: sink.skip([pending[index]], exc))
+    return sink.results()
+
+
+def pack_rows(rows: list[int], pack_size: int) -> list[list[int]]:
+    """
+    Splits row indices into consecutive groups of at most pack_size rows.
+    """
+    return [rows[i:i + pack_size] for i in range(0, len(rows), pack_size)]
+
+
+class ResultSink:
+    """
+    Collects the records of a run, streaming them to a JSONL file when output_path is given.
+
+    Args:
+        parsed (list[tuple[str, str, str]]): (text, gt_emotion, gt_sentiment) of every row
+        model (str): Name of the model
+        language (str, optional): Language used for prompts
+        country (str, optional): Country context used for prompts
+        output_path (str, optional): JSONL file the records are appended to
+        store (ResultsStore, optional): Results store the records are also written to
+        variant (str): Prompt variant of the records in the store (see prompt_variant)
+    """
+
+    def __init__(self, parsed: list, model: str, language: str = None, country: str = None,
+                 output_path: str = None, store=None, variant: str = "language"):
+        self.parsed = parsed
+        self.model = model
+        self.language = language
+        self.country = country
+        self.output_path = output_path
+        self.writer = JsonlWriter(output_path) if output_path else None
+        self.store = store
+        self.variant = variant
+        self.records = {}
+        self.skipped = []
+
+    def add(self, row: int, prompt: str, pred_emotion: str, fields: dict = None) -> None:
+        text, gt_emotion, _ = self.parsed[row]
+        pred_emotion, scores = split_scored(pred_emotion)
+        record = make_record(prompt, text, gt_emotion, pred_emotion, self.model, self.language, self.country,
+                             scores, take_record_fields() if fields is None else fields)
+        if self.store:
+            self.store.add(record, row, self.variant, self.output_path)
+        if self.writer:
+            self.writer.write({"row": row, **record})
+        else:
+            self.records[row] = record
+
+    def add_packed(self, group: list[int], prompt: str, answer: str) -> list[int]:
+        """
+        Stores the rows of a packed request that got an answer and returns the rows that did not.
+        """
+        labels = unpack_answer(answer, len(group))
+        fields = take_record_fields()
+        for position, row in enumerate(group):
+            if position in labels:
+                self.add(row, prompt, labels[position], fields)
+        return [row for position, row in enumerate(group) if position not in labels]
+
+    def skip(self, rows: list[int], error: Exception) -> None:
+        """
+        Leaves out rows whose request timed out; with output_path they are asked again when the run is resumed.
+        """
+        self.skipped += rows
+        print(f"Rows {', '.join(str(row + 1) for row in rows)} skipped: {type(error).__name__}: {error}")
+
+    def results(self) -> list[dict]:
+        """
+        Returns all records in the original row order, including those of earlier runs in output_path.
+        """
+        if self.output_path:
+            return load_jsonl(self.output_path)
+        return [self.records[row] for row in sorted(self.records)]
+
+    def close(self) -> None:
+        if self.skipped:
+            print(f"{len(self.skipped)} rows timed out and have no record; run again to retry them")
+        if self.store:
+            self.store.flush()
+        if self.writer:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def truncate_partial_line(path: str, chunk_size: int = 4096) -> None:
+    """
+    Cuts a file back to its last line break, dropping a last line whose write was interrupted.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+class JsonlWriter:
+    """
+    Appends result records to a JSONL file as soon as they are produced.
+    
+    Every record is flushed to the OS immediately and the file is fsynced every `fsync_every` records
+    and on close, so a crash loses at most the records of the last unsynced batch. A partial last line left
+    by a crash is cut off before appending, so the next record starts on a line of its own.
+    
+    Args:
+        path (str): Path of the JSONL file (created if missing, appended to otherwise)
+        fsync_every (int): Number of records between fsync calls
+    """
+
+    def __init__(self, path: str, fsync_every: int = 20):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        truncate_partial_line(path)
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def default_stream_path(output_path: str, stream_dir: str = STREAM_DIR) -> str:
+    """
+    Returns the JSONL stream of a run writing output_path, under stream_dir
+    (e.g. gpt4_outputs/eng_gpt-4.json -> .cache/streams/gpt4_outputs/eng_gpt-4.jsonl).
+    """
+    relative = os.path.normpath(output_path)
+    if os.path.isabs(relative) or relative.startswith(os.pardir):
+        relative = os.path.splitdrive(os.path.abspath(output_path))[1].lstrip(os.sep)
+    return os.path.join(stream_dir, relative + "l")
+
+
+def read_jsonl(path: str) -> dict[int, dict]:
+    """
+    Reads a results JSONL file written by JsonlWriter.
+    
+    A truncated last line (from a crash mid-write) is ignored.
+    
+    Args:
+        path (str): Path of the JSONL file
+        
+    Returns:
+        dict[int, dict]: Mapping from TSV row index to the record stored for it
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record.pop("row")] = record
+    return records
+
+
+def completed_rows(path: str) -> set[int]:
+    """
+    Returns the TSV row indices already present in a results JSONL file.
+    """
+    return set(read_jsonl(path))
+
+
+def load_jsonl(path: str) -> list[dict]:
+    """
+    Loads a results JSONL file as a list of records in the original row order.
+    """
+    records = read_jsonl(path)
+    return [records[row] for row in sorted(records)]
+
+
+def export_json(jsonl_path: str, output_path: str) -> None:
+    """
+    Converts a results JSONL file into the pretty-printed JSON format used by eval.py.
+    
+    Args:
+        jsonl_path (str): Path of the JSONL file written by process_file
+        output_path (str): Path where the JSON file should be written
+    """
+    write_json(load_jsonl(jsonl_path), output_path)
 
 
 def write_json(data: list[dict], output_path: str) -> None:
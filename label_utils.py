@@ -0,0 +1,240 @@
+"""
+Emotion label sets of the benchmark and mapping of model answers to canonical label IDs.
+Every language uses its own six emotion words (see inference_utils.get_prompt); they all map to the same
+six canonical English classes.
+
+The normalizer is compiled once from the labels that appear in the prompts: a hash map from Unicode-normalized
+labels to class IDs answers the common single-word case in constant time, and an Aho-Corasick automaton finds
+labels inside verbose answers such as "The closest emotion would be: fear".
+"""
+
+import functools
+import re
+import unicodedata
+from collections import deque
+from inference_utils import LANGUAGE_CODES, get_prompt, get_prompt_wo_country_pref
+
+
+EMOTIONS = ("anger", "fear", "sadness", "joy", "guilt", "neutral")
+EMOTION_IDS = {emotion: index for index, emotion in enumerate(EMOTIONS)}
+INVALID_ID = -1  # Answers that do not match any label
+
+# Emotion words used in the prompts and gold labels of each language
+LANGUAGE_LABELS = {
+    "English": {"anger": "anger", "fear": "fear", "sadness": "sadness", "joy": "joy", "guilt": "guilt", "neutral": "neutral"},
+    "Arabic": {"غضب": "anger", "خوف": "fear", "حزن": "sadness", "فرح": "joy", "ذنب": "guilt", "محايد": "neutral"},
+    "Spanish": {"enojo": "anger", "miedo": "fear", "tristeza": "sadness", "alegría": "joy", "culpa": "guilt", "neutral": "neutral"},
+    "Amharic": {"ቁጣ": "anger", "ፍርሀት": "fear", "ሀዘን": "sadness", "ደስታ": "joy", "ጥፋተኛ": "guilt", "መደበኛ": "neutral"},
+    "German": {"wut": "anger", "furcht": "fear", "traurigkeit": "sadness", "freude": "joy", "schuld": "guilt", "neutral": "neutral"},
+    "Hindi": {"गुस्सा": "anger", "डर": "fear", "उदासी": "sadness", "आनंद": "joy", "अपराध": "guilt", "सामान्य": "neutral"},
+}
+
+# Languages whose labels are not scored from log-probabilities (see generation_utils.label_distribution): their
+# first answer token is usually a UTF-8 fragment that matches no label or is shared by several of them
+UNSCORED_LANGUAGES = ("Arabic", "Amharic", "Hindi")
+UNSCORED_LABELS = frozenset(word for language in UNSCORED_LANGUAGES for word in LANGUAGE_LABELS[language])
+
+# Quoted words in the instruction line of a prompt, e.g. 'anger' or "غضب"
+LABEL_PATTERN = re.compile(r"'([^']+)'|\"([^\"]+)\"")
+ARABIC_ARTICLE = "ال"
+
+
+def extract_labels(prompt: str) -> list[str]:
+    """
+    Returns the emotion labels listed in the instruction line of a prompt, in prompt order.
+    """
+    return [single or double for single, double in LABEL_PATTERN.findall(prompt.split("\n")[0])]
+
+
+def scoring_supported(labels: list[str]) -> bool:
+    """
+    Checks whether the labels of a prompt can be scored from the top alternatives of the first answer token.
+    """
+    return not any(label in UNSCORED_LABELS for label in labels)
+
+
+def fold(text: str) -> str:
+    """
+    Unicode-normalizes text for matching: NFKC and case folding.
+    """
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def strip_accents(text: str) -> str:
+    """
+    Removes combining accents (alegría -> alegria). Only meant for Latin-script words.
+    """
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or unicodedata.category(c) in ("Mn", "Mc")
+
+
+def strip_edges(text: str) -> str:
+    """Removes whitespace, punctuation and symbols (quotes, danda, markdown, ...) around a word."""
+    start, end = 0, len(text)
+    while start < end and not _is_word_char(text[start]):
+        start += 1
+    while end > start and not _is_word_char(text[end - 1]):
+        end -= 1
+    return text[start:end]
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton finding all occurrences of a set of keywords in one pass over the text.
+
+    Args:
+        keywords (dict[str, int]): Keyword to value mapping
+    """
+
+    def __init__(self, keywords: dict[str, int]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword, value in keywords.items():
+            node = 0
+            for char in keyword:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append((len(keyword), value))
+
+        # Breadth-first construction of the failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find_all(self, text: str) -> list[tuple[int, int, int]]:
+        """
+        Returns (start, end, value) for every keyword occurrence in text.
+        """
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.output[node]:
+                matches.append((i + 1 - length, i + 1, value))
+        return matches
+
+
+class LabelNormalizer:
+    """
+    Maps raw model answers or gold labels to canonical label IDs.
+
+    Args:
+        labels (dict[str, str]): Label word (any language) to canonical English emotion
+    """
+
+    def __init__(self, labels: dict[str, str]):
+        self.lookup = {}
+        for word, emotion in labels.items():
+            label_id = EMOTION_IDS[emotion]
+            for variant in self._variants(fold(word)):
+                self.lookup[variant] = label_id
+        self.matcher = AhoCorasick(self.lookup)
+        self.normalize = functools.lru_cache(maxsize=65536)(self._normalize)
+
+    @staticmethod
+    def _variants(word: str) -> set[str]:
+        variants = {word}
+        if strip_accents(word).isascii():
+            variants.add(strip_accents(word))
+        if "؀" <= word[0] <= "ۿ":
+            variants.add(ARABIC_ARTICLE + word)
+        return variants
+
+    def _match_verbose(self, text: str) -> int:
+        found = set()
+        for start, end, label_id in self.matcher.find_all(text):
+            before = text[start - 1] if start > 0 else " "
+            after = text[end] if end < len(text) else " "
+            if not _is_word_char(before) and not _is_word_char(after):
+                found.add(label_id)
+        return found.pop() if len(found) == 1 else INVALID_ID
+
+    def _normalize(self, text: str) -> int:
+        if not text:
+            return INVALID_ID
+        folded = fold(text)
+        label_id = self.lookup.get(strip_edges(folded))
+        if label_id is not None:
+            return label_id
+        # Verbose answer: a single class mentioned in the whole answer, or else in its first or last line
+        label_id = self._match_verbose(folded)
+        lines = [line for line in folded.splitlines() if line.strip()]
+        if label_id == INVALID_ID and len(lines) > 1:
+            label_id = self._match_verbose(lines[0])
+            if label_id == INVALID_ID:
+                label_id = self._match_verbose(lines[-1])
+        return label_id
+
+    def __call__(self, text: str) -> int:
+        return self.normalize(text)
+
+    def normalize_many(self, texts: list[str]) -> list[int]:
+        """
+        Normalizes many answers; repeated strings are only normalized once.
+        """
+        return [self.normalize(text or "") for text in texts]
+
+
+def compile_labels() -> dict[str, str]:
+    """
+    Collects the label words from all prompt templates and maps them to canonical emotions.
+
+    Raises:
+        ValueError: If a prompt lists labels that are missing from LANGUAGE_LABELS
+    """
+    labels = {}
+    prompts = [(language, get_prompt(language, None, "")) for language in LANGUAGE_CODES]
+    prompts += [(language, get_prompt_wo_country_pref(language, None, "")) for language in LANGUAGE_CODES]
+    prompts.append(("English", get_prompt(None, "Mexico", "")))
+    for language, prompt in prompts:
+        for word in extract_labels(prompt):
+            if word not in LANGUAGE_LABELS[language]:
+                raise ValueError(f"Label '{word}' of the {language} prompt has no entry in LANGUAGE_LABELS")
+            labels[word] = LANGUAGE_LABELS[language][word]
+    return labels
+
+
+@functools.lru_cache(maxsize=None)
+def get_normalizer() -> LabelNormalizer:
+    """
+    Returns the shared normalizer, compiling it on first use.
+    """
+    return LabelNormalizer(compile_labels())
+
+
+def normalize_label(text: str) -> int:
+    """
+    Maps a gold label or a model answer to its canonical label ID.
+
+    Args:
+        text (str): Label or raw model response (e.g. "Sadness\\n", "حزن", "The closest emotion is: fear")
+
+    Returns:
+        int: Index into EMOTIONS, or INVALID_ID if the text matches no label or several different ones
+    """
+    return get_normalizer()(text)
+
+
+def canonical_emotion(text: str):
+    """
+    Maps a gold label or a model answer to its canonical English emotion, or None if it matches no label.
+    """
+    label_id = normalize_label(text)
+    return None if label_id == INVALID_ID else EMOTIONS[label_id]
@@ -0,0 +1,471 @@
+"""
+Local stand-in server for the provider APIs used by the inference scripts.
+It answers every prompt with one of the emotion words listed in the prompt, so the pipeline can be run
+end to end without API credits. Point the SDK clients at it with base_url:
+    OpenAI:    http://127.0.0.1:<port>/v1
+    Anthropic: http://127.0.0.1:<port>
+    Ollama:    http://127.0.0.1:<port> (host)
+    Gemini:    genai.configure(transport="rest", client_options={"api_endpoint": "http://127.0.0.1:<port>"})
+
+The chat endpoints can simulate a real provider (see FaultProfile): random latency, server errors and periodic
+bursts of 429 responses with Retry-After, so throughput and retry behaviour can be measured offline.
+
+Supported endpoints:
+    POST /v1/chat/completions                                                                (OpenAI)
+    POST /v1/messages                                                                        (Anthropic)
+    POST /v1beta/models/{model}:generateContent                                              (Gemini, REST)
+    POST /v1/files, GET /v1/files/{id}/content, POST /v1/batches, GET /v1/batches/{id}   (OpenAI Batch API)
+    POST /v1/messages/batches, GET /v1/messages/batches/{id}[/results]                     (Anthropic Message Batches)
+    POST /api/chat, POST /api/generate, GET /api/ps                                          (Ollama, non-streaming)
+    GET /mock/stats                                                                          (request counters)
+"""
+
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from label_utils import extract_labels
+
+
+def mock_answer(prompt: str) -> str:
+    """
+    Picks one of the quoted emotion labels in the prompt, deterministically per prompt.
+    Packed prompts (inference_utils.pack_prompt) get one numbered label per question.
+    """
+    labels = extract_labels(prompt)
+    if not labels:
+        return "neutral"
+    items = re.findall(r"^(\d+)\. (.*)$", prompt, re.MULTILINE) if "numbered texts" in prompt else []
+    if items:
+        return "\n".join(f"{number}. {mock_answer(prompt.split(chr(10))[0] + chr(10) + text)}" for number, text in items)
+    digest = hashlib.md5(prompt.encode("utf-8")).digest()
+    return labels[digest[0] % len(labels)]
+
+
+def _prompt_of(messages: list[dict]) -> str:
+    return messages[-1]["content"] if messages else ""
+
+
+def _structured(answer: str) -> str:
+    return json.dumps({"emotion": answer}, ensure_ascii=False)
+
+
+def mock_top_logprobs(prompt: str, count: int = 20) -> list[dict]:
+    """
+    Alternatives of the first answer token: mock_answer's label is the most likely, the other labels and a
+    filler token share the rest.
+    """
+    answer = mock_answer(prompt)
+    labels = [label for label in extract_labels(prompt) if label != answer]
+    alternatives = [(answer, 0.6)] + [(label, 0.3 / len(labels)) for label in labels] + [("The", 0.1)]
+    return [{"token": token, "logprob": math.log(p), "bytes": list(token.encode("utf-8"))}
+            for token, p in alternatives[:count]]
+
+
+def openai_completion(body: dict) -> dict:
+    """Builds a chat.completions response body for a request body."""
+    prompt = _prompt_of(body.get("messages", []))
+    answer = mock_answer(prompt)
+    if body.get("response_format", {}).get("type") == "json_schema":
+        answer = _structured(answer)
+    logprobs = None
+    if body.get("logprobs"):
+        top = mock_top_logprobs(prompt, body.get("top_logprobs") or 0)
+        logprobs = {"content": [{**top[0], "top_logprobs": top}], "refusal": None}
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer},
+            "logprobs": logprobs,
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": 1, "total_tokens": len(prompt.split()) + 1},
+    }
+
+
+def anthropic_message(body: dict) -> dict:
+    """Builds a messages response body for a request body; a forced tool call is answered with a tool_use block."""
+    prompt = _prompt_of(body.get("messages", []))
+    tool = (body.get("tool_choice") or {}).get("name")
+    if tool:
+        content = {"type": "tool_use", "id": "toolu_mock", "name": tool, "input": {"emotion": mock_answer(prompt)}}
+    else:
+        content = {"type": "text", "text": mock_answer(prompt)}
+    return {
+        "id": "msg_mock",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model"),
+        "content": [content],
+        "stop_reason": "tool_use" if tool else "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": len(prompt.split()), "output_tokens": 1},
+    }
+
+
+def ollama_chat(body: dict) -> dict:
+    """Builds a non-streaming /api/chat response body, with the timing fields Ollama reports."""
+    prompt = _prompt_of(body.get("messages", []))
+    answer = mock_answer(prompt)
+    prompt_tokens, output_tokens = len(prompt.split()), len(answer.split())
+    if isinstance(body.get("format"), dict):
+        answer = _structured(answer)
+    logprobs = None
+    if body.get("logprobs"):
+        top = [{"token": alt["token"], "logprob": alt["logprob"]}
+               for alt in mock_top_logprobs(prompt, body.get("top_logprobs") or 0)]
+        logprobs = [{**top[0], "top_logprobs": top}]
+    return {
+        "model": body.get("model"),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "message": {"role": "assistant", "content": answer},
+        **({"logprobs": logprobs} if logprobs else {}),
+        "done": True,
+        "done_reason": "stop",
+        # Durations are in nanoseconds
+        "total_duration": 1_000_000 * (prompt_tokens + output_tokens),
+        "load_duration": 0,
+        "prompt_eval_count": prompt_tokens,
+        "prompt_eval_duration": 100_000 * prompt_tokens,
+        "eval_count": output_tokens,
+        "eval_duration": 10_000_000 * output_tokens,
+    }
+
+
+def gemini_content(body: dict) -> dict:
+    """Builds a generateContent response body (REST JSON) for a request body."""
+    contents = body.get("contents") or [{}]
+    prompt = "".join(part.get("text", "") for part in contents[-1].get("parts", []))
+    answer = mock_answer(prompt)
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": answer}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {"promptTokenCount": len(prompt.split()), "candidatesTokenCount": 1,
+                          "totalTokenCount": len(prompt.split()) + 1},
+    }
+
+
+def error_body(provider: str, status: int, message: str) -> dict:
+    """Builds an error response body in the provider's format."""
+    if provider == "anthropic":
+        kind = "rate_limit_error" if status == 429 else "api_error"
+        return {"type": "error", "error": {"type": kind, "message": message}}
+    if provider == "gemini":
+        return {"error": {"code": status, "message": message,
+                          "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}}
+    if provider == "ollama":
+        return {"error": message}
+    return {"error": {"type": "rate_limit_exceeded" if status == 429 else "server_error", "message": message,
+                      "code": None, "param": None}}
+
+
+@dataclass
+class FaultProfile:
+    """
+    Simulated behaviour of the chat endpoints.
+
+    Args:
+        latency_ms (float): Median response latency in milliseconds
+        latency_distribution (str): "fixed", "exponential" (mean latency_ms) or "lognormal" (median latency_ms)
+        latency_sigma (float): Shape of the lognormal distribution; 1.0 gives a long tail
+        error_rate (float): Fraction of requests answered with a 500/503 error
+        stall_rate (float): Fraction of requests that hang for stall_seconds before being answered
+        stall_seconds (float): How long a stalled request hangs
+        burst_every (float): Seconds between 429 bursts; 0 disables them
+        burst_length (float): Seconds each burst lasts; every request during a burst gets a 429
+        retry_after (float): Retry-After sent with 429 responses; None uses the time left in the burst
+        seed (int): Seed of the random generator
+    """
+    latency_ms: float = 0.0
+    latency_distribution: str = "lognormal"
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall_seconds: float = 30.0
+    burst_every: float = 0.0
+    burst_length: float = 0.0
+    retry_after: float = None
+    seed: int = 0
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Returns a latency in seconds."""
+        if self.latency_ms <= 0:
+            return 0.0
+        if self.latency_distribution == "fixed":
+            return self.latency_ms / 1000
+        if self.latency_distribution == "exponential":
+            return rng.expovariate(1000 / self.latency_ms)
+        return rng.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+    def burst_remaining(self, elapsed: float) -> float:
+        """Returns the seconds left in the current 429 burst, or 0 outside bursts."""
+        if not self.burst_every or not self.burst_length:
+            return 0.0
+        phase = elapsed % self.burst_every
+        start = self.burst_every - self.burst_length
+        return self.burst_every - phase if phase >= start else 0.0
+
+
+class MockState:
+    """In-memory storage of uploaded files and batches."""
+
+    def __init__(self, faults: FaultProfile = None):
+        self.lock = threading.Lock()
+        self.faults = faults or FaultProfile()
+        self.rng = random.Random(self.faults.seed)
+        self.started = time.monotonic()
+        self.counters = {"requests": 0, "errors": 0, "throttled": 0, "stalled": 0}
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+        self.message_batches = {}
+        self.loaded_models = {}  # Ollama model name -> keep_alive of the last request
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}{next(self.ids)}"
+
+    def draw_fault(self) -> tuple[float, int, float]:
+        """
+        Decides the simulated outcome of a chat request.
+
+        Returns:
+            tuple[float, int, float]: (latency in seconds, HTTP status, Retry-After in seconds or None)
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            burst = self.faults.burst_remaining(time.monotonic() - self.started)
+            if burst:
+                self.counters["throttled"] += 1
+                retry_after = self.faults.retry_after if self.faults.retry_after is not None else burst
+                return 0.0, 429, retry_after
+            latency = self.faults.sample_latency(self.rng)
+            if self.rng.random() < self.faults.stall_rate:
+                self.counters["stalled"] += 1
+                latency += self.faults.stall_seconds
+            if self.rng.random() < self.faults.error_rate:
+                self.counters["errors"] += 1
+                return latency, self.rng.choice((500, 503)), None
+            return latency, 200, None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "faults": asdict(self.faults)}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = None
+    protocol_version = "HTTP/1.1"  # Keep connections open, like the real APIs
+    disable_nagle_algorithm = True  # Headers and body are written separately; avoid delayed-ACK stalls
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status: int = 200) -> None:
+        self._send(json.dumps(payload).encode("utf-8"), "application/json", status)
+
+    def _send(self, data: bytes, content_type: str, status: int = 200, headers: dict = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (e.g. a hedged request answered by another attempt)
+            pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _not_found(self) -> None:
+        self._send_json({"error": {"type": "not_found_error", "message": self.path}}, 404)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        state = self.state
+        if path == "/mock/stats":
+            return self._send_json(state.stats())
+        if path == "/api/ps":
+            return self._send_json({"models": [{"name": name, "model": name, "keep_alive": keep_alive}
+                                               for name, keep_alive in state.loaded_models.items()]})
+        if match := re.fullmatch(r"/v1/files/([^/]+)/content", path):
+            file = state.files.get(match.group(1))
+            return self._send(file["content"], "application/jsonl") if file else self._not_found()
+        if match := re.fullmatch(r"/v1/batches/([^/]+)", path):
+            batch = state.batches.get(match.group(1))
+            return self._send_json(batch) if batch else self._not_found()
+        if match := re.fullmatch(r"/v1/messages/batches/([^/]+)", path):
+            batch = state.message_batches.get(match.group(1))
+            return self._send_json(batch["info"]) if batch else self._not_found()
+        if match := re.fullmatch(r"/v1/messages/batches/([^/]+)/results", path):
+            batch = state.message_batches.get(match.group(1))
+            return self._send(batch["results"], "application/binary") if batch else self._not_found()
+        self._not_found()
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/v1/files":
+            return self._upload_file()
+        if path == "/v1/batches":
+            return self._create_batch(json.loads(self._body()))
+        if path == "/v1/messages/batches":
+            return self._create_message_batch(json.loads(self._body()))
+        if path == "/v1/chat/completions":
+            return self._chat("openai", openai_completion, json.loads(self._body()))
+        if path == "/v1/messages":
+            return self._chat("anthropic", anthropic_message, json.loads(self._body()))
+        if re.fullmatch(r"/v1beta/models/[^/]+:generateContent", path):
+            return self._chat("gemini", gemini_content, json.loads(self._body()))
+        if path == "/api/chat":
+            return self._chat("ollama", lambda body: self._ollama(path, body), json.loads(self._body()))
+        if path == "/api/generate":
+            return self._send_json(self._ollama(path, json.loads(self._body())))
+        self._not_found()
+
+    def _chat(self, provider: str, respond, body: dict) -> None:
+        """Answers a chat request after the simulated latency, or with a simulated error."""
+        latency, status, retry_after = self.state.draw_fault()
+        if latency:
+            time.sleep(latency)
+        if status == 200:
+            return self._send_json(respond(body))
+        headers = {"Retry-After": f"{retry_after:.3f}"} if retry_after is not None else None
+        message = "Rate limit exceeded (simulated)" if status == 429 else "Server error (simulated)"
+        self._send(json.dumps(error_body(provider, status, message)).encode("utf-8"), "application/json",
+                   status, headers)
+
+    def _ollama(self, path: str, body: dict) -> dict:
+        with self.state.lock:
+            self.state.loaded_models[body.get("model")] = body.get("keep_alive")
+        if path == "/api/chat":
+            return ollama_chat(body)
+        # An empty /api/generate request only loads the model
+        response = ollama_chat({"model": body.get("model"), "messages": [{"content": body.get("prompt", "")}]})
+        response["response"] = response.pop("message")["content"] if body.get("prompt") else ""
+        response["done_reason"] = "stop" if body.get("prompt") else "load"
+        return response
+
+    def _upload_file(self) -> None:
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(header + self._body())
+        content, filename = b"", "upload.jsonl"
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                content = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+        with self.state.lock:
+            file_id = self.state.new_id("file-")
+            self.state.files[file_id] = {"content": content}
+        self._send_json({
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": "batch", "status": "processed",
+        })
+
+    def _create_batch(self, body: dict) -> None:
+        lines = self.state.files[body["input_file_id"]]["content"].decode("utf-8").splitlines()
+        output = []
+        for line in filter(None, lines):
+            request = json.loads(line)
+            output.append({
+                "id": f"batch_req_{request['custom_id']}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": "mock", "body": openai_completion(request["body"])},
+                "error": None,
+            })
+        with self.state.lock:
+            output_id = self.state.new_id("file-")
+            self.state.files[output_id] = {"content": "".join(json.dumps(o) + "\n" for o in output).encode("utf-8")}
+            batch_id = self.state.new_id("batch_")
+            now = int(time.time())
+            self.state.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": body["endpoint"], "errors": None,
+                "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                "status": "completed", "output_file_id": output_id, "error_file_id": None,
+                "created_at": now, "completed_at": now,
+                "request_counts": {"total": len(output), "completed": len(output), "failed": 0},
+            }
+        self._send_json(self.state.batches[batch_id])
+
+    def _create_message_batch(self, body: dict) -> None:
+        results = []
+        for request in body["requests"]:
+            results.append({
+                "custom_id": request["custom_id"],
+                "result": {"type": "succeeded", "message": anthropic_message(request["params"])},
+            })
+        host = f"http://{self.headers['Host']}"
+        with self.state.lock:
+            batch_id = self.state.new_id("msgbatch_")
+            now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            self.state.message_batches[batch_id] = {
+                "info": {
+                    "id": batch_id, "type": "message_batch", "processing_status": "ended",
+                    "request_counts": {"processing": 0, "succeeded": len(results), "errored": 0,
+                                       "canceled": 0, "expired": 0},
+                    "ended_at": now, "created_at": now, "expires_at": now, "cancel_initiated_at": None,
+                    "archived_at": None, "results_url": f"{host}/v1/messages/batches/{batch_id}/results",
+                },
+                "results": "".join(json.dumps(r) + "\n" for r in results).encode("utf-8"),
+            }
+        self._send_json(self.state.message_batches[batch_id]["info"])
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # The default backlog of 5 drops connections of bursts of (hedged) requests
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, faults: FaultProfile = None) -> ThreadingHTTPServer:
+    """
+    Starts the stand-in server in a background thread.
+
+    Args:
+        host (str): Interface to bind to
+        port (int): Port to bind to; 0 picks a free port (read it from server.server_address)
+        faults (FaultProfile, optional): Simulated latency and errors of the chat endpoints; none by default
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it
+    """
+    handler = type("Handler", (MockHandler,), {"state": MockState(faults)})
+    server = MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in server for the provider APIs")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Median response latency")
+    parser.add_argument("--latency-distribution", choices=["fixed", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500/503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--stall-seconds", type=float, default=30.0, help="How long a stalled request hangs")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="Seconds between 429 bursts")
+    parser.add_argument("--burst-length", type=float, default=0.0, help="Seconds each 429 burst lasts")
+    args = parser.parse_args()
+
+    faults = FaultProfile(latency_ms=args.latency_ms, latency_distribution=args.latency_distribution,
+                          error_rate=args.error_rate, stall_rate=args.stall_rate,
+                          stall_seconds=args.stall_seconds, burst_every=args.burst_every, burst_length=args.burst_length)
+    server = start_server(port=args.port, faults=faults)
+    print(f"Mock server listening on http://{server.server_address[0]}:{server.server_address[1]}")
+    threading.Event().wait()
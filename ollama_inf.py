@@ -2,10 +2,21 @@
 Script for running inference using Ollama models.
 This script processes text data and generates emotion predictions using locally hosted Ollama models.
 It supports both language-specific and country-specific evaluations.
+
+The model is loaded once and kept resident (KEEP_ALIVE), generation is capped to the few tokens an emotion word
+needs (GENERATION) and requests are sent concurrently up to the server's parallel slot count, so start the server
+with OLLAMA_NUM_PARALLEL set to at least CONCURRENCY. Runs against mock_server.py work without a model or GPU.
 """
 
-from inference_utils import process_file, write_json
-from ollama import chat, ChatResponse
+from client_utils import get_client
+from providers import RunConfig, run_evaluation
+from generation_utils import GenerationConfig, ollama_params, ollama_scored, ollama_usage, parse_structured
+from inference_utils import default_stream_path
+from telemetry_utils import record_usage
+import os
+import sys
+import threading
+import time
 
 # Configuration for the evaluation
 TSV_FILE_PATH = "data/test/test2.tsv"
@@ -14,20 +25,109 @@ LANG = "Arabic"     # "English", "Arabic", "Spanish", "German", "Amharic", "Hind
 COUNTRY = None      # "Ethiopia", "United Arab Emirates", "Germany", "India", "Mexico", None
 MODEL_NAME = "llama3.2:1b-instruct-q8_0"  # Local Llama model to use
 OUTPUT_JSON_PATH = "test.json"
+# Results are streamed here while running so an interrupted run resumes where it stopped (under .cache/streams/)
+STREAM_PATH = default_stream_path(OUTPUT_JSON_PATH)
+# Send requests concurrently instead of one row at a time
+ASYNC_MODE = True
+# Requests in flight; should match the server's OLLAMA_NUM_PARALLEL (extra requests just queue on the server)
+CONCURRENCY = int(os.getenv("OLLAMA_NUM_PARALLEL", 4))
+# Reuse responses from earlier runs; in replay mode uncached prompts raise instead of calling the API
+CACHE_PATH = ".cache/responses.sqlite"
+CACHE_REPLAY = False
+# Per-request trace (JSONL), Prometheus metrics and a progress bar are written here; None disables telemetry
+TELEMETRY_DIR = "telemetry"
+# Every record is also written to this results store (see results_store.py); None disables it
+RESULTS_DB = "results.sqlite"
+# Hedge slow requests and fail over to other routes (see hedging_utils); None sends every request once
+HEDGE = None        # e.g. hedging_utils.HedgePolicy(percentile=0.95, deadline=60)
+HEDGE_ROUTES = []   # Other "provider:model" routes, e.g. "anthropic:claude-3-5-sonnet-20240620"
+OLLAMA_HOST = None  # e.g. "http://localhost:11434"; None uses OLLAMA_HOST from the environment or the default
+
+# How long the model stays loaded after the last request
+KEEP_ALIVE = "30m"
+# Server options sent with every request; the prompts are short, so a small context leaves memory
+# for more parallel slots
+OPTIONS = {"num_ctx": 1024}
+# Rows asked per request; above 1, numbered questions are packed into one prompt (see inference_utils.pack_prompt)
+PACK_SIZE = 1
+# Output token cap, stop sequences and structured (label-constrained) answers; see generation_utils.py.
+# scoring=True asks for one token with its top logprobs and stores the label distribution in the records
+GENERATION = GenerationConfig(max_tokens=16, temperature=0, structured=False, scoring=False).for_pack(PACK_SIZE)
+CACHE_PARAMS = GENERATION.cache_params(**OPTIONS)
 
 
-def get_prediction(model: str, prompt: str) -> tuple[str, str]:
+class ThroughputStats:
+    """
+    Collects the token counts and timings Ollama reports with each response.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.monotonic()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.eval_seconds = 0.0
+
+    def add(self, response) -> None:
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += response.get("prompt_eval_count") or 0
+            self.output_tokens += response.get("eval_count") or 0
+            self.eval_seconds += (response.get("eval_duration") or 0) / 1e9
+
+    def stats(self) -> dict:
+        """
+        Returns the totals, the overall output tokens/sec (wall clock, all slots together) and the
+        average decode speed of a single request.
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens,
+                "seconds": round(elapsed, 2),
+                "requests_per_sec": round(self.requests / elapsed, 2) if elapsed else 0.0,
+                "tokens_per_sec": round(self.output_tokens / elapsed, 2) if elapsed else 0.0,
+                "decode_tokens_per_sec": round(self.output_tokens / self.eval_seconds, 2) if self.eval_seconds else 0.0,
+            }
+
+
+throughput = ThroughputStats()
+
+
+def warm_up(model: str) -> None:
+    """
+    Loads the model with the run's options before the first request, so the load time is not counted against
+    the first rows and the server does not reload it when the options differ from its defaults.
+    """
+    client = get_client("ollama", endpoint=OLLAMA_HOST)
+    client.generate(model=model, prompt="", keep_alive=KEEP_ALIVE, options=OPTIONS)
+    throughput.reset()
+
+
+def throughput_stats(model: str, generation: GenerationConfig = GENERATION) -> dict:
+    return throughput.stats()
+
+
+def get_prediction(model: str, prompt: str, generation: GenerationConfig = GENERATION) -> tuple[str, str]:
     """
     Gets a prediction from the local Llama model using Ollama.
     
     Args:
         model (str): Name of the Llama model to use
         prompt (str): The prompt to send to the model
+        generation (GenerationConfig): Output limits and answer format of the run
         
     Returns:
         tuple[str, str]: A tuple containing (prompt, model_response)
     """
-    response: ChatResponse = chat(
+    client = get_client("ollama", endpoint=OLLAMA_HOST)
+    response = client.chat(
         model=model,
         messages=[
             {
@@ -35,22 +135,57 @@ def get_prediction(model: str, prompt: str) -> tuple[str, str]:
                 "content": prompt,
             },
         ],
+        keep_alive=KEEP_ALIVE,
+        **ollama_params(generation, prompt, OPTIONS),
     )
-    print(response["message"]["content"])
-    return prompt, response["message"]["content"]
+    throughput.add(response)
+    record_usage(*ollama_usage(response))
+    if generation.scoring:
+        return prompt, ollama_scored(response, prompt)
+    return prompt, parse_structured(response["message"]["content"])
 
 
-if __name__ == "__main__":
-    # Process the TSV file and generate predictions
-    output_data = process_file(
-        tsv_file=TSV_FILE_PATH,
-        model=MODEL_NAME,
-        get_prediction=get_prediction,
-        language=LANG,
-        country=COUNTRY
+async def get_prediction_async(model: str, prompt: str, generation: GenerationConfig = GENERATION) -> tuple[str, str]:
+    """
+    Async version of get_prediction using the Ollama AsyncClient of the running event loop.
+    """
+    async_client = get_client("ollama", endpoint=OLLAMA_HOST, async_client=True)
+    response = await async_client.chat(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt,
+            },
+        ],
+        keep_alive=KEEP_ALIVE,
+        **ollama_params(generation, prompt, OPTIONS),
     )
-    
-    # Save the results to a JSON file
-    write_json(output_data, OUTPUT_JSON_PATH)
+    throughput.add(response)
+    record_usage(*ollama_usage(response))
+    if generation.scoring:
+        return prompt, ollama_scored(response, prompt)
+    return prompt, parse_structured(response["message"]["content"])
 
 
+def run_config() -> RunConfig:
+    """
+    Returns the run config set by the constants above.
+    """
+    return RunConfig(tsv_file=TSV_FILE_PATH, model=MODEL_NAME, output_path=OUTPUT_JSON_PATH, language=LANG,
+                     country=COUNTRY, stream_path=STREAM_PATH, async_mode=ASYNC_MODE, concurrency=CONCURRENCY,
+                     cache_path=CACHE_PATH, cache_replay=CACHE_REPLAY, telemetry_dir=TELEMETRY_DIR,
+                     results_db=RESULTS_DB, hedge=HEDGE, hedge_routes=tuple(HEDGE_ROUTES), pack_size=PACK_SIZE,
+                     generation=GENERATION)
+
+
+def main() -> list[dict]:
+    """
+    Runs the evaluation configured by the constants above and returns the records; the model is warmed up first
+    (warm_up) and the server's throughput is printed at the end.
+    """
+    return run_evaluation("ollama", run_config(), sys.modules[__name__])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Registry of the provider backends and the runner of one evaluation.
+Each provider is implemented by an inference script (OpenAI_inf.py, ...) that provides get_prediction,
+get_prediction_async (except hf_inf), the run config constants, run_config() and main(). The scripts are only
+imported when a provider is first used, and they import their SDK only when the first client is created (see
+client_utils), so reaching one provider does not pay for the others. Credentials are checked for the selected
+provider only.
+
+run_evaluation wires a run (response cache, results store, scheduler, hedging, telemetry and packing) around the
+get_prediction functions of a script, from a RunConfig; the scripts' main() and culemo.py only build the config.
+Optional hooks of a script: warm_up(model) before the first request, prefetch(model, prompts, generation) to answer
+the pending prompts in batches, and throughput_stats(model, generation), printed at the end of the run.
+"""
+
+import functools
+import importlib
+import os
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Provider:
+    """
+    A provider backend.
+
+    Args:
+        name (str): Provider name, as used in cache keys and scheduler quotas
+        module (str): Inference script implementing the provider
+        env_var (str, optional): Environment variable holding the API key; None if no key is needed
+    """
+    name: str
+    module: str
+    env_var: str = None
+
+
+PROVIDERS = {
+    "openai": Provider("openai", "OpenAI_inf", "OPENAI_API_KEY"),
+    "anthropic": Provider("anthropic", "Anthropic_inf", "ANTHROPIC_API_KEY"),
+    "gemini": Provider("gemini", "Gemini_inf", "GOOGLE_API_KEY"),
+    "ollama": Provider("ollama", "ollama_inf"),
+    "transformers": Provider("transformers", "hf_inf"),
+}
+
+
+def get_provider(name: str) -> Provider:
+    """
+    Returns the registered provider.
+
+    Raises:
+        ValueError: If the provider is unknown
+    """
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider '{name}'; choose from {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]
+
+
+def check_credentials(name: str) -> None:
+    """
+    Checks that the API key of a provider is set.
+
+    Raises:
+        ValueError: If the provider needs an API key and its environment variable is not set
+    """
+    provider = get_provider(name)
+    if provider.env_var and not os.getenv(provider.env_var):
+        raise ValueError(f"Please set the {provider.env_var} environment variable")
+
+
+def load_provider(name: str, check: bool = True):
+    """
+    Imports the inference script of a provider (once; later calls return the same module).
+
+    Args:
+        name (str): Provider name
+        check (bool): Check the provider's credentials first
+
+    Returns:
+        module: The provider's inference script
+    """
+    if check:
+        check_credentials(name)
+    return importlib.import_module(get_provider(name).module)
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    Settings of one evaluation run (see run_evaluation).
+
+    Args:
+        tsv_file (str): TSV file with the evaluation data
+        model (str): Name of the model
+        output_path (str): JSON file the records are written to
+        language (str, optional): Prompt language; either language or country must be None
+        country (str, optional): Country context (English prompts)
+        stream_path (str, optional): JSONL file results are streamed to while running, so an interrupted run
+            resumes where it stopped; defaults to inference_utils.default_stream_path(output_path)
+        async_mode (bool): Send requests concurrently instead of one row at a time (scripts with
+            get_prediction_async only)
+        concurrency (int): Maximum number of requests in flight
+        cache_path (str): Response cache (see cache_utils)
+        cache_replay (bool): Uncached prompts raise instead of calling the API
+        telemetry_dir (str, optional): Directory of the per-request trace, metrics and progress bar; None
+            disables telemetry
+        results_db (str, optional): Results store every record is also written to; None disables it
+        hedge (HedgePolicy, optional): Hedge slow requests and fail over (see hedging_utils); None sends every
+            request once
+        hedge_routes (tuple[str, ...]): Other "provider:model" routes for hedges and failover
+        pack_size (int): Rows asked per request (see inference_utils.pack_prompt)
+        generation (GenerationConfig, optional): Output limits and answer format, already adjusted to pack_size
+            (GenerationConfig.for_pack); defaults to the script's GENERATION
+        prompt_fn (callable, optional): Builds the prompts; defaults to inference_utils.get_prompt
+    """
+    tsv_file: str
+    model: str
+    output_path: str
+    language: str = None
+    country: str = None
+    stream_path: str = None
+    async_mode: bool = True
+    concurrency: int = 8
+    cache_path: str = ".cache/responses.sqlite"
+    cache_replay: bool = False
+    telemetry_dir: str = "telemetry"
+    results_db: str = "results.sqlite"
+    hedge: "HedgePolicy" = None
+    hedge_routes: tuple[str, ...] = ()
+    pack_size: int = 1
+    generation: "GenerationConfig" = None
+    prompt_fn: object = None
+
+
+def run_evaluation(provider: str, config: RunConfig, script=None) -> list[dict]:
+    """
+    Runs one evaluation, writes its records to config.output_path and returns them.
+
+    Args:
+        provider (str): Provider name, used in the cache keys and for the scheduler quotas
+        config (RunConfig): Settings of the run
+        script (module, optional): Inference script with the get_prediction functions and hooks (see the module
+            docstring); defaults to the provider's registered script
+
+    Returns:
+        list[dict]: The records, in row order
+    """
+    import asyncio
+    from cache_utils import ResponseCache, cached, cached_async, make_key
+    from dataset_utils import load_dataset
+    from hedging_utils import Hedger, hedged, hedged_async, load_routes
+    from inference_utils import (completed_rows, default_stream_path, get_prompt, process_file, process_file_async,
+                                 write_json)
+    from results_store import ResultsStore
+    from scheduler_utils import Scheduler, scheduled, scheduled_async
+    from telemetry_utils import Telemetry
+
+    check_credentials(provider)
+    script = script or load_provider(provider, check=False)
+    generation = config.generation or script.GENERATION
+    cache_params = generation.cache_params(**getattr(script, "OPTIONS", {}))
+    stream_path = config.stream_path or default_stream_path(config.output_path)
+    prompt_fn = config.prompt_fn or get_prompt
+    async_mode = config.async_mode and hasattr(script, "get_prediction_async")
+
+    cache = ResponseCache(config.cache_path, replay=config.cache_replay)
+    store = ResultsStore(config.results_db) if config.results_db else None
+    # Rate limits, retries and adaptive concurrency for this provider
+    scheduler = Scheduler.for_provider(provider, max_concurrency=config.concurrency,
+                                       max_output_tokens=generation.token_cap)
+    hedger = None
+    if config.hedge:
+        hedger = Hedger(config.hedge, load_routes(config.hedge_routes, async_mode, generation, cache))
+    telemetry = None
+    if config.telemetry_dir:
+        run_name = os.path.splitext(os.path.basename(config.output_path))[0]
+        telemetry = Telemetry.in_directory(config.telemetry_dir, provider, run_name)
+
+    done_rows = completed_rows(stream_path)
+    print(f"Streaming records to {stream_path}" + (f"; resuming after the {len(done_rows)} rows already in it "
+                                                   f"(delete it to start over)" if done_rows else ""))
+    if not config.cache_replay and hasattr(script, "warm_up"):
+        script.warm_up(config.model)
+    if not config.cache_replay and hasattr(script, "prefetch"):
+        # Batch backends (hf_inf) answer the prompts of the pending rows ahead of process_file
+        parsed = load_dataset(config.tsv_file).rows(config.language, config.country)
+        prompts = [prompt_fn(config.language, config.country, text)
+                   for row, (text, _, _) in enumerate(parsed) if row not in done_rows]
+        prompts = [prompt for prompt in prompts
+                   if make_key(provider, config.model, prompt, cache_params) not in cache]
+        print(f"Prefetching {len(prompts)} answers")
+        script.prefetch(config.model, prompts, generation)
+
+    kwargs = dict(tsv_file=config.tsv_file, model=config.model, language=config.language, country=config.country,
+                  output_path=stream_path, prompt_fn=prompt_fn, pack_size=config.pack_size, telemetry=telemetry,
+                  store=store)
+    if async_mode:
+        get_prediction = functools.partial(script.get_prediction_async, generation=generation)
+        get_prediction = cached_async(hedged_async(scheduled_async(get_prediction, scheduler), hedger, provider),
+                                      cache, provider, params=cache_params)
+        output_data = asyncio.run(process_file_async(get_prediction=get_prediction, concurrency=config.concurrency,
+                                                     **kwargs))
+    else:
+        get_prediction = functools.partial(script.get_prediction, generation=generation)
+        get_prediction = cached(hedged(scheduled(get_prediction, scheduler), hedger, provider), cache, provider,
+                                params=cache_params)
+        output_data = process_file(get_prediction=get_prediction, **kwargs)
+
+    print(f"Cache: {cache.stats()}")
+    print(f"Scheduler: {scheduler.stats()}")
+    if hedger:
+        print(f"Hedging: {hedger.stats()}")
+    if telemetry:
+        telemetry.close()
+        print(f"Telemetry: {telemetry.summary()}")
+    if not config.cache_replay and hasattr(script, "throughput_stats"):
+        print(f"Throughput: {script.throughput_stats(config.model, generation)}")
+    cache.close()
+    if store:
+        store.close()
+
+    write_json(output_data, config.output_path)
+    return output_data
@@ -0,0 +1,303 @@
+"""
+Consolidated results store: every result record of every run in one indexed SQLite database.
+The output JSON trees encode model, language and country in their paths and repeat the full prompt in every
+record; here each record is one row of the `results` table with model, prompt variant, language/country, the TSV
+file it comes from (item_set) and canonical gold/predicted label IDs as indexed columns, and prompts are stored
+once in the `prompts` table, referenced by their SHA-256. Cross-model questions become single SQL queries.
+The route that answered a hedged request (see hedging_utils) is kept in the route and hedged columns.
+
+process_file and process_file_async write to a store directly when given one (see RESULTS_DB in the inference
+scripts); existing output trees are loaded with the importer.
+
+Usage:
+    python results_store.py import [output files or directories ...]
+    python results_store.py all-wrong --language Amharic [--variant language]
+    python results_store.py query "SELECT model, AVG(correct) FROM results GROUP BY model"
+    python results_store.py stats
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from eval import OUTPUT_DIRS, discover_output_files, get_variant, to_label_ids
+from inference_utils import COUNTRY_CODES, LANGUAGE_CODES, make_record
+from label_utils import INVALID_ID, normalize_label
+
+
+DEFAULT_RESULTS_PATH = "results.sqlite"
+# Columns of the results table, in the order _row fills them
+COLUMNS = ("model", "variant", "target", "row", "language", "country", "item_set", "prompt_hash", "text", "emotion",
+           "emotion_id", "pred_emotion", "pred_id", "correct", "label_distribution", "label_coverage", "route",
+           "hedged", "source", "created_at")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompts (
+    hash TEXT PRIMARY KEY,
+    prompt TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    model TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    target TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    language TEXT,
+    country TEXT,
+    item_set TEXT,
+    prompt_hash TEXT REFERENCES prompts(hash),
+    text TEXT,
+    emotion TEXT,
+    emotion_id INTEGER,
+    pred_emotion TEXT,
+    pred_id INTEGER,
+    correct INTEGER,
+    label_distribution TEXT,
+    label_coverage REAL,
+    route TEXT,
+    hedged INTEGER,
+    source TEXT,
+    created_at REAL,
+    PRIMARY KEY (model, variant, target, row)
+);
+CREATE INDEX IF NOT EXISTS idx_results_model ON results(model);
+CREATE INDEX IF NOT EXISTS idx_results_variant ON results(variant);
+CREATE INDEX IF NOT EXISTS idx_results_language ON results(language);
+CREATE INDEX IF NOT EXISTS idx_results_country ON results(country);
+CREATE INDEX IF NOT EXISTS idx_results_emotion ON results(emotion_id);
+CREATE INDEX IF NOT EXISTS idx_results_item ON results(item_set, row);
+"""
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def item_set_of(language: str = None, country: str = None) -> str:
+    """
+    Returns the code of the TSV file a language or country is evaluated on (e.g. "spn" for Mexico).
+    """
+    if country:
+        return COUNTRY_CODES[country][0] if country in COUNTRY_CODES else country
+    return LANGUAGE_CODES.get(language, language)
+
+
+class ResultsStore:
+    """
+    SQLite database of result records.
+
+    Args:
+        path (str): Path of the SQLite database file
+        commit_every (int): Records buffered by add before they are committed; close commits the rest
+    """
+
+    def __init__(self, path: str = DEFAULT_RESULTS_PATH, commit_every: int = 50):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = []
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        existing = {column for _, column, *_ in self._conn.execute("PRAGMA table_info(results)")}
+        for column, kind in (("route", "TEXT"), ("hedged", "INTEGER")):
+            # Stores created before hedged requests were recorded
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE results ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    def _row(self, record: dict, row: int, variant: str, emotion_id: int, pred_id: int, source: str,
+             now: float) -> tuple:
+        language, country = record.get("language"), record.get("country")
+        distribution = record.get("label_distribution")
+        return (
+            record["model"], variant, country or language, row, language, country, item_set_of(language, country),
+            prompt_hash(record["prompt"]), record["text"], record["emotion"], emotion_id, record["pred_emotion"],
+            pred_id, int(emotion_id == pred_id and emotion_id != INVALID_ID),
+            json.dumps(distribution, ensure_ascii=False) if distribution is not None else None,
+            record.get("label_coverage"), record.get("route"), int(record.get("hedged", False)), source, now,
+        )
+
+    def _write(self, prompts: list[str], rows: list[tuple]) -> None:
+        self._conn.executemany("INSERT OR IGNORE INTO prompts VALUES (?, ?)",
+                               [(prompt_hash(prompt), prompt) for prompt in dict.fromkeys(prompts)])
+        self._conn.executemany(f"INSERT OR REPLACE INTO results ({', '.join(COLUMNS)}) "
+                               f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        self._conn.commit()
+
+    def add(self, record: dict, row: int, variant: str, source: str = None) -> None:
+        """
+        Stores one record (as built by inference_utils.make_record); a record for the same model, variant,
+        language/country and row replaces the earlier one.
+
+        Args:
+            record (dict): The result record
+            row (int): Index of the row in the TSV file
+            variant (str): Prompt variant ("language", "country" or "wo_country_pref")
+            source (str, optional): Where the record comes from (e.g. the run's JSONL file)
+        """
+        gold, pred = normalize_label(record["emotion"]), normalize_label(record["pred_emotion"] or "")
+        with self._lock:
+            self._pending.append((record["prompt"], self._row(record, row, variant, gold, pred, source, time.time())))
+            if len(self._pending) >= self.commit_every:
+                self._flush()
+
+    def add_many(self, records: list[dict], variant: str, source: str = None) -> None:
+        """
+        Stores the records of a whole output file (in row order) in one transaction.
+        """
+        gold = to_label_ids([record["emotion"] for record in records])
+        pred = to_label_ids([record["pred_emotion"] or "" for record in records])
+        now = time.time()
+        rows = [self._row(record, row, variant, int(gold[row]), int(pred[row]), source, now)
+                for row, record in enumerate(records)]
+        with self._lock:
+            self._write([record["prompt"] for record in records], rows)
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._write([prompt for prompt, _ in self._pending], [row for _, row in self._pending])
+            self._pending = []
+
+    def flush(self) -> None:
+        """Commits the buffered records."""
+        with self._lock:
+            self._flush()
+
+    def query(self, sql: str, params: tuple = ()) -> list[dict]:
+        """
+        Runs a SQL query and returns its rows as dicts.
+        """
+        self.flush()
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, values)) for values in cursor.fetchall()]
+
+    def all_wrong(self, language: str = None, country: str = None, variant: str = None,
+                  min_models: int = 2) -> list[dict]:
+        """
+        Returns the items every stored model answered wrongly.
+
+        Args:
+            language (str, optional): Only results of prompts in this language
+            country (str, optional): Only results of prompts with this country context
+            variant (str, optional): Only results of this prompt variant
+            min_models (int): Only items answered by at least this many models
+
+        Returns:
+            list[dict]: item_set, row, text, gold emotion, number of models and their answers per item
+        """
+        filters = {"language": language, "country": country, "variant": variant}
+        where = " AND ".join(f"{column} = ?" for column, value in filters.items() if value is not None)
+        return self.query(
+            f"""SELECT item_set, row, MIN(text) AS text, MIN(emotion) AS emotion,
+                       COUNT(DISTINCT model) AS models, GROUP_CONCAT(pred_emotion, ' | ') AS answers
+                FROM results {'WHERE ' + where if where else ''}
+                GROUP BY item_set, row
+                HAVING MAX(correct) = 0 AND COUNT(DISTINCT model) >= ?
+                ORDER BY item_set, row""",
+            (*[value for value in filters.values() if value is not None], min_models),
+        )
+
+    def records(self, model: str, variant: str, language: str = None, country: str = None) -> list[dict]:
+        """
+        Returns the records of one run in the format of the output JSON files, in row order.
+        """
+        rows = self.query(
+            """SELECT p.prompt, r.text, r.language, r.country, r.emotion, r.pred_emotion,
+                      r.label_distribution, r.label_coverage, r.route, r.hedged
+               FROM results r JOIN prompts p ON p.hash = r.prompt_hash
+               WHERE r.model = ? AND r.variant = ? AND r.target = ?
+               ORDER BY r.row""",
+            (model, variant, country or language),
+        )
+        return [
+            make_record(row["prompt"], row["text"], row["emotion"], row["pred_emotion"], model, row["language"],
+                        row["country"],
+                        {"distribution": json.loads(row["label_distribution"]), "coverage": row["label_coverage"]}
+                        if row["label_distribution"] is not None else None,
+                        {"route": row["route"], **({"hedged": True} if row["hedged"] else {})} if row["route"] else None)
+            for row in rows
+        ]
+
+    def stats(self) -> dict:
+        """Returns the number of stored results, distinct prompts, models and runs."""
+        return self.query(
+            """SELECT (SELECT COUNT(*) FROM results) AS results, (SELECT COUNT(*) FROM prompts) AS prompts,
+                      (SELECT COUNT(DISTINCT model) FROM results) AS models,
+                      (SELECT COUNT(*) FROM (SELECT DISTINCT model, variant, target FROM results)) AS runs"""
+        )[0]
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def import_outputs(store: ResultsStore, paths: list[str]) -> int:
+    """
+    Imports output JSON files (or directories of them) into a store; importing a file again replaces its rows.
+
+    Returns:
+        int: Number of imported records
+    """
+    imported = 0
+    for path in discover_output_files(paths):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list) or not data or "pred_emotion" not in data[0]:
+            continue
+        store.add_many(data, get_variant(path, data[0]), source=path)
+        imported += len(data)
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consolidated CuLEmo results store")
+    parser.add_argument("--db", default=DEFAULT_RESULTS_PATH, help="Path of the SQLite database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import output JSON files or directories")
+    import_parser.add_argument("paths", nargs="*", default=OUTPUT_DIRS)
+
+    wrong_parser = subparsers.add_parser("all-wrong", help="List the items every model answered wrongly")
+    wrong_parser.add_argument("--language")
+    wrong_parser.add_argument("--country")
+    wrong_parser.add_argument("--variant", choices=["language", "country", "wo_country_pref"])
+    wrong_parser.add_argument("--min-models", type=int, default=2)
+
+    query_parser = subparsers.add_parser("query", help="Run a SQL query")
+    query_parser.add_argument("sql")
+
+    subparsers.add_parser("stats", help="Count the stored results")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        start = time.perf_counter()
+        if args.command == "import":
+            count = import_outputs(store, args.paths)
+            print(f"Imported {count} records in {time.perf_counter() - start:.2f}s: {store.stats()}")
+        elif args.command == "all-wrong":
+            items = store.all_wrong(args.language, args.country, args.variant, args.min_models)
+            for item in items:
+                answers = " ".join(item["answers"].split())
+                print(f"{item['item_set']}:{item['row']:<4} {item['emotion']:<10} {item['models']} models "
+                      f"({answers})  {item['text']}")
+            print(f"{len(items)} items in {(time.perf_counter() - start) * 1000:.1f} ms")
+        elif args.command == "query":
+            rows = store.query(args.sql)
+            for row in rows:
+                print(json.dumps(row, ensure_ascii=False))
+            print(f"{len(rows)} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
+        else:
+            print(store.stats())
@@ -0,0 +1,292 @@
+"""
+Rate limiting and retry scheduler shared by all provider backends.
+Each provider gets token buckets for requests/min and tokens/min, retries of throttled, timed out and
+transient 5xx requests with exponential backoff and jitter (honouring Retry-After), and an AIMD-adjusted
+concurrency limit that backs off when the provider throttles and grows again while requests succeed.
+"""
+
+import asyncio
+import contextvars
+import functools
+import random
+import threading
+import time
+from telemetry_utils import count_retry
+
+
+# Default quotas per provider; adjust them to the limits of your account tier.
+# None means the limit is not enforced (e.g. a local Ollama server).
+PROVIDER_LIMITS = {
+    "openai": {"requests_per_minute": 500, "tokens_per_minute": 30_000},
+    "anthropic": {"requests_per_minute": 50, "tokens_per_minute": 40_000},
+    "gemini": {"requests_per_minute": 1_000, "tokens_per_minute": 4_000_000},
+    "ollama": {"requests_per_minute": None, "tokens_per_minute": None},
+}
+
+# Callback of the current request, called with "queued" when it enters the scheduler and "sent" when it leaves
+# the queue to be sent; lets the hedger tell waiting for the rate limits from waiting for the provider
+dispatch_hook = contextvars.ContextVar("dispatch_hook", default=None)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+THROTTLING_STATUS_CODES = {429, 529}
+
+
+def report_dispatch(state: str) -> None:
+    """
+    Calls the dispatch hook of the current request, if any.
+    """
+    hook = dispatch_hook.get()
+    if hook:
+        hook(state)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimates the number of tokens in a text (about 4 characters per token).
+    """
+    return len(text) // 4 + 1
+
+
+def get_status_code(exc: Exception):
+    """
+    Extracts the HTTP status code from a provider SDK exception, if it has one.
+    """
+    for attr in ("status_code", "code"):
+        status = getattr(exc, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def get_retry_after(exc: Exception):
+    """
+    Returns the delay in seconds requested by a Retry-After (or retry-after-ms) response header, if any.
+    """
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """
+    Decides whether a failed request should be retried: throttling, timeouts, connection errors and 5xx.
+    """
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    name = type(exc).__name__
+    if "Timeout" in name or "Connection" in name or name in ("ResourceExhausted", "ServiceUnavailable"):
+        return True
+    return get_status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def is_throttled(exc: Exception) -> bool:
+    return get_status_code(exc) in THROTTLING_STATUS_CODES or type(exc).__name__ == "ResourceExhausted"
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+
+    reserve() takes the tokens immediately (the bucket may go into debt) and returns how long the
+    caller has to wait before using them, so the same bucket works for threads and asyncio tasks.
+
+    Args:
+        rate_per_minute (float): Refill rate
+        capacity (float, optional): Maximum burst size; defaults to one minute worth of tokens
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Takes `amount` tokens and returns the number of seconds to wait before they are available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+
+class Scheduler:
+    """
+    Per-provider scheduler combining token buckets, retries with backoff and an adaptive concurrency limit.
+
+    Args:
+        provider (str): Provider name, used in log messages
+        requests_per_minute (float, optional): Request quota
+        tokens_per_minute (float, optional): Token quota (input plus maximum output tokens)
+        max_concurrency (int): Upper bound of the concurrency limit
+        min_concurrency (int): Lower bound of the concurrency limit
+        max_retries (int): Retries per request before the error is raised
+        base_delay (float): Initial backoff delay in seconds
+        max_delay (float): Maximum backoff delay in seconds
+        max_output_tokens (int): Output tokens counted against the token quota for every request
+        timeout (float, optional): Per-attempt timeout in seconds for async calls
+    """
+
+    def __init__(self, provider: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_concurrency: int = 8, min_concurrency: int = 1, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 60.0, max_output_tokens: int = 16,
+                 timeout: float = None):
+        self.provider = provider
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_output_tokens = max_output_tokens
+        self.timeout = timeout
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.retries = 0
+        self.throttled = 0
+        self._condition = None
+        self._loop = None
+
+    @classmethod
+    def for_provider(cls, provider: str, **kwargs) -> "Scheduler":
+        """
+        Creates a scheduler with the default quotas from PROVIDER_LIMITS; kwargs override them.
+        """
+        return cls(provider, **{**PROVIDER_LIMITS.get(provider, {}), **kwargs})
+
+    def _rate_delay(self, prompt: str) -> float:
+        delay = 0.0
+        if self.request_bucket:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket:
+            delay = max(delay, self.token_bucket.reserve(estimate_tokens(prompt) + self.max_output_tokens))
+        return delay
+
+    def _backoff(self, attempt: int, exc: Exception) -> float:
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            return retry_after
+        # Full jitter: uniform in [0, min(max_delay, base * 2^attempt)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _on_success(self) -> None:
+        # Additive increase: about +1 per `limit` successful requests
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _on_failure(self, exc: Exception) -> None:
+        self.retries += 1
+        count_retry()
+        if is_throttled(exc):
+            # Multiplicative decrease
+            self.throttled += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self.in_flight = 0
+        return self._condition
+
+    async def call(self, fn, *args):
+        """
+        Runs an async provider call under the rate limits, with retries.
+
+        Args:
+            fn (callable): Coroutine function, typically get_prediction_async
+            *args: Arguments for fn; the last one is the prompt, used to estimate tokens
+
+        Returns:
+            The result of fn
+        """
+        condition = self._get_condition()
+        report_dispatch("queued")
+        attempt = 0
+        while True:
+            async with condition:
+                await condition.wait_for(lambda: self.in_flight < int(self.limit))
+                self.in_flight += 1
+            try:
+                await asyncio.sleep(self._rate_delay(args[-1]))
+                report_dispatch("sent")
+                if self.timeout:
+                    result = await asyncio.wait_for(fn(*args), self.timeout)
+                else:
+                    result = await fn(*args)
+                self._on_success()
+                return result
+            except Exception as exc:
+                if not is_retryable(exc) or attempt >= self.max_retries:
+                    raise
+                self._on_failure(exc)
+                delay = self._backoff(attempt, exc)
+                print(f"[{self.provider}] {type(exc).__name__}, retry {attempt + 1} in {delay:.1f}s "
+                      f"(concurrency limit {int(self.limit)})")
+            finally:
+                async with condition:
+                    self.in_flight -= 1
+                    condition.notify_all()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def call_sync(self, fn, *args):
+        """
+        Runs a blocking provider call under the rate limits, with retries.
+        """
+        report_dispatch("queued")
+        attempt = 0
+        while True:
+            time.sleep(self._rate_delay(args[-1]))
+            report_dispatch("sent")
+            try:
+                result = fn(*args)
+                self._on_success()
+                return result
+            except Exception as exc:
+                if not is_retryable(exc) or attempt >= self.max_retries:
+                    raise
+                self._on_failure(exc)
+                delay = self._backoff(attempt, exc)
+                print(f"[{self.provider}] {type(exc).__name__}, retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        return {"retries": self.retries, "throttled": self.throttled, "concurrency_limit": int(self.limit)}
+
+
+def scheduled(get_prediction, scheduler: Scheduler):
+    """
+    Wraps a get_prediction function so that every call runs through the scheduler.
+    """
+    @functools.wraps(get_prediction)
+    def wrapper(model: str, prompt: str) -> tuple[str, str]:
+        return scheduler.call_sync(get_prediction, model, prompt)
+
+    return wrapper
+
+
+def scheduled_async(get_prediction, scheduler: Scheduler):
+    """
+    Async version of scheduled for coroutine get_prediction functions.
+    """
+    @functools.wraps(get_prediction)
+    async def wrapper(model: str, prompt: str) -> tuple[str, str]:
+        return await scheduler.call(get_prediction, model, prompt)
+
+    return wrapper
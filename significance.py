@@ -0,0 +1,300 @@
+"""
+Script for bootstrap confidence intervals and significance tests over all evaluation cells.
+The per-row correctness of every (model, language/country, prompt variant) cell is loaded into one matrix, rows
+aligned by their position in the TSV file (country prompts use the English text of the same file, so e.g.
+countries/mex-eng_* and spn_* answer the same 400 items). All comparisons are then tested at once:
+
+- model: two models on the same language/country and prompt variant
+- country_vs_language: a country prompt against the language prompt of the same file (mex-eng vs spn)
+- wo_country_pref_vs_language: the prompt without country preference against the language prompt
+
+Resampling is vectorized: each bootstrap resample is a row of multiplicity weights shared by all cells of the
+same length, so the accuracies of every cell under every resample come from one matrix product, and the
+paired differences reuse the same resamples. The paired permutation test flips the sign of the per-row
+differences the same way. McNemar's exact test is computed alongside, and p-values are Holm-adjusted over all
+comparisons. Results depend only on --seed.
+
+Usage:
+    python significance.py [output files or directories ...] [--resamples 10000] [--seed 0]
+                           [--report significance_report.json] [--tables significance_tables]
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from itertools import combinations
+import numpy as np
+from eval import OUTPUT_DIRS, Cell, discover_output_files, load_cells
+from inference_utils import COUNTRY_CODES, LANGUAGE_CODES
+from label_utils import INVALID_ID
+
+
+REPORT_PATH = "significance_report.json"
+TABLE_DIR = "significance_tables"
+RESAMPLES = 10000
+CONFIDENCE = 0.95
+# Resamples generated per matrix product; bounds the memory of the weight matrix
+CHUNK_SIZE = 2000
+COMPARISONS = ("model", "country_vs_language", "wo_country_pref_vs_language")
+
+
+def item_set(cell: Cell) -> str:
+    """
+    Returns the code of the TSV file a cell's rows come from (e.g. "spn" for Spanish and for Mexico).
+    """
+    return COUNTRY_CODES[cell.country][0] if cell.country else LANGUAGE_CODES.get(cell.language, cell.language)
+
+
+def cell_name(cell: Cell) -> str:
+    return f"{cell.model}/{cell.variant}/{cell.language or cell.country}"
+
+
+def correctness_matrix(cells: list[Cell]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stacks the per-row correctness of cells with the same number of rows.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (correct, valid) float32 arrays of shape (n_cells, n_rows); valid marks
+            rows with a known gold label
+    """
+    y_true = np.stack([cell.y_true for cell in cells])
+    y_pred = np.stack([cell.y_pred for cell in cells])
+    valid = y_true != INVALID_ID
+    return ((y_true == y_pred) & valid).astype(np.float32), valid.astype(np.float32)
+
+
+def find_comparisons(cells: list[Cell]) -> list[tuple[str, int, int]]:
+    """
+    Lists the paired comparisons between cells answering the same rows with the same gold labels.
+
+    Returns:
+        list[tuple[str, int, int]]: (comparison kind, index of cell a, index of cell b)
+    """
+    pairs = []
+    for a, b in combinations(range(len(cells)), 2):
+        x, y = cells[a], cells[b]
+        if item_set(x) != item_set(y) or len(x.y_true) != len(y.y_true) or not np.array_equal(x.y_true, y.y_true):
+            continue
+        if x.model != y.model:
+            if x.variant == y.variant and (x.language, x.country) == (y.language, y.country):
+                pairs.append(("model", a, b))
+            continue
+        variants = {x.variant: a, y.variant: b}
+        if set(variants) == {"country", "language"}:
+            pairs.append(("country_vs_language", variants["country"], variants["language"]))
+        elif set(variants) == {"wo_country_pref", "language"} and x.language == y.language:
+            pairs.append(("wo_country_pref_vs_language", variants["wo_country_pref"], variants["language"]))
+    return pairs
+
+
+def bootstrap_weights(rng: np.random.Generator, resamples: int, n: int) -> np.ndarray:
+    """
+    Returns (resamples, n) multiplicity weights: row r counts how often each item was drawn in resample r.
+    """
+    draws = rng.integers(0, n, size=(resamples, n))
+    flat = (np.arange(resamples)[:, None] * n + draws).ravel()
+    return np.bincount(flat, minlength=resamples * n).reshape(resamples, n).astype(np.float32)
+
+
+def resample_accuracies(correct: np.ndarray, valid: np.ndarray, resamples: int, rng: np.random.Generator,
+                        chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """
+    Computes the accuracy of every cell under every bootstrap resample, the same resamples for all cells.
+
+    Returns:
+        np.ndarray: Array of shape (n_cells, resamples)
+    """
+    accuracies = np.empty((len(correct), resamples), dtype=np.float32)
+    for start in range(0, resamples, chunk_size):
+        weights = bootstrap_weights(rng, min(chunk_size, resamples - start), correct.shape[1]).T
+        accuracies[:, start:start + weights.shape[1]] = (correct @ weights) / np.maximum(valid @ weights, 1)
+    return accuracies
+
+
+def permutation_pvalues(differences: np.ndarray, resamples: int, rng: np.random.Generator,
+                        chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """
+    Two-sided paired permutation test of the mean per-row difference of each pair, flipping the sign of every
+    row independently (the same flips for all pairs).
+
+    Args:
+        differences (np.ndarray): (n_pairs, n_rows) correctness of a minus correctness of b
+
+    Returns:
+        np.ndarray: p-values of shape (n_pairs,)
+    """
+    observed = np.abs(differences.sum(axis=1))
+    # Guards against float32 rounding making a permuted sum equal to the observed one look smaller
+    tolerance = 1e-3
+    extreme = np.zeros(len(differences))
+    for start in range(0, resamples, chunk_size):
+        count = min(chunk_size, resamples - start)
+        signs = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), size=(differences.shape[1], count))
+        extreme += (np.abs(differences @ signs) >= observed[:, None] - tolerance).sum(axis=1)
+    return (extreme + 1) / (resamples + 1)
+
+
+def mcnemar_pvalues(only_a: np.ndarray, only_b: np.ndarray) -> np.ndarray:
+    """
+    Exact two-sided McNemar test: the smaller discordant count against Binomial(only_a + only_b, 1/2).
+    """
+    discordant = only_a + only_b
+    smaller = np.minimum(only_a, only_b)
+    log_factorial = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, discordant.max(initial=0) + 1)))])
+    k = np.arange(discordant.max(initial=0) + 1)
+    m = discordant[:, None]
+    with np.errstate(invalid="ignore"):
+        log_pmf = (log_factorial[m] - log_factorial[np.minimum(k, m)] - log_factorial[np.maximum(m - k, 0)]
+                   - m * np.log(2))
+    tail = np.where(k <= smaller[:, None], np.exp(log_pmf), 0.0).sum(axis=1)
+    return np.minimum(1.0, 2 * tail)
+
+
+def holm_adjust(pvalues: np.ndarray) -> np.ndarray:
+    """
+    Returns Holm-Bonferroni adjusted p-values (family-wise error control over all comparisons).
+    """
+    m = len(pvalues)
+    order = np.argsort(pvalues, kind="stable")
+    adjusted = np.minimum(1.0, np.maximum.accumulate((m - np.arange(m)) * pvalues[order]))
+    result = np.empty(m)
+    result[order] = adjusted
+    return result
+
+
+def analyze(cells: list[Cell], resamples: int = RESAMPLES, confidence: float = CONFIDENCE,
+            seed: int = 0) -> tuple[list[dict], list[dict]]:
+    """
+    Computes bootstrap intervals for every cell and tests every comparison.
+
+    Args:
+        cells (list[Cell]): Evaluation cells (see eval.load_cells)
+        resamples (int): Bootstrap resamples and sign flips of the permutation test
+        confidence (float): Level of the percentile intervals
+        seed (int): Seed of all random draws
+
+    Returns:
+        tuple[list[dict], list[dict]]: One entry per cell and one per comparison
+    """
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    pairs = find_comparisons(cells)
+    cell_rows, pair_rows = [None] * len(cells), [None] * len(pairs)
+
+    # Cells of different lengths cannot share resamples; each length gets its own stream of the seed
+    for n in sorted({len(cell.y_true) for cell in cells}):
+        rng = np.random.default_rng([seed, n])
+        members = [i for i, cell in enumerate(cells) if len(cell.y_true) == n]
+        position = {i: k for k, i in enumerate(members)}
+        correct, valid = correctness_matrix([cells[i] for i in members])
+        accuracies = resample_accuracies(correct, valid, resamples, rng)
+        observed = correct.sum(axis=1) / np.maximum(valid.sum(axis=1), 1)
+        low, high = np.quantile(accuracies, quantiles, axis=1)
+        for k, i in enumerate(members):
+            cell_rows[i] = {
+                "cell": cell_name(cells[i]),
+                "model": cells[i].model,
+                "variant": cells[i].variant,
+                "language": cells[i].language,
+                "country": cells[i].country,
+                "n": n,
+                "accuracy": round(float(observed[k]), 4),
+                "ci_low": round(float(low[k]), 4),
+                "ci_high": round(float(high[k]), 4),
+            }
+
+        group = [p for p, (_, a, _) in enumerate(pairs) if a in position]
+        if not group:
+            continue
+        a_index = np.array([position[pairs[p][1]] for p in group])
+        b_index = np.array([position[pairs[p][2]] for p in group])
+        differences = correct[a_index] - correct[b_index]
+        diff_low, diff_high = np.quantile(accuracies[a_index] - accuracies[b_index], quantiles, axis=1)
+        only_a = (differences > 0).sum(axis=1).astype(np.int64)
+        only_b = (differences < 0).sum(axis=1).astype(np.int64)
+        permutation = permutation_pvalues(differences, resamples, rng)
+        mcnemar = mcnemar_pvalues(only_a, only_b)
+        for k, p in enumerate(group):
+            kind, a, b = pairs[p]
+            pair_rows[p] = {
+                "comparison": kind,
+                "a": cell_name(cells[a]),
+                "b": cell_name(cells[b]),
+                "n": n,
+                "difference": round(float(observed[a_index[k]] - observed[b_index[k]]), 4),
+                "ci_low": round(float(diff_low[k]), 4),
+                "ci_high": round(float(diff_high[k]), 4),
+                "only_a": int(only_a[k]),
+                "only_b": int(only_b[k]),
+                "p_permutation": float(permutation[k]),
+                "p_mcnemar": float(mcnemar[k]),
+            }
+
+    if pair_rows:
+        for test in ("permutation", "mcnemar"):
+            adjusted = holm_adjust(np.array([row[f"p_{test}"] for row in pair_rows]))
+            for row, p in zip(pair_rows, adjusted):
+                row[f"p_{test}_holm"] = float(p)
+    for row in pair_rows:
+        for key in ("p_permutation", "p_mcnemar", "p_permutation_holm", "p_mcnemar_holm"):
+            row[key] = round(row[key], 6)
+    return cell_rows, pair_rows
+
+
+def write_table(rows: list[dict], path: str) -> None:
+    """
+    Writes rows as a CSV table.
+    """
+    if not rows:
+        return
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_significance(paths: list[str], resamples: int = RESAMPLES, confidence: float = CONFIDENCE, seed: int = 0,
+                     report_path: str = REPORT_PATH, table_dir: str = TABLE_DIR) -> dict:
+    """
+    Loads the output files, analyzes them and writes the JSON report and CSV tables.
+    """
+    cells = load_cells(discover_output_files(paths))
+    if not cells:
+        print("No output files found")
+        return {}
+    start = time.perf_counter()
+    cell_rows, pair_rows = analyze(cells, resamples, confidence, seed)
+    seconds = time.perf_counter() - start
+
+    report = {"resamples": resamples, "confidence": confidence, "seed": seed, "cells": cell_rows,
+              "comparisons": pair_rows}
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    if table_dir:
+        os.makedirs(table_dir, exist_ok=True)
+        write_table(cell_rows, os.path.join(table_dir, "cells.csv"))
+        write_table(pair_rows, os.path.join(table_dir, "comparisons.csv"))
+
+    print(f"{'a':<48} {'b':<48} {'diff':>7} {'CI':>17} {'p_perm':>8} {'p_holm':>8}")
+    for row in sorted(pair_rows, key=lambda r: (r["comparison"], r["a"], r["b"])):
+        marker = " *" if row["p_permutation_holm"] < 1 - confidence else ""
+        print(f"{row['a']:<48} {row['b']:<48} {row['difference']:>7.4f} "
+              f"[{row['ci_low']:>7.4f},{row['ci_high']:>7.4f}] {row['p_permutation']:>8.4f} "
+              f"{row['p_permutation_holm']:>8.4f}{marker}")
+    print(f"{len(cell_rows)} cells and {len(pair_rows)} comparisons with {resamples} resamples in {seconds:.2f}s; "
+          f"report written to {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap intervals and significance tests for CuLEmo outputs")
+    parser.add_argument("paths", nargs="*", default=OUTPUT_DIRS, help="Output JSON files or directories")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=REPORT_PATH, help="Path of the JSON report")
+    parser.add_argument("--tables", default=TABLE_DIR, help="Directory of the CSV tables")
+    args = parser.parse_args()
+
+    run_significance(args.paths, args.resamples, args.confidence, args.seed, args.report, args.tables)
@@ -0,0 +1,212 @@
+"""
+Script for running a full benchmark sweep.
+A sweep spec (JSON) lists models, languages, countries and prompt variants; this script expands it into one job
+per (model, variant, language/country), skips jobs whose outputs are already complete and runs the rest.
+Jobs of different providers run in parallel, so a sweep takes about as long as its slowest provider.
+
+Usage:
+    python sweep.py sweep_spec.json [--dry-run] [--providers openai anthropic] [--no-telemetry] [--results-db PATH]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from cache_utils import DEFAULT_CACHE_PATH, ResponseCache, cached_async
+from dataset_utils import load_dataset
+from inference_utils import (COUNTRY_CODES, LANGUAGE_CODES, default_stream_path, get_prompt, get_prompt_wo_country_pref,
+                             load_jsonl, process_file_async, write_json)
+from providers import load_provider
+from results_store import DEFAULT_RESULTS_PATH, ResultsStore
+from scheduler_utils import Scheduler, scheduled_async
+from telemetry_utils import Telemetry
+
+
+DATA_DIR = "data/test"
+TELEMETRY_DIR = "telemetry"
+VARIANTS = ("language", "country", "wo_country_pref")
+
+DEFAULT_CONCURRENCY = {
+    "openai": 16,
+    "anthropic": 8,
+    "gemini": 16,
+    "ollama": 4,
+}
+
+
+@dataclass
+class Job:
+    """A single (model, prompt variant, language/country) run."""
+    provider: str
+    model: str
+    variant: str
+    tsv_file: str
+    output_path: str
+    language: str = None
+    country: str = None
+
+    @property
+    def prompt_fn(self):
+        return get_prompt_wo_country_pref if self.variant == "wo_country_pref" else get_prompt
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}/{self.variant}/{self.language or self.country}"
+
+    @property
+    def stream_path(self) -> str:
+        return default_stream_path(self.output_path)
+
+
+def load_spec(path: str) -> dict:
+    """
+    Loads a sweep spec.
+
+    The spec is a JSON object with "languages", "countries", "variants" and "models". Each model entry has a
+    "provider", a "model" name and an "outputs" object mapping each variant to an output path template
+    with {lang} (file code of the language, e.g. "amh") or {country} (e.g. "mex") placeholders.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def expand_jobs(spec: dict, data_dir: str = DATA_DIR) -> list[Job]:
+    """
+    Expands a sweep spec into the list of jobs.
+    """
+    variants = spec.get("variants", VARIANTS)
+    jobs = []
+    for entry in spec["models"]:
+        for variant in variants:
+            template = entry["outputs"].get(variant)
+            if not template:
+                continue
+            if variant == "country":
+                for country in spec.get("countries", []):
+                    tsv_code, country_code = COUNTRY_CODES[country]
+                    jobs.append(Job(entry["provider"], entry["model"], variant,
+                                    os.path.join(data_dir, f"{tsv_code}.tsv"),
+                                    template.format(country=country_code), country=country))
+            else:
+                for language in spec.get("languages", []):
+                    code = LANGUAGE_CODES[language]
+                    jobs.append(Job(entry["provider"], entry["model"], variant,
+                                    os.path.join(data_dir, f"{code}.tsv"),
+                                    template.format(lang=code), language=language))
+    return jobs
+
+
+def is_complete(job: Job) -> bool:
+    """
+    Checks whether the output JSON of a job already has a record for every TSV row.
+    """
+    if not os.path.exists(job.output_path):
+        return False
+    try:
+        with open(job.output_path, "r", encoding="utf-8") as f:
+            return len(json.load(f)) >= len(load_dataset(job.tsv_file))
+    except json.JSONDecodeError:
+        return False
+
+
+async def run_job(job: Job, get_prediction, concurrency: int, pack_size: int = 1, telemetry: Telemetry = None,
+                  store: ResultsStore = None) -> None:
+    """
+    Runs one job, streaming to job.stream_path (so it resumes if interrupted) and writing the final JSON.
+    With a store, the records are also written to the results store.
+    """
+    if os.path.dirname(job.output_path):
+        os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+    print(f"Starting {job.name}, streaming to {job.stream_path}")
+    output_data = await process_file_async(
+        tsv_file=job.tsv_file,
+        model=job.model,
+        get_prediction=get_prediction,
+        language=job.language,
+        country=job.country,
+        concurrency=concurrency,
+        output_path=job.stream_path,
+        prompt_fn=job.prompt_fn,
+        pack_size=pack_size,
+        telemetry=telemetry,
+        store=store,
+    )
+    write_json(output_data, job.output_path)
+
+
+async def run_provider(provider: str, jobs: list[Job], cache: ResponseCache, concurrency: int,
+                       telemetry_dir: str = None, store: ResultsStore = None) -> None:
+    """
+    Runs all jobs of one provider concurrently, sharing one scheduler so the provider's limits hold across jobs.
+    With telemetry_dir, the requests of all jobs are traced to <telemetry_dir>/sweep-<provider>.*.
+    """
+    # Provider script with get_prediction_async, GENERATION, CACHE_PARAMS and PACK_SIZE
+    module = load_provider(provider)
+    scheduler = Scheduler.for_provider(provider, max_concurrency=concurrency,
+                                       max_output_tokens=module.GENERATION.token_cap)
+    get_prediction = cached_async(scheduled_async(module.get_prediction_async, scheduler), cache, provider,
+                                  params=module.CACHE_PARAMS)
+    telemetry = Telemetry.in_directory(telemetry_dir, provider, f"sweep-{provider}") if telemetry_dir else None
+    results = await asyncio.gather(*(run_job(job, get_prediction, concurrency, module.PACK_SIZE, telemetry, store)
+                                     for job in jobs), return_exceptions=True)
+    if telemetry:
+        telemetry.close()
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            print(f"FAILED {job.name}: {type(result).__name__}: {result}")
+    print(f"[{provider}] done, scheduler: {scheduler.stats()}"
+          + (f", telemetry: {telemetry.summary()}" if telemetry else ""))
+
+
+async def run_sweep(jobs: list[Job], cache: ResponseCache, concurrency: dict = None,
+                    telemetry_dir: str = None, store: ResultsStore = None) -> None:
+    """
+    Runs the jobs, one group per provider, all providers in parallel, writing every record to store if given.
+    """
+    concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+    by_provider = {}
+    for job in jobs:
+        by_provider.setdefault(job.provider, []).append(job)
+    # A provider that fails to start (e.g. missing credentials) must not cancel the jobs of the others
+    results = await asyncio.gather(*(
+        run_provider(provider, provider_jobs, cache, concurrency.get(provider, 8), telemetry_dir, store)
+        for provider, provider_jobs in by_provider.items()
+    ), return_exceptions=True)
+    for provider, result in zip(by_provider, results):
+        if isinstance(result, Exception):
+            print(f"FAILED provider {provider}: {type(result).__name__}: {result}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a CuLEmo benchmark sweep")
+    parser.add_argument("spec", help="Path of the sweep spec JSON")
+    parser.add_argument("--providers", nargs="*", help="Only run jobs of these providers")
+    parser.add_argument("--dry-run", action="store_true", help="List the pending jobs without running them")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Path of the response cache")
+    parser.add_argument("--telemetry-dir", default=TELEMETRY_DIR, help="Directory of the request traces and metrics")
+    parser.add_argument("--no-telemetry", action="store_true", help="Do not trace requests")
+    parser.add_argument("--results-db", default=DEFAULT_RESULTS_PATH, help="Results store the records are written to")
+    parser.add_argument("--no-results-db", action="store_true", help="Only write the output files")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    jobs = expand_jobs(spec)
+    if args.providers:
+        jobs = [job for job in jobs if job.provider in args.providers]
+    pending = [job for job in jobs if not is_complete(job)]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already complete, {len(pending)} to run")
+
+    if args.dry_run:
+        for job in pending:
+            done = len(load_jsonl(job.stream_path))
+            print(f"  {job.name} -> {job.output_path}" + (f" ({done} rows done)" if done else ""))
+    elif pending:
+        cache = ResponseCache(args.cache)
+        telemetry_dir = None if args.no_telemetry else args.telemetry_dir
+        store = None if args.no_results_db else ResultsStore(args.results_db)
+        asyncio.run(run_sweep(pending, cache, spec.get("concurrency"), telemetry_dir, store))
+        print(f"Cache: {cache.stats()}")
+        cache.close()
+        if store:
+            store.close()
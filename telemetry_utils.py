@@ -0,0 +1,278 @@
+"""
+Per-request telemetry for get_prediction: wall time, time to first byte, tokens, estimated cost, retries and
+cache hits, written as a JSONL trace and a Prometheus textfile summary, with a live progress bar.
+
+Telemetry is opt-in: process_file only wraps get_prediction when a Telemetry object is passed. The hooks called
+from the rest of the pipeline (annotate, record_usage, count_retry, ...) only look up a context variable when
+no request is being traced, so they cost next to nothing when telemetry is off.
+"""
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from inference_utils import JsonlWriter
+
+
+# USD per million (input, output) tokens; models not listed are counted as free (e.g. local Ollama models)
+MODEL_PRICES = {
+    "gpt-4": (30.0, 60.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "claude-3-5-sonnet-20240620": (3.0, 15.0),
+    "gemini-1.5-flash": (0.075, 0.3),
+}
+# Upper bounds (seconds) of the request duration histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "culemo"
+
+# Span of the request being traced in the current thread or asyncio task
+_current_span = contextvars.ContextVar("telemetry_span", default=None)
+
+
+def annotate(**fields) -> None:
+    """
+    Adds fields to the span of the request being traced, if any.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.update(fields)
+
+
+def record_usage(input_tokens: int, output_tokens: int) -> None:
+    """
+    Records the token usage reported by the provider for the current request.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span["input_tokens"] = input_tokens or 0
+        span["output_tokens"] = output_tokens or 0
+
+
+def count_retry() -> None:
+    """
+    Counts a retry of the current request (called by the scheduler).
+    """
+    span = _current_span.get()
+    if span is not None:
+        span["retries"] += 1
+
+
+def mark_response(status_code: int) -> None:
+    """
+    Records the arrival of response headers: the first one sets the time to first byte, errors are counted.
+    """
+    span = _current_span.get()
+    if span is not None:
+        if span["ttfb_s"] is None:
+            span["ttfb_s"] = round(time.perf_counter() - span["_start"], 4)
+        if status_code >= 400:
+            span["http_errors"] += 1
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    Estimates the cost in USD of a request from MODEL_PRICES.
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1e6
+
+
+class Telemetry:
+    """
+    Traces the requests made through a get_prediction function.
+
+    Args:
+        provider (str): Provider name, used as a metric label
+        trace_path (str, optional): JSONL file that gets one line per request
+        metrics_path (str, optional): Prometheus textfile (e.g. for node_exporter's textfile collector)
+            rewritten every `metrics_interval` seconds and on close
+        progress (bool): Show a progress bar with throughput and ETA
+        metrics_interval (float): Seconds between rewrites of the metrics file
+    """
+
+    def __init__(self, provider: str, trace_path: str = None, metrics_path: str = None, progress: bool = True,
+                 metrics_interval: float = 15.0):
+        self.provider = provider
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._writer = JsonlWriter(trace_path, fsync_every=1000) if trace_path else None
+        self._metrics_written = time.monotonic()
+        self._bar = None
+        if progress:
+            from tqdm import tqdm
+            self._bar = tqdm(total=0, desc=provider, unit="req", dynamic_ncols=True, smoothing=0.1)
+        self.total = 0
+        # Aggregates per (model, status)
+        self.requests = {}
+        self.totals = {"input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "retries": 0, "http_errors": 0,
+                       "cache_hits": 0, "cache_misses": 0, "wall_seconds": 0.0}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @classmethod
+    def in_directory(cls, directory: str, provider: str, name: str, **kwargs) -> "Telemetry":
+        """
+        Creates a Telemetry writing <directory>/<name>.trace.jsonl and <directory>/<name>.prom.
+        """
+        return cls(provider, os.path.join(directory, f"{name}.trace.jsonl"), os.path.join(directory, f"{name}.prom"),
+                   **kwargs)
+
+    def add_total(self, count: int) -> None:
+        """
+        Adds the number of requests expected, for the progress bar's ETA.
+        """
+        with self._lock:
+            self.total += count
+            if self._bar is not None:
+                self._bar.total = self.total
+                self._bar.refresh()
+
+    def _start(self, model: str, prompt: str) -> dict:
+        return {
+            "ts": round(time.time(), 3),
+            "provider": self.provider,
+            "model": model,
+            "prompt_chars": len(prompt),
+            "wall_s": None,
+            "ttfb_s": None,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cost_usd": 0.0,
+            "retries": 0,
+            "http_errors": 0,
+            "cache": None,
+            "status": "ok",
+            "_start": time.perf_counter(),
+        }
+
+    def _finish(self, span: dict) -> None:
+        span["wall_s"] = round(time.perf_counter() - span.pop("_start"), 4)
+        span["cost_usd"] = round(estimate_cost(span["model"], span["input_tokens"], span["output_tokens"]), 6)
+
+        with self._lock:
+            key = (span["model"], span["status"])
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name in ("input_tokens", "output_tokens", "cost_usd", "retries", "http_errors"):
+                self.totals[name] += span[name]
+            self.totals["wall_seconds"] += span["wall_s"]
+            if span["cache"] == "hit":
+                self.totals["cache_hits"] += 1
+            elif span["cache"] == "miss":
+                self.totals["cache_misses"] += 1
+            self.buckets[sum(span["wall_s"] > bound for bound in LATENCY_BUCKETS)] += 1
+            if self._writer:
+                self._writer.write(span)
+            if self._bar is not None:
+                self._bar.update(1)
+                self._bar.set_postfix(cost=f"${self.totals['cost_usd']:.3f}", retries=self.totals["retries"],
+                                      refresh=False)
+            write_metrics = self.metrics_path and time.monotonic() - self._metrics_written >= self.metrics_interval
+        if write_metrics:
+            self.write_metrics()
+
+    def wrap(self, get_prediction):
+        """
+        Wraps a get_prediction function so that each call is traced.
+        """
+        @functools.wraps(get_prediction)
+        def wrapper(model: str, prompt: str) -> tuple[str, str]:
+            span = self._start(model, prompt)
+            token = _current_span.set(span)
+            try:
+                return get_prediction(model, prompt)
+            except Exception as exc:
+                span["status"] = "error"
+                span["error"] = type(exc).__name__
+                raise
+            finally:
+                _current_span.reset(token)
+                self._finish(span)
+
+        return wrapper
+
+    def wrap_async(self, get_prediction):
+        """
+        Async version of wrap for coroutine get_prediction functions.
+        """
+        @functools.wraps(get_prediction)
+        async def wrapper(model: str, prompt: str) -> tuple[str, str]:
+            span = self._start(model, prompt)
+            token = _current_span.set(span)
+            try:
+                return await get_prediction(model, prompt)
+            except Exception as exc:
+                span["status"] = "error"
+                span["error"] = type(exc).__name__
+                raise
+            finally:
+                _current_span.reset(token)
+                self._finish(span)
+
+        return wrapper
+
+    def summary(self) -> dict:
+        with self._lock:
+            count = sum(self.requests.values())
+            return {
+                "requests": count,
+                "errors": sum(n for (_, status), n in self.requests.items() if status == "error"),
+                **{name: round(value, 6) if isinstance(value, float) else value for name, value in self.totals.items()},
+                "mean_wall_s": round(self.totals["wall_seconds"] / count, 4) if count else 0.0,
+            }
+
+    def write_metrics(self) -> None:
+        """
+        Writes the aggregates in the Prometheus text exposition format (atomically, as the textfile collector expects).
+        """
+        with self._lock:
+            self._metrics_written = time.monotonic()
+            provider = f'provider="{self.provider}"'
+            lines = [
+                f"# HELP {METRIC_PREFIX}_requests_total Requests made through get_prediction.",
+                f"# TYPE {METRIC_PREFIX}_requests_total counter",
+            ]
+            for (model, status), count in sorted(self.requests.items()):
+                lines.append(f'{METRIC_PREFIX}_requests_total{{{provider},model="{model}",status="{status}"}} {count}')
+            for name, help_text in (("input_tokens", "Input tokens reported by the provider."),
+                                    ("output_tokens", "Output tokens reported by the provider."),
+                                    ("cost_usd", "Estimated cost in USD."),
+                                    ("retries", "Retries made by the scheduler."),
+                                    ("http_errors", "HTTP error responses, including those retried by the SDK."),
+                                    ("cache_hits", "Responses served from the response cache."),
+                                    ("cache_misses", "Responses not found in the response cache.")):
+                lines += [
+                    f"# HELP {METRIC_PREFIX}_{name}_total {help_text}",
+                    f"# TYPE {METRIC_PREFIX}_{name}_total counter",
+                    f"{METRIC_PREFIX}_{name}_total{{{provider}}} {round(self.totals[name], 6)}",
+                ]
+            lines += [
+                f"# HELP {METRIC_PREFIX}_request_duration_seconds Wall time of get_prediction calls.",
+                f"# TYPE {METRIC_PREFIX}_request_duration_seconds histogram",
+            ]
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), self.buckets):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_bucket{{{provider},le="{bound}"}} {cumulative}')
+            lines += [
+                f"{METRIC_PREFIX}_request_duration_seconds_sum{{{provider}}} {self.totals['wall_seconds']:.4f}",
+                f"{METRIC_PREFIX}_request_duration_seconds_count{{{provider}}} {cumulative}",
+            ]
+
+        if os.path.dirname(self.metrics_path):
+            os.makedirs(os.path.dirname(self.metrics_path), exist_ok=True)
+        tmp_path = f"{self.metrics_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.metrics_path)
+
+    def close(self) -> None:
+        if self._bar is not None:
+            self._bar.close()
+        if self._writer:
+            self._writer.close()
+        if self.metrics_path:
+            self.write_metrics()
@@ -0,0 +1,39 @@
+from generation_utils import GenerationConfig, openai_params, openai_scored
+from inference_utils import get_prompt, make_record, split_scored
+
+SCORING = GenerationConfig(scoring=True)
+
+
+def completion(content: str, top_logprobs: list[tuple[str, float]]) -> dict:
+    return {"choices": [{
+        "message": {"content": content},
+        "logprobs": {"content": [{"token": top_logprobs[0][0], "logprob": top_logprobs[0][1],
+                                  "top_logprobs": [{"token": t, "logprob": p} for t, p in top_logprobs]}]},
+    }]}
+
+
+def test_english_answer_is_scored():
+    prompt = get_prompt("English", None, "I passed the exam.")
+    answer = openai_scored(completion("joy", [("joy", -0.1), ("Sad", -2.5), ("The", -4.0)]), prompt)
+
+    emotion, scores = split_scored(answer)
+    assert emotion == "joy"
+    assert set(scores["distribution"]) == {"anger", "fear", "sadness", "joy", "guilt", "neutral"}
+    assert scores["distribution"]["joy"] > scores["distribution"]["sadness"] > 0
+    assert 0 < scores["coverage"] < 1
+
+
+def test_amharic_answer_is_marked_unscored():
+    prompt = get_prompt("Amharic", None, "ፈተናውን አለፍኩ።")
+    # The first token of every Amharic label is a partial UTF-8 fragment of the same lead byte
+    fragments = [("�", -0.2), ("bytes:\\xe1\\x8b", -1.9), ("ደ", -3.0)]
+
+    params = openai_params(SCORING, prompt)
+    assert "logprobs" not in params
+    assert params["max_tokens"] == SCORING.max_tokens
+
+    emotion, scores = split_scored(openai_scored(completion("ደስታ", fragments), prompt))
+    assert emotion == "ደስታ"
+    record = make_record(prompt, "ፈተናውን አለፍኩ።", "ደስታ", emotion, "gpt-4o", "Amharic", scores=scores)
+    assert record["label_scoring"] == "unsupported"
+    assert "label_distribution" not in record
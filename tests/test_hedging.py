@@ -0,0 +1,53 @@
+import asyncio
+from cache_utils import ResponseCache, cached, cached_async, make_key
+from hedging_utils import HedgePolicy, Hedger, Route, hedged, hedged_async
+
+PROMPT = "How does this text feel?"
+
+
+def failing(model: str, prompt: str):
+    raise ConnectionError("primary is down")
+
+
+async def failing_async(model: str, prompt: str):
+    raise ConnectionError("primary is down")
+
+
+def alternate(model: str, prompt: str):
+    return prompt, f"joy from {model}"
+
+
+async def alternate_async(model: str, prompt: str):
+    return prompt, f"joy from {model}"
+
+
+def test_failover_answer_is_cached_under_the_alternate_only(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    route = Route("anthropic", cached(alternate, cache, "anthropic"), "claude")
+    hedger = Hedger(HedgePolicy(), [route])
+    get_prediction = cached(hedged(failing, hedger, "openai"), cache, "openai")
+
+    assert get_prediction("gpt-4", PROMPT) == (PROMPT, "joy from claude")
+    assert hedger.stats()["failovers"] == 1
+    assert make_key("openai", "gpt-4", PROMPT) not in cache
+    assert cache.get(make_key("anthropic", "claude", PROMPT)) == "joy from claude"
+
+
+def test_failover_answer_is_cached_under_the_alternate_only_async(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    route = Route("anthropic", cached_async(alternate_async, cache, "anthropic"), "claude")
+    hedger = Hedger(HedgePolicy(), [route])
+    get_prediction = cached_async(hedged_async(failing_async, hedger, "openai"), cache, "openai")
+
+    assert asyncio.run(get_prediction("gpt-4", PROMPT)) == (PROMPT, "joy from claude")
+    assert make_key("openai", "gpt-4", PROMPT) not in cache
+    assert cache.get(make_key("anthropic", "claude", PROMPT)) == "joy from claude"
+
+
+def test_primary_answer_is_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    hedger = Hedger(HedgePolicy(), [Route("anthropic", failing_async, "claude")])
+    get_prediction = cached_async(hedged_async(alternate_async, hedger, "openai"), cache, "openai")
+
+    asyncio.run(get_prediction("gpt-4", PROMPT))
+    assert cache.get(make_key("openai", "gpt-4", PROMPT)) == "joy from gpt-4"
@@ -0,0 +1,500 @@
+"""
+Sharded work queue for running a sweep with several worker processes or hosts.
+`init` splits the pending rows of the sweep's jobs (see sweep.py) into leases of --lease-size rows, stored in a
+SQLite queue file. Workers (`work`, started on any number of hosts that share the queue file and the working
+directory) claim leases, renew them while they run and write the records of each lease to their own JSONL part
+file. A lease whose worker stops renewing it (crash, lost host) expires and is claimed by another worker, which
+skips the rows its predecessor already wrote. `merge` reassembles the parts of every finished job in row order
+into the job's JSONL and JSON outputs, the same files a single-process run writes, and optionally loads them into
+the results store.
+
+Each worker process has its own scheduler per provider; with --workers N the provider quotas are split between
+the N processes (pass --quota-share on each host when workers run on several hosts). SQLite locking needs a
+filesystem with working POSIX locks (local disks, NFSv4); the response cache is shared the same way unless
+--cache points each host to its own file.
+
+Usage:
+    python work_queue.py init sweep_spec.json [--providers ollama] [--lease-size 25]
+    python work_queue.py work [--workers 4] [--lease-seconds 120]
+    python work_queue.py status
+    python work_queue.py retry
+    python work_queue.py merge [--results-db PATH]
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from cache_utils import DEFAULT_CACHE_PATH, ResponseCache, cached, cached_async, make_key
+from dataset_utils import load_dataset
+from inference_utils import (JsonlWriter, completed_rows, pack_rows, process_file, process_file_async, read_jsonl,
+                             write_json)
+from providers import load_provider
+from results_store import DEFAULT_RESULTS_PATH, ResultsStore
+from scheduler_utils import PROVIDER_LIMITS, Scheduler, scheduled, scheduled_async
+from sweep import DEFAULT_CONCURRENCY, TELEMETRY_DIR, Job, expand_jobs, load_spec
+from telemetry_utils import Telemetry
+
+
+DEFAULT_QUEUE_PATH = "work_queue.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    output_path TEXT NOT NULL UNIQUE,
+    spec TEXT NOT NULL,
+    merged INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    rows TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_leases_state ON leases(state, expires);
+"""
+
+
+@dataclass
+class Lease:
+    """Rows of one job claimed by a worker."""
+    id: int
+    job_id: int
+    job: Job
+    rows: list[int]
+    attempt: int
+
+
+class WorkQueue:
+    """
+    Leases of (job, rows) units in a SQLite file shared by the workers.
+
+    A lease is pending, leased (until `expires`), done or failed. Claiming takes the oldest pending or expired
+    lease in one write transaction, so two workers never get the same lease while it is renewed.
+
+    Args:
+        path (str): Path of the SQLite queue file; part files go to the `<name>_parts/` directory next to it
+        lease_seconds (float): How long a claimed lease stays with its worker without being renewed
+        max_attempts (int): Claims of a lease before it is marked failed (e.g. a row that crashes every worker)
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = 120.0, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.parts_dir = os.path.splitext(path)[0] + "_parts"
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit; claim and merge open their own write transactions
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def add_jobs(self, jobs: list[Job], lease_size: int = 25) -> int:
+        """
+        Adds the rows of the jobs that are not in their output JSONL yet, in leases of lease_size rows; jobs
+        already in the queue are skipped. Returns the number of leases added.
+        """
+        added = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            for job in jobs:
+                done_rows = completed_rows(job.stream_path)
+                rows = [row for row in range(len(load_dataset(job.tsv_file))) if row not in done_rows]
+                if not rows:
+                    continue
+                cursor = self._conn.execute("INSERT OR IGNORE INTO jobs (output_path, spec) VALUES (?, ?)",
+                                            (job.output_path, json.dumps(asdict(job))))
+                if not cursor.rowcount:
+                    continue
+                groups = pack_rows(rows, lease_size)
+                self._conn.executemany("INSERT INTO leases (job_id, rows) VALUES (?, ?)",
+                                       [(cursor.lastrowid, json.dumps(group)) for group in groups])
+                added += len(groups)
+            self._conn.execute("COMMIT")
+        return added
+
+    def claim(self, worker: str) -> Lease:
+        """
+        Claims the next pending or expired lease for a worker; returns None when there is none.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    now = time.time()
+                    row = self._conn.execute(
+                        """SELECT l.id, l.job_id, l.rows, l.attempts, j.spec
+                           FROM leases l JOIN jobs j ON j.id = l.job_id
+                           WHERE l.state = 'pending' OR (l.state = 'leased' AND l.expires < ?)
+                           ORDER BY l.id LIMIT 1""", (now,)).fetchone()
+                    if row is None:
+                        return None
+                    lease_id, job_id, rows, attempts, spec = row
+                    if attempts >= self.max_attempts:
+                        # Every worker that took it stopped before finishing it
+                        self._conn.execute("UPDATE leases SET state = 'failed', error = ? WHERE id = ?",
+                                           ("lease expired too many times", lease_id))
+                        continue
+                    self._conn.execute(
+                        "UPDATE leases SET state = 'leased', worker = ?, expires = ?, attempts = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, attempts + 1, lease_id))
+                    return Lease(lease_id, job_id, Job(**json.loads(spec)), json.loads(rows), attempts + 1)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def renew(self, lease: Lease, worker: str) -> bool:
+        """
+        Extends a lease; returns False if the worker lost it (it expired and was claimed again).
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, lease.id, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, lease: Lease, worker: str) -> bool:
+        """
+        Marks a lease done; returns False (and changes nothing) if the worker no longer holds it.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET state = 'done', expires = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+                (lease.id, worker))
+            return cursor.rowcount == 1
+
+    def release(self, lease: Lease, worker: str, error: Exception) -> bool:
+        """
+        Gives a lease back after an error; it is retried by any worker until max_attempts claims. Returns False
+        (and changes nothing) if the worker no longer holds it.
+        """
+        state = "failed" if lease.attempt >= self.max_attempts else "pending"
+        with self._lock:
+            cursor = self._conn.execute(
+                """UPDATE leases SET state = ?, worker = NULL, expires = NULL, error = ?
+                   WHERE id = ? AND worker = ? AND state = 'leased'""",
+                (state, f"{type(error).__name__}: {error}", lease.id, worker))
+            return cursor.rowcount == 1
+
+    def retry_failed(self) -> int:
+        """
+        Makes the failed leases pending again; returns their number.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET state = 'pending', attempts = 0, error = NULL WHERE state = 'failed'")
+            return cursor.rowcount
+
+    def leased(self) -> int:
+        """Returns the number of leases currently held by workers (they may still expire)."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM leases WHERE state = 'leased'").fetchone()[0]
+
+    def part_path(self, lease: Lease, worker: str) -> str:
+        """
+        Returns the JSONL file a worker writes the records of a lease to.
+        """
+        return os.path.join(self.parts_dir, str(lease.job_id), f"{lease.id:06d}-{worker}.jsonl")
+
+    def lease_done_rows(self, lease: Lease) -> set[int]:
+        """
+        Returns the rows of a lease already written by any worker that held it.
+        """
+        done_rows = set()
+        for path in glob.glob(os.path.join(self.parts_dir, str(lease.job_id), f"{lease.id:06d}-*.jsonl")):
+            done_rows |= completed_rows(path)
+        return done_rows
+
+    def status(self) -> list[dict]:
+        """
+        Returns the lease counts of every job by state.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT j.id, j.output_path, j.merged, l.state, COUNT(*)
+                   FROM jobs j JOIN leases l ON l.job_id = j.id
+                   GROUP BY j.id, l.state ORDER BY j.id""").fetchall()
+        jobs = {}
+        for job_id, output_path, merged, state, count in rows:
+            job = jobs.setdefault(job_id, {"job": output_path, "merged": bool(merged), "pending": 0, "leased": 0,
+                                           "done": 0, "failed": 0})
+            job[state] = count
+        return list(jobs.values())
+
+    def merge(self, store: ResultsStore = None) -> list[str]:
+        """
+        Writes the outputs of every job whose leases are all done and that was not merged yet.
+
+        The records of a job are those already in its output JSONL when it was queued, then those of the part
+        files in name (lease, worker) order; the first record of a row wins, so merging is deterministic even
+        when an expired lease was run twice. The JSONL is rewritten in row order and the JSON written as by
+        process_file; the part files of the job are then removed. With a store, the records are also stored.
+
+        Returns:
+            list[str]: Output paths of the merged jobs
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            ready = self._conn.execute(
+                """SELECT id, spec FROM jobs WHERE merged = 0 AND NOT EXISTS
+                   (SELECT 1 FROM leases WHERE job_id = jobs.id AND state != 'done')""").fetchall()
+            # Taken by this merge, so that workers of other hosts finishing at the same time skip them
+            self._conn.executemany("UPDATE jobs SET merged = 1 WHERE id = ?", [(job_id,) for job_id, _ in ready])
+            self._conn.execute("COMMIT")
+
+        merged = []
+        for job_id, spec in ready:
+            job = Job(**json.loads(spec))
+            try:
+                self._merge_job(job_id, job, store)
+            except Exception:
+                with self._lock:
+                    self._conn.execute("UPDATE jobs SET merged = 0 WHERE id = ?", (job_id,))
+                raise
+            merged.append(job.output_path)
+        return merged
+
+    def _merge_job(self, job_id: int, job: Job, store: ResultsStore = None) -> None:
+        stream_path = job.stream_path
+        records = read_jsonl(stream_path)
+        part_dir = os.path.join(self.parts_dir, str(job_id))
+        for path in sorted(glob.glob(os.path.join(part_dir, "*.jsonl"))):
+            for row, record in read_jsonl(path).items():
+                records.setdefault(row, record)
+        missing = len(load_dataset(job.tsv_file)) - len(records)
+        if missing:
+            raise ValueError(f"{job.name}: {missing} rows have no record in {part_dir}")
+
+        temporary_path = stream_path + ".merge"
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        with JsonlWriter(temporary_path, fsync_every=len(records)) as writer:
+            for row in sorted(records):
+                writer.write({"row": row, **records[row]})
+        os.replace(temporary_path, stream_path)
+        output_data = [records[row] for row in sorted(records)]
+        write_json(output_data, job.output_path)
+        if store:
+            store.add_many(output_data, job.variant, stream_path)
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class QueueWorker:
+    """
+    Claims and runs leases until the queue is empty.
+
+    Args:
+        queue (WorkQueue): The queue
+        cache (ResponseCache): Response cache shared by the leases of all providers
+        slots (int): Leases run at the same time, so a lease finishing does not leave the provider idle
+        quota_share (float): Fraction of the provider quotas (PROVIDER_LIMITS) this worker may use; 0 disables them
+        telemetry_dir (str, optional): Directory of the request traces, one per provider and worker
+        name (str, optional): Worker name in the queue; defaults to <host>-<pid>
+    """
+
+    def __init__(self, queue: WorkQueue, cache: ResponseCache, slots: int = 2, quota_share: float = 1.0,
+                 telemetry_dir: str = None, name: str = None):
+        self.queue = queue
+        self.cache = cache
+        self.slots = slots
+        self.quota_share = quota_share
+        self.telemetry_dir = telemetry_dir
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.completed = 0
+        self._predictors = {}  # provider -> (module, get_prediction, telemetry, concurrency)
+
+    def _predictor(self, provider: str) -> tuple:
+        """
+        Returns the script module, cached and scheduled get_prediction, telemetry and concurrency of a provider.
+        """
+        if provider not in self._predictors:
+            module = load_provider(provider)
+            concurrency = DEFAULT_CONCURRENCY.get(provider, getattr(module, "CONCURRENCY", 8))
+            limits = {quota: value * self.quota_share if self.quota_share else None
+                      for quota, value in PROVIDER_LIMITS.get(provider, {}).items() if value}
+            scheduler = Scheduler.for_provider(provider, max_concurrency=concurrency,
+                                               max_output_tokens=module.GENERATION.token_cap, **limits)
+            if hasattr(module, "get_prediction_async"):
+                get_prediction = cached_async(scheduled_async(module.get_prediction_async, scheduler), self.cache,
+                                              provider, params=module.CACHE_PARAMS)
+            else:
+                get_prediction = cached(scheduled(module.get_prediction, scheduler), self.cache, provider,
+                                        params=module.CACHE_PARAMS)
+            telemetry = (Telemetry.in_directory(self.telemetry_dir, provider, f"queue-{provider}-{self.name}",
+                                                progress=False) if self.telemetry_dir else None)
+            self._predictors[provider] = (module, get_prediction, telemetry, concurrency)
+        return self._predictors[provider]
+
+    async def _run_lease(self, lease: Lease) -> None:
+        job = lease.job
+        module, get_prediction, telemetry, concurrency = self._predictor(job.provider)
+        done_rows = self.queue.lease_done_rows(lease)
+        rows = [row for row in lease.rows if row not in done_rows]
+        output_path = self.queue.part_path(lease, self.name)
+        kwargs = dict(tsv_file=job.tsv_file, model=job.model, get_prediction=get_prediction, language=job.language,
+                      country=job.country, output_path=output_path, prompt_fn=job.prompt_fn,
+                      pack_size=getattr(module, "PACK_SIZE", 1), telemetry=telemetry, rows=rows)
+        if hasattr(module, "get_prediction_async"):
+            await process_file_async(concurrency=concurrency, **kwargs)
+        else:
+            await asyncio.to_thread(self._run_sync, module, job, rows, kwargs)
+        # Rows that timed out (see inference_utils.ResultSink.skip) have no record; release the lease to retry them
+        missing = len(set(lease.rows) - self.queue.lease_done_rows(lease))
+        if missing:
+            raise TimeoutError(f"{missing} rows of lease {lease.id} got no answer in time")
+
+    def _run_sync(self, module, job: Job, rows: list[int], kwargs: dict) -> None:
+        # Local backends that answer in batches (hf_inf) get the prompts of the lease ahead of process_file
+        if hasattr(module, "prefetch"):
+            parsed = load_dataset(job.tsv_file).rows(job.language, job.country)
+            prompts = [job.prompt_fn(job.language, job.country, parsed[row][0]) for row in rows]
+            module.prefetch(job.model, [prompt for prompt in prompts if make_key(
+                job.provider, job.model, prompt, module.CACHE_PARAMS) not in self.cache])
+        process_file(**kwargs)
+
+    async def _heartbeat(self, lease: Lease, run: asyncio.Task) -> bool:
+        """
+        Renews a lease while it runs; if the lease was lost, cancels the run and returns True.
+        """
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not self.queue.renew(lease, self.name):
+                print(f"[{self.name}] lost lease {lease.id} ({lease.job.name}); another worker took it over")
+                # Sync backends (see _run_sync) finish the process_file call in their thread
+                run.cancel()
+                return True
+
+    async def _slot(self) -> None:
+        while True:
+            lease = self.queue.claim(self.name)
+            if lease is None:
+                if not self.queue.leased():
+                    return
+                # Leases held by other workers expire if their worker died; wait to take them over
+                await asyncio.sleep(min(1.0, self.queue.lease_seconds / 4))
+                continue
+            run = asyncio.ensure_future(self._run_lease(lease))
+            heartbeat = asyncio.ensure_future(self._heartbeat(lease, run))
+            try:
+                await run
+            except asyncio.CancelledError:
+                if heartbeat.done() and heartbeat.result():
+                    continue
+                raise
+            except Exception as exc:
+                print(f"[{self.name}] FAILED lease {lease.id} ({lease.job.name}): {type(exc).__name__}: {exc}")
+                self.queue.release(lease, self.name, exc)
+                continue
+            finally:
+                heartbeat.cancel()
+            if self.queue.complete(lease, self.name):
+                self.completed += 1
+
+    async def run(self) -> int:
+        """
+        Runs leases until none are left; returns the number of leases this worker completed.
+        """
+        await asyncio.gather(*(self._slot() for _ in range(self.slots)))
+        for provider, (_, _, telemetry, _) in self._predictors.items():
+            if telemetry:
+                telemetry.close()
+                print(f"[{self.name}] {provider} telemetry: {telemetry.summary()}")
+        return self.completed
+
+
+def run_worker(queue_path: str, cache_path: str, lease_seconds: float, slots: int, quota_share: float,
+               telemetry_dir: str = None) -> None:
+    """
+    Entry point of a worker process.
+    """
+    queue = WorkQueue(queue_path, lease_seconds)
+    cache = ResponseCache(cache_path)
+    worker = QueueWorker(queue, cache, slots, quota_share, telemetry_dir)
+    started = time.perf_counter()
+    completed = asyncio.run(worker.run())
+    print(f"[{worker.name}] {completed} leases in {time.perf_counter() - started:.1f}s, cache: {cache.stats()}")
+    cache.close()
+    queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a CuLEmo sweep with several worker processes or hosts")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="Path of the SQLite queue file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser("init", help="Queue the pending rows of a sweep spec")
+    init_parser.add_argument("spec", help="Path of the sweep spec JSON")
+    init_parser.add_argument("--providers", nargs="*", help="Only queue jobs of these providers")
+    init_parser.add_argument("--lease-size", type=int, default=25, help="Rows per lease")
+
+    work_parser = subparsers.add_parser("work", help="Run leases until the queue is empty, then merge")
+    work_parser.add_argument("--workers", type=int, default=1, help="Worker processes to start on this host")
+    work_parser.add_argument("--slots", type=int, default=2, help="Leases each worker runs at the same time")
+    work_parser.add_argument("--lease-seconds", type=float, default=120.0,
+                             help="Seconds after which the lease of a silent worker is taken over")
+    work_parser.add_argument("--quota-share", type=float,
+                             help="Fraction of the provider quotas per worker (default: 1 / --workers; 0 disables "
+                                  "the quotas, e.g. for a local server)")
+    work_parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Path of the response cache")
+    work_parser.add_argument("--telemetry-dir", default=TELEMETRY_DIR, help="Directory of the request traces")
+    work_parser.add_argument("--no-telemetry", action="store_true", help="Do not trace requests")
+    work_parser.add_argument("--no-merge", action="store_true", help="Leave merging to `merge`")
+    work_parser.add_argument("--results-db", default=DEFAULT_RESULTS_PATH, help="Results store merged records go to")
+    work_parser.add_argument("--no-results-db", action="store_true", help="Only write the output files")
+
+    subparsers.add_parser("status", help="Show the leases of every job by state")
+    subparsers.add_parser("retry", help="Queue the failed leases again")
+
+    merge_parser = subparsers.add_parser("merge", help="Write the outputs of the finished jobs")
+    merge_parser.add_argument("--results-db", default=DEFAULT_RESULTS_PATH, help="Results store merged records go to")
+    merge_parser.add_argument("--no-results-db", action="store_true", help="Only write the output files")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    if args.command == "init":
+        jobs = expand_jobs(load_spec(args.spec))
+        if args.providers:
+            jobs = [job for job in jobs if job.provider in args.providers]
+        print(f"{queue.add_jobs(jobs, args.lease_size)} leases added to {args.queue}")
+    elif args.command == "work":
+        quota_share = args.quota_share if args.quota_share is not None else 1 / args.workers
+        telemetry_dir = None if args.no_telemetry else args.telemetry_dir
+        worker_args = (args.queue, args.cache, args.lease_seconds, args.slots, quota_share, telemetry_dir)
+        started = time.perf_counter()
+        if args.workers == 1:
+            run_worker(*worker_args)
+        else:
+            processes = [multiprocessing.Process(target=run_worker, args=worker_args) for _ in range(args.workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        print(f"{args.workers} workers finished in {time.perf_counter() - started:.1f}s")
+    elif args.command == "status":
+        for job in queue.status():
+            print(json.dumps(job))
+    elif args.command == "retry":
+        print(f"{queue.retry_failed()} failed leases queued again")
+
+    if args.command == "merge" or (args.command == "work" and not args.no_merge):
+        store = None if args.no_results_db else ResultsStore(args.results_db)
+        for output_path in queue.merge(store):
+            print(f"Merged {output_path}")
+        if store:
+            store.close()
+    queue.close()